@@ -21,6 +21,8 @@ from caffe import layers as L, params as P, to_proto
 from caffe.proto import caffe_pb2
 import os, glob, sys
 import cv2
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts_python'))
+from inference_methods import predict_files
 
 # parse command-line arguments
 parser = argparse.ArgumentParser(description='Process some input_images.')
@@ -43,6 +45,12 @@ parser.add_argument('-m','--meanimage', dest='meanimageDir', metavar='meanimageD
 parser.add_argument('-u','--uav', dest='uavDir', metavar='uavDIR', type=str,
                    help='string for UAV radargrams dir', required=True)
 
+parser.add_argument('-b','--batchsize', dest='batchSize', metavar='batchSize', type=int,
+                   help='number of images per forward pass', default=256)
+
+parser.add_argument('-t','--threads', dest='threads', metavar='threads', type=int,
+                   help='number of threads decoding images', default=4)
+
 args = parser.parse_args()
 
 # set database directories
@@ -52,6 +60,8 @@ testDir = str(args.testDir)
 caffeDir = str(args.caffeDir)
 meanimageDir = str(args.meanimageDir)
 uavDir = str(args.uavDir)
+batchSize = args.batchSize
+threads = args.threads
 
 def train(solver_txt):
     # train model normally
@@ -162,34 +172,14 @@ def val_images(net):
     print "Classifying validation images..."
 
     input_images = [ f for f in listdir("/tmp/stage5/validation") if isfile(join("/tmp/stage5/validation",f)) ]
+    image_names = ["/tmp/stage5/validation/"+str(image) for image in input_images]
 
-    mine_positive = np.zeros((1,len(input_images)))
-    classes = np.zeros((1,len(input_images)))
-
-    highest_image_name = ""
-
-    count = 0
-
-    print ""
-    for i in range(len(input_images)):
-        sys.stdout.write("\r%d%%" % np.round((count/len(input_images))*100))
-        sys.stdout.flush()
-
-        image_name = "/tmp/stage5/validation/"+str(input_images[i])
-        image = caffe.io.load_image(image_name,False)
-
-        prediction = net.predict([image], oversample=False)
-
-        # save the actual class of the image
-        if "without" in image_name:
-            classes[0,i] = 0
-        else:
-            classes[0,i] = 1
+    # save the actual class of the image
+    classes = np.array([[0 if "without" in image_name else 1 for image_name in image_names]])
 
-        # save only the score given to the positive mine class
-        mine_positive[0,i] = prediction[0][1]
-
-        count += 1
+    # batched forward passes, save only the score given to the positive mine class
+    scores = predict_files(net, image_names, batchSize, threads)
+    mine_positive = scores[:,1][np.newaxis,:]
 
     highest_image_idx = np.argmax(mine_positive[0])
     highest_image_name = "/tmp/stage5/validation/"+input_images[highest_image_idx]
@@ -299,8 +289,8 @@ def vis_square(data):
 
 def visualise_filters(net, best_image):
 
-    image = caffe.io.load_image(best_image,False)
-    prediction = net.predict([image], oversample=False)
+    # forward pass through network, leaves the activations of this image in the blobs
+    prediction = predict_files(net, [best_image], 1, 1)
 
     print ""
     print "printing layer features and shapes : "
@@ -316,10 +306,6 @@ def visualise_filters(net, best_image):
     print "showing net filters and outputs ..."
     print ""
 
-    # forward pass through network
-    image = caffe.io.load_image(best_image,False)
-    prediction = net.predict([image], oversample=False)
-
     # show parameters on first convolutional layer
     filters = net.params['conv1'][0].data
     vis_square(filters.transpose(0, 2, 3, 1))
@@ -338,11 +324,9 @@ def uav_predictions(net,uav_dir):
     print "UAV radargram class predictions :"
 
     images = [image for image in os.listdir(uav_dir)]
+    predictions = predict_files(net, [uav_dir+"/"+image for image in images], batchSize, threads)
 
-    for image in images:
-        img = caffe.io.load_image(uav_dir+"/"+image,False)
-        prediction = net.predict([img], oversample=False)
-
+    for image, prediction in zip(images, predictions):
         print image,prediction
 
     print ""
@@ -18,6 +18,8 @@ import lasagne
 import theano
 import theano.tensor as T
 sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts_python'))
+from preprocessing_methods import Preprocessor, fit_and_save, load_float32
 
 #   Usage:
 #
@@ -30,6 +32,22 @@ sys.dont_write_bytecode = True
 #     --modelType <str> this is a string to define model type: "cnn" or "mlp"
 #     -m
 #
+#     --preprocessing <str> optional, file the preprocessing statistics fitted
+#     -p                    on the training data are saved to (default
+#                           <input>/preprocessing_las.npz). Training always refits
+#                           them, --load and --resume use those of the model file
+#
+#     --save <str> optional, npz file to save the trained parameters and the
+#     -sm          preprocessing statistics to
+#
+#     --load <str> optional, npz file of saved parameters to evaluate on the test
+#     -lm          data without any training
+#
+#     --resume <str> optional, npz file of saved parameters to warm-start training
+#     -r             from. The saved preprocessing statistics are reused and the
+#                    parameters are saved back to the same file unless --save is
+#                    given
+#
 
 parser = argparse.ArgumentParser(description='Process some inputs.')
 
@@ -39,19 +57,45 @@ parser.add_argument('-i','--input', dest='dataDir', metavar='dataDir', type=str,
 parser.add_argument('-m','--modelType', dest='modelType', metavar='modelType', type=str,
                    help='string for model type', required=True)
 
+parser.add_argument('-p','--preprocessing', dest='preFile', metavar='preFile', type=str,
+                   help='string for file to save the preprocessing statistics to', default=None)
+
+parser.add_argument('-sm','--save', dest='saveFile', metavar='saveFile', type=str,
+                   help='string for file to save the trained parameters to', default=None)
+
+parser.add_argument('-lm','--load', dest='loadFile', metavar='loadFile', type=str,
+                   help='string for saved parameter file to evaluate', default=None)
+
+parser.add_argument('-r','--resume', dest='resumeFile', metavar='resumeFile', type=str,
+                   help='string for saved parameter file to warm-start from', default=None)
+
 args = parser.parse_args()
 
 dataDir = str(args.dataDir)
 modelType = str(args.modelType)
+preFile = args.preFile or dataDir+"/preprocessing_las.npz"
+modelFile = args.loadFile or args.resumeFile
+saveFile = args.saveFile or args.resumeFile
+
+if args.loadFile and args.resumeFile:
+    raise ValueError('use only one of --load and --resume')
+
+# parameters and preprocessing statistics of a saved model
+state = None
+if modelFile is not None:
+    print "Loading model from "+modelFile+" ..."
+    state = np.load(modelFile)
+    if str(state["model_type"]) != modelType:
+        raise ValueError(modelFile+' holds a '+str(state["model_type"])+' model')
 
 #######################################################################
 # 1: load up data
 #######################################################################
 
 print "Loading data ..."
-X_train = np.load(dataDir+"/X_train.npy")
+X_train = load_float32(dataDir+"/X_train.npy")
 Y_train = np.load(dataDir+"/Y_train.npy")
-X_test = np.load(dataDir+"/X_test.npy")
+X_test = load_float32(dataDir+"/X_test.npy")
 Y_test = np.load(dataDir+"/Y_test.npy")
 Y_train = Y_train.T
 Y_test = Y_test.T
@@ -60,30 +104,15 @@ Y_test = Y_test.T
 # 2: preprocessing
 ######################################################
 
-# subtract mean image from every image
-def zero_meaning(X_train, X_test):
-    print "Mean subtraction ..."
-    mean_image = np.mean(X_train,axis=2)
+if state is not None:
+    preprocessor = Preprocessor().set_state(state)
+else:
+    preprocessor = fit_and_save(preFile, X_train)
 
-    return X_train - mean_image[:,:,np.newaxis], X_test - mean_image[:,:,np.newaxis], mean_image
-
-X_train, X_test, mean = zero_meaning(X_train, X_test)
-
-# normalise data to interval [0 1]
-def normaliser(*arg):
-    print "Normalising "+arg[1]+" data to range [0 1] ..."
-    data = arg[0]
-    if len(arg) > 2:
-        min_val = arg[2]
-        max_val = arg[3]
-    else:
-        min_val = np.amin(data)
-        max_val = np.amax(data)
-
-    return np.divide((data-min_val),(max_val-min_val)), min_val, max_val
-
-X_train, min_val, max_val = normaliser(X_train, "train")
-X_test, min_val, max_val = normaliser(X_test, "test", min_val, max_val)
+# subtract mean image from every image and normalise data to interval [0 1]
+print "Mean subtraction and normalising ..."
+X_train = preprocessor.transform(X_train)
+X_test = preprocessor.transform(X_test)
 
 # create negative of data? (just testing at present)
 def negative(data):
@@ -100,7 +129,7 @@ def negative(data):
 def resize(data, (new_height, new_width)):
     # if 3D array, resize each one individually, else just resize 2D array
     if len(data.shape) > 2:
-        new_array = np.zeros((new_height, new_width, data.shape[2]))
+        new_array = np.zeros((new_height, new_width, data.shape[2]), dtype=data.dtype)
         for i in range(data.shape[2]):
             new_array[:,:,i] = cv2.resize(data[:,:,i], (new_height,new_width), interpolation=3)
 
@@ -175,6 +204,8 @@ plot_example()
 gc.collect()
 
 num_epochs = 50
+if args.loadFile:
+    num_epochs = 0
 learning_rate = 0.00000001
 batch_size = int(np.round(0.1*X_train.shape[2]))
 
@@ -269,6 +300,19 @@ def plotgraphs(training_error, validation_error, validation_accuracy):
 
     plt.show()
 
+def save_params(filename, network, preprocessor):
+    # all network parameters plus the preprocessing statistics in one npz file
+    params = lasagne.layers.get_all_param_values(network)
+    state = dict(("param_%d" % i, param) for i, param in enumerate(params))
+    state.update(preprocessor.get_state())
+    state["model_type"] = np.array(modelType)
+
+    np.savez_compressed(filename, **state)
+
+def load_params(state, network):
+    n_params = len(lasagne.layers.get_all_params(network))
+    lasagne.layers.set_all_param_values(network, [state["param_%d" % i] for i in range(n_params)])
+
 def run_net(X_train, y_train, X_test, y_test, model=modelType, num_epochs=num_epochs):
     # Load the dataset
     training_error = []
@@ -316,6 +360,10 @@ def run_net(X_train, y_train, X_test, y_test, model=modelType, num_epochs=num_ep
     else:
         print("Unrecognized model type %r." % model)
 
+    # warm-start from saved parameters
+    if state is not None:
+        load_params(state, network)
+
     # Create a loss expression for training
     prediction = lasagne.layers.get_output(network)
     loss = lasagne.objectives.categorical_crossentropy(prediction, target_var)
@@ -410,7 +458,12 @@ def run_net(X_train, y_train, X_test, y_test, model=modelType, num_epochs=num_ep
 
     print confusion_matrix(y_test, y_predictions)
 
-    plotgraphs(training_error, validation_error, validation_accuracy)
+    if saveFile is not None and num_epochs > 0:
+        print "Saving model to "+saveFile+" ..."
+        save_params(saveFile, network, preprocessor)
+
+    if num_epochs > 0:
+        plotgraphs(training_error, validation_error, validation_accuracy)
 
 # run the net
 run_net(X_train, Y_train, X_test, Y_test)
@@ -10,15 +10,19 @@ from numpy import genfromtxt
 import numpy as np
 import os, sys, time
 import argparse
-from sklearn.metrics import confusion_matrix
+from sklearn.metrics import confusion_matrix, log_loss
 from sklearn.cross_validation import StratifiedShuffleSplit
 from sklearn import preprocessing, svm, grid_search
 from sklearn.grid_search import GridSearchCV
 from sklearn.svm import SVC
 from scipy.misc import imresize
 sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts_python'))
 from loading_methods import load_data, windows, resize
-from preprocessing_methods import zero_meaning, normaliser, standardiser
+from preprocessing_methods import Preprocessor, fit_and_save, load_float32
+from svm_methods import to_memmap, approx_svm_fit, approx_svm_predict, exact_svm_fit, benchmark_svm
+from svm_methods import successive_halving, save_svm, load_svm
+from hyperbola_methods import hyperbola_features
 import matplotlib.pyplot as plt
 
 #   Usage:
@@ -32,6 +36,64 @@ import matplotlib.pyplot as plt
 #     --dataType <str> this is the string to define datatype: "windows" or "radargrams"
 #     -d
 #
+#     --solver <str> optional, "exact" for the kernel SVC (default) or "approx" for
+#     -s             the out-of-core kernel approximation, needed for >10^5 windows
+#
+#     --kernelmap <str> optional, kernel approximation for "approx": "rff" (default)
+#     -k                or "nystroem"
+#
+#     --components <int> optional, number of kernel approximation features (2000)
+#     -nc
+#
+#     --chunksize <int> optional, samples held in memory at once by "approx" and
+#     -cs               --search (10000). These load X_train.npy and X_test.npy as
+#                       memory maps and preprocess them chunk by chunk straight
+#                       in to <input>/X_train_svm.npy and X_test_svm.npy
+#
+#     --benchmark optional flag, time the exact SVC against "approx" on growing
+#     -b          subsets of the training data instead of fitting a single model
+#
+#     --search optional flag, pick C and gamma by a parallel successive halving
+#     -sh      search before the final fit. Results are appended to --searchfile
+#              and a rerun with the same file resumes where the last one stopped,
+#              unless the data, solver or features have changed since, which
+#              starts the file again
+#
+#     --searchfile <str> optional, search results file (default <input>/svm_search.json)
+#     -sf
+#
+#     --jobs <int> optional, number of search worker processes (default all cores)
+#     -j
+#
+#     --preprocessing <str> optional, file the preprocessing statistics fitted
+#     -p                    on the training data are saved to (default
+#                           <input>/preprocessing_svm.npz). Training always refits
+#                           them, --load and --resume use those of the model file
+#
+#     --save <str> optional, npz file to save the trained model and its
+#     -sm          preprocessing statistics to
+#
+#     --load <str> optional, npz file of a saved model to evaluate on the test
+#     -lm          data without any training
+#
+#     --resume <str> optional, npz file of a saved model to warm-start from. The
+#     -r             approximate SVM continues training from its saved weights and
+#                    the exact SVM is refitted on those of its saved support
+#                    vectors not already in the training data plus the training
+#                    data. The model keeps its saved solver, C, gamma
+#                    and preprocessing, and is saved back to the same file unless
+#                    --save is given
+#
+#     --features <str> optional, "pixels" (default) to classify the resized image
+#     -f               pixels or "hyperbola" to classify pooled Hough hyperbola
+#                      accumulator scores. A saved model keeps its own features
+#
+#     --tracestep <float> optional, metres between the traces (columns) of the
+#     -ts                 data, used by the hyperbola features (0.02)
+#
+#     --timewindow <float> optional, seconds spanned by the rows of the data,
+#     -tw                  used by the hyperbola features (16e-9)
+#
 
 parser = argparse.ArgumentParser(description='Process some inputs.')
 
@@ -41,10 +103,85 @@ parser.add_argument('-i','--input', dest='dataDir', metavar='dataDir', type=str,
 parser.add_argument('-d','--datatype', dest='dataType', metavar='dataType', type=str,
                    help='string for data type', required=True)
 
+parser.add_argument('-s','--solver', dest='solver', metavar='solver', type=str,
+                   help='string for solver: exact or approx', default="exact")
+
+parser.add_argument('-k','--kernelmap', dest='kernelMap', metavar='kernelMap', type=str,
+                   help='string for kernel approximation: rff or nystroem', default="rff")
+
+parser.add_argument('-nc','--components', dest='components', metavar='components', type=int,
+                   help='number of kernel approximation features', default=2000)
+
+parser.add_argument('-cs','--chunksize', dest='chunkSize', metavar='chunkSize', type=int,
+                   help='number of samples held in memory at once', default=10000)
+
+parser.add_argument('-b','--benchmark', dest='benchmark', action='store_true',
+                   help='benchmark exact SVC against the kernel approximation')
+
+parser.add_argument('-sh','--search', dest='search', action='store_true',
+                   help='successive halving search over C and gamma')
+
+parser.add_argument('-sf','--searchfile', dest='searchFile', metavar='searchFile', type=str,
+                   help='string for search results file', default=None)
+
+parser.add_argument('-j','--jobs', dest='jobs', metavar='jobs', type=int,
+                   help='number of search worker processes', default=None)
+
+parser.add_argument('-p','--preprocessing', dest='preFile', metavar='preFile', type=str,
+                   help='string for file to save the preprocessing statistics to', default=None)
+
+parser.add_argument('-sm','--save', dest='saveFile', metavar='saveFile', type=str,
+                   help='string for file to save the trained model to', default=None)
+
+parser.add_argument('-lm','--load', dest='loadFile', metavar='loadFile', type=str,
+                   help='string for saved model file to evaluate', default=None)
+
+parser.add_argument('-r','--resume', dest='resumeFile', metavar='resumeFile', type=str,
+                   help='string for saved model file to warm-start from', default=None)
+
+parser.add_argument('-f','--features', dest='features', metavar='features', type=str,
+                   help='string for features: pixels or hyperbola', default="pixels")
+
+parser.add_argument('-ts','--tracestep', dest='traceStep', metavar='traceStep', type=float,
+                   help='metres between traces', default=0.02)
+
+parser.add_argument('-tw','--timewindow', dest='timeWindow', metavar='timeWindow', type=float,
+                   help='seconds spanned by the rows', default=16e-9)
+
 args = parser.parse_args()
 
 dataDir = str(args.dataDir)
 dataType = str(args.dataType)
+solver = str(args.solver)
+kernelMap = str(args.kernelMap)
+components = args.components
+chunkSize = args.chunkSize
+searchFile = args.searchFile or dataDir+"/svm_search.json"
+preFile = args.preFile or dataDir+"/preprocessing_svm.npz"
+modelFile = args.loadFile or args.resumeFile
+saveFile = args.saveFile or args.resumeFile
+features = str(args.features)
+
+if solver not in ("exact", "approx"):
+    raise ValueError('solver must be "exact" or "approx"')
+
+if features not in ("pixels", "hyperbola"):
+    raise ValueError('features must be "pixels" or "hyperbola"')
+
+if args.loadFile and args.resumeFile:
+    raise ValueError('use only one of --load and --resume')
+
+# a saved model brings its own solver, C, gamma and preprocessing statistics
+C = 1
+gamma = 1
+init = None
+
+if modelFile is not None:
+    print "Loading model from "+modelFile+" ..."
+    init, C, gamma, state = load_svm(modelFile)
+    solver = str(state["solver"])
+    if "features" in state:
+        features = str(state["features"])
 
 #######################################################################
 # 1: load up data, resize if not windows.
@@ -55,11 +192,19 @@ if dataType=="windows":
 else:
     new_size = (32, 32)
 
+# the out-of-core paths read the images through memory maps and preprocess
+# them chunk by chunk, everything else loads them whole
+out_of_core = args.search or solver == "approx"
+
 print "Loading data ..."
 if os.path.isfile(dataDir+"/X_train.npy"):
-    X_train = np.load(dataDir+"/X_train.npy")
+    if out_of_core:
+        X_train = np.load(dataDir+"/X_train.npy", mmap_mode='r')
+        X_test = np.load(dataDir+"/X_test.npy", mmap_mode='r')
+    else:
+        X_train = load_float32(dataDir+"/X_train.npy")
+        X_test = load_float32(dataDir+"/X_test.npy")
     Y_train = np.load(dataDir+"/Y_train.npy")
-    X_test = np.load(dataDir+"/X_test.npy")
     Y_test = np.load(dataDir+"/Y_test.npy")
     Y_train = Y_train.T
     Y_test = Y_test.T
@@ -74,41 +219,37 @@ else:
 # histogram eqaulisation
 # normalisation
 
-print "Mean subtraction ..."
-
-X_train, X_test, mean = zero_meaning(X_train, X_test)
-
-X_train, val1, val2 = normaliser(X_train, "train")
-X_test, val1, val2 = normaliser(X_test, "test", val1, val2)
+if modelFile is not None:
+    preprocessor = Preprocessor().set_state(state)
+else:
+    preprocessor = fit_and_save(preFile, X_train)
 
-X_train = X_train.astype(np.float32)
-X_test = X_test.astype(np.float32)
 Y_train = Y_train.astype(np.uint8)
 Y_test = Y_test.astype(np.uint8)
-print "Resizing ..."
-
-new_size = (32,32)
-X_train = resize(X_train, new_size)
-X_test = resize(X_test, new_size)
-
-def plot_example():
-    print "plotting example ..."
-    clean_idx = np.where(Y_train==0)
-    mine_idx = np.where(Y_train==1)
 
-    conv = np.hstack((X_train[:,:,clean_idx[0][i]],X_train[:,:,mine_idx[0][i]]))
-    plt.imshow(conv, cmap='gray')
-    plt.show()
+# columns are traces and the rows span the time window
+dt = args.timeWindow / X_train.shape[0]
 
-# plot_example()
+def svm_rows(images):
+    # (samples, features) rows of a float32 (height, width, n) stack: mean
+    # subtraction and normalising, then hyperbola features or resized pixels
+    images = preprocessor.transform(images)
+    if features == "hyperbola":
+        return hyperbola_features(images, args.traceStep, dt)
 
-print "Reshape for SVM ..."
+    images = resize(images, (32,32))
+    return np.reshape(images, (images.shape[0]*images.shape[1],images.shape[2])).T
 
-X_train = np.reshape(X_train, (X_train.shape[0]*X_train.shape[1],X_train.shape[2]))
-X_train = X_train.T
+print "Mean subtraction, normalising and "+("hyperbola features" if features == "hyperbola" else "resizing")+" ..."
 
-X_test = np.reshape(X_test, (X_test.shape[0]*X_test.shape[1],X_test.shape[2]))
-X_test = X_test.T
+if out_of_core:
+    # preprocessed features are written once and memory mapped from here on
+    X_train = to_memmap(X_train, svm_rows, dataDir+"/X_train_svm.npy", chunkSize)
+    X_test = to_memmap(X_test, svm_rows, dataDir+"/X_test_svm.npy", chunkSize)
+    np.save(dataDir+"/Y_train_svm.npy", Y_train)
+else:
+    X_train = svm_rows(X_train)
+    X_test = svm_rows(X_test)
 
 print "Training X shape : "+str(X_train.shape)
 print "Training Y shape : "+str(Y_train.shape)
@@ -128,24 +269,48 @@ print ""
 
 print "Build model ..."
 
-# C_range = np.logspace(-2, 10, 13)
-# gamma_range = np.logspace(-9, 3, 13)
-# param_grid = dict(gamma=gamma_range, C=C_range)
-# cv = StratifiedShuffleSplit(Y_train, n_iter=5, test_size=0.2, random_state=42)
-# grid = GridSearchCV(SVC(), param_grid=param_grid, cv=cv)
-# grid.fit(X_train, Y_train)
+if args.search:
+    print "Successive halving search ..."
+    C_range = np.logspace(-2, 10, 13)
+    gamma_range = np.logspace(-9, 3, 13)
+    best, results = successive_halving(dataDir+"/X_train_svm.npy", dataDir+"/Y_train_svm.npy",
+                                       C_range, gamma_range, searchFile, n_jobs=args.jobs,
+                                       solver=solver, features=features)
+    C = best["C"]
+    gamma = best["gamma"]
+
+    print("The best parameters are C=%g, gamma=%g with a score of %0.2f on %d samples"
+          % (C, gamma, best["score"], best["samples"]))
+
+if args.benchmark:
+    sizes = [1000, 10000, 100000, 1000000]
+    benchmark_svm(X_train, Y_train, X_test, Y_test, sizes, gamma=gamma, C=C, method=kernelMap,
+                  n_components=components, chunk_size=chunkSize)
+
+else:
+    if args.loadFile:
+        model = init
 
-# print("The best parameters are %s with a score of %0.2f"
-#       % (grid.best_params_, grid.best_score_))
+    elif solver == "approx":
+        model = approx_svm_fit(X_train, Y_train, gamma=gamma, C=C, method=kernelMap,
+                               n_components=components, chunk_size=chunkSize, init=init)
 
-clf = svm.SVC(kernel='rbf', gamma=1, C=1, probability=True)
-# clf = svm.SVC(probability=True)
+    else:
+        model = exact_svm_fit(X_train, Y_train, gamma=gamma, C=C, init=init)
 
-clf.fit(X_train, Y_train)
+    if solver == "approx":
+        Y_predict, Y_probability = approx_svm_predict(model, X_test, chunkSize)
+    else:
+        Y_predict = model.predict(X_test)
+        Y_probability = model.predict_proba(X_test)[:,1]
 
-Y_predict = clf.predict(X_test)
+    print confusion_matrix(Y_test, Y_predict)
+    # how well the mine probabilities are calibrated, not only the classes
+    print "Log loss of the mine probabilities: %.4f" % log_loss(Y_test, np.column_stack((1 - Y_probability, Y_probability)))
 
-print confusion_matrix(Y_test, Y_predict)
+    if saveFile is not None and not args.loadFile:
+        print "Saving model to "+saveFile+" ..."
+        save_svm(saveFile, model, C, gamma, preprocessor, features)
 
 
 #
@@ -0,0 +1,103 @@
+#!/bin/bash
+
+#########################################################################################
+# Pipeline to simulate, merge and process gpr data with the stages overlapping
+#
+# Each stage is a scripts_python/stream-worker.py watching $STAGE1_OUTPUT_DIR. A scene
+# is checked by validate-scenes.py as soon as gpr-gen-new.py has written it, simulated
+# as soon as it has passed and left its .valid marker, merged as soon as its simulation
+# leaves its .simulated marker and post processed as soon as its merged B-scan has its
+# .done marker, so the simulations start while scenes are still being generated and the
+# post processing keeps pace with the simulations instead of waiting for all of them. Each worker writes a .finished
+# marker when it is done, which tells the next one to stop once it has caught up. Running
+# it again on the same directory carries on where it stopped. Set ROOT_DIR, FILES,
+# RECEIVERS, SIM_JOBS, POST_JOBS or PYTHON2 to change the defaults, e.g.
+#
+#   ROOT_DIR=/data/run2 POST_JOBS=4 ./pipeline-stream.sh
+#########################################################################################
+
+# Path names
+export GPRMAX_HOME=$(pwd)
+export GPRMAX=$(pwd)/gprMax
+export PYTHON_SCRIPTS=$(pwd)/scripts_python
+
+# every stage appends its time, memory and I/O to the trace,
+# summarise it with scripts_python/trace-summary.py
+export GPR_TRACE=${GPR_TRACE:-$(pwd)/trace.jsonl}
+export WORKER="python $PYTHON_SCRIPTS/stream-worker.py"
+
+export ROOT_DIR=${ROOT_DIR:-$(pwd)/data}
+export STAGE1_OUTPUT_DIR=$ROOT_DIR/stage1
+export STAGE3_OUTPUT_DIR=$ROOT_DIR/stage3
+mkdir -p $STAGE1_OUTPUT_DIR $STAGE3_OUTPUT_DIR
+
+export number_iters=95
+FILES=${FILES:-200}
+# receivers per scene, each gives its own radargram
+RECEIVERS=${RECEIVERS:-1}
+SIM_JOBS=${SIM_JOBS:-1}
+POST_JOBS=${POST_JOBS:-2}
+
+# gpr-gen-new.py and trace-summary.py are python 2, keep the interpreter from before py3k
+PYTHON2=${PYTHON2:-$(command -v python)}
+
+source py3k/bin/activate
+
+# recalibrate the simulation cost model on the runs recorded so far
+if [ -f $GPR_TRACE ]; then
+    python $PYTHON_SCRIPTS/simulation-cost.py -i $STAGE1_OUTPUT_DIR -m $ROOT_DIR/cost-model.json \
+        --calibrate $GPR_TRACE > /dev/null
+fi
+
+echo "###"
+echo "Starting stage workers"
+echo "###"
+
+# a scene is taken once it has stopped changing, those that pass or are repaired go on
+# to the simulations and the others are set aside
+$WORKER -s validate -i "$STAGE1_OUTPUT_DIR/*.in" -r "" \
+    -c "$PYTHON2 $PYTHON_SCRIPTS/validate-scenes.py -i {input} -n $number_iters --repair --reject $ROOT_DIR/rejected -m {dir}/{stem}.valid" \
+    --end $STAGE1_OUTPUT_DIR/generate.finished --finish $STAGE1_OUTPUT_DIR/validate.finished &
+
+$WORKER -s simulate -i "$STAGE1_OUTPUT_DIR/*.in" -r "{dir}/{stem}.valid" -j $SIM_JOBS --cwd $GPRMAX \
+    --longest-first --cost-model $ROOT_DIR/cost-model.json --reject-status 3 \
+    -c "python3 $PYTHON_SCRIPTS/simulation-watchdog.py -i {input} -n $number_iters -- python3 -m gprMax {input} -n $number_iters -gpu" \
+    -m "{dir}/{stem}.simulated" \
+    --end $STAGE1_OUTPUT_DIR/validate.finished --finish $STAGE1_OUTPUT_DIR/simulate.finished &
+
+$WORKER -s merge -i "$STAGE1_OUTPUT_DIR/*.in" -r "{dir}/{stem}.simulated" --cwd $GPRMAX \
+    -c "python3 -m tools.outputfiles_merge {dir}/{stem} $number_iters" \
+    -m "{dir}/{stem}_merged.out.done" \
+    --end $STAGE1_OUTPUT_DIR/simulate.finished --finish $STAGE1_OUTPUT_DIR/merge.finished &
+
+$WORKER -s post_process -i "$STAGE1_OUTPUT_DIR/*_merged.out" -j $POST_JOBS --cwd $PYTHON_SCRIPTS \
+    -c "python post_process.py {input} Ez $STAGE3_OUTPUT_DIR n" \
+    --end $STAGE1_OUTPUT_DIR/merge.finished --finish $STAGE1_OUTPUT_DIR/post_process.finished &
+
+#########################################################################################
+# Generate random sample data, once
+#########################################################################################
+
+if [ ! -f $STAGE1_OUTPUT_DIR/generate.finished ]; then
+    echo "###"
+    echo "Creating gpr files"
+    echo "###"
+    python $PYTHON_SCRIPTS/trace-run.py -s generate -- $PYTHON2 $PYTHON_SCRIPTS/gpr-gen-new.py -n with -f 0.5 -w $FILES \
+        -o $STAGE1_OUTPUT_DIR -mt anti_tank -r n -rx $RECEIVERS
+    GENERATED=$?
+    # the workers finish what was generated either way, a failed generation runs again next time
+    touch $STAGE1_OUTPUT_DIR/generate.finished
+    python $PYTHON_SCRIPTS/simulation-cost.py -i $STAGE1_OUTPUT_DIR -m $ROOT_DIR/cost-model.json -n $number_iters \
+        -j $SIM_JOBS | tail -n 1
+    wait
+    [ $GENERATED -ne 0 ] && rm $STAGE1_OUTPUT_DIR/generate.finished
+fi
+
+wait
+
+echo "Data generation complete"
+echo "###"
+
+$PYTHON2 $PYTHON_SCRIPTS/trace-summary.py -i $GPR_TRACE
+
+deactivate
@@ -2,7 +2,8 @@
 # Create the imagenet lmdb inputs
 # N.B. set the path to the gprnet train + val data dirs
 
-DATA_DIR=/tmp/stage5
+# data directory is an optional second argument
+DATA_DIR=${2:-/tmp/stage5}
 TRAIN_DATA_ROOT=$DATA_DIR/train
 VAL_DATA_ROOT=$DATA_DIR/validation
 TEST_DATA_ROOT=$DATA_DIR/test
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+################################################################################
+# benchmark-inference.py
+#
+# Times the mine classifier on synthetic radargrams. Windows are classified in
+# calls of one batch each over a sweep of window sizes, batch sizes and thread
+# counts, and whole radargrams are localised with sliding windows over a sweep
+# of radargram sizes. Throughput and p50/p95/p99 latency of every case are
+# written as JSON and can be checked against a stored baseline, the exit
+# status is 1 if any case is slower than the baseline by more than the
+# tolerance.
+################################################################################
+
+from __future__ import division
+import argparse
+import numpy as np
+import os, sys, time
+from benchmark_methods import synthetic_radargram, latency_summary, peak_rss_mb, timed, meta, \
+    save_results, report_regressions
+from localise_methods import extract_windows
+
+#   Usage:
+#
+#     benchmark-inference.py --deploy <str> --weights <str> -o <str>
+#
+#   where
+#     --deploy <str> caffe model definition and trained weights, as used by
+#     --weights      model-caffe.py and localise.py
+#
+#     --engine <str> optional, "caffe" (default), "numpy" or "int8" as in
+#     -e             localise.py, or "server" to time inference-server.py
+#
+#     --quantized <str> optional, int8 engine, input scales saved by
+#                       quantize-net.py
+#
+#     --server <str> optional, server engine, host:port or Unix socket
+#
+#     --batch_sizes <str> optional, comma separated batch sizes ("1,16,64,256")
+#     -b
+#
+#     --threads <str> optional, comma separated thread counts ("1,2,4")
+#     -th
+#
+#     --sizes <str> optional, comma separated window sizes in pixels, the
+#     -s            classifier resizes windows to its input ("64,128")
+#
+#     --windows <int> optional, windows classified per case (512)
+#     -n
+#
+#     --radargrams <str> optional, comma separated heightxwidth radargram
+#     -r                 sizes to localise ("500x1000,1000x2000"), "" for none
+#
+#     --repeats <int> optional, times each radargram is localised (3)
+#
+#     --output <str> optional, json file for the results ("-" for stdout)
+#     -o
+#
+#     --baseline <str> optional, json results to compare against
+#
+#     --tolerance <float> optional, allowed slow down against the baseline (0.1)
+#
+
+parser = argparse.ArgumentParser(description='benchmark the mine classifier')
+
+parser.add_argument('--deploy', dest='model_deploy', default='/home/pwhc/skycap/gprlearn/models/caffe_files/deploy.prototxt', action='store', help='caffe model definition file')
+
+parser.add_argument('--weights', dest='pre_trained', default='/home/pwhc/skycap/Results/Fifth_Model/stage5/saved_models/snapshot_iter_140.caffemodel', action='store', help='caffe trained weights file')
+
+parser.add_argument('-e', '--engine', dest='engine', default='caffe', action='store', help='"caffe", "numpy", "int8" or "server"')
+
+parser.add_argument('--quantized', dest='quantized', default=None, action='store', help='int8 engine, input scales saved by quantize-net.py')
+
+parser.add_argument('--server', dest='server', default='127.0.0.1:8765', action='store', help='server engine, host:port or Unix socket of inference-server.py')
+
+parser.add_argument('--caffe_root', dest='caffe_root', default=os.environ.get('CAFFE_ROOT', '/home/pwhc/skycap/deep-learning/caffe/'), action='store', help='caffe build directory, defaults to $CAFFE_ROOT')
+
+parser.add_argument('-b', '--batch_sizes', dest='batch_sizes', default='1,16,64,256', action='store', help='comma separated batch sizes')
+
+parser.add_argument('-th', '--threads', dest='threads', default='1,2,4', action='store', help='comma separated thread counts')
+
+parser.add_argument('-s', '--sizes', dest='sizes', default='64,128', action='store', help='comma separated window sizes')
+
+parser.add_argument('-n', '--windows', dest='windows', default=512, type=int, action='store', help='windows classified per case')
+
+parser.add_argument('-r', '--radargrams', dest='radargrams', default='500x1000,1000x2000', action='store', help='comma separated heightxwidth radargram sizes')
+
+parser.add_argument('--repeats', dest='repeats', default=3, type=int, action='store', help='times each radargram is localised')
+
+parser.add_argument('-o', '--output', dest='output', default='-', action='store', help='json file for the results')
+
+parser.add_argument('--baseline', dest='baseline', default=None, action='store', help='json results to compare against')
+
+parser.add_argument('--tolerance', dest='tolerance', default=0.1, type=float, action='store', help='allowed slow down against the baseline')
+
+args = parser.parse_args()
+
+if args.engine not in ('caffe', 'numpy', 'int8', 'server'):
+    raise ValueError('engine must be "caffe", "numpy", "int8" or "server"')
+
+if args.engine == 'int8' and args.quantized is None:
+    raise ValueError('the int8 engine needs the scales saved by quantize-net.py, --quantized')
+
+start = time.time()
+if args.engine == 'caffe':
+    sys.path.insert(0, os.path.join(args.caffe_root, 'python'))
+    import caffe
+    from inference_methods import predict_images
+    caffe.set_mode_cpu()
+    net = caffe.Classifier(args.model_deploy, args.pre_trained, raw_scale = 255)
+    predict = lambda windows, batch_size, threads: predict_images(net, windows, batch_size, threads)
+elif args.engine == 'numpy':
+    from numpy_net_methods import NumpyClassifier
+    net = NumpyClassifier(args.model_deploy, args.pre_trained, raw_scale = 255)
+    predict = lambda windows, batch_size, threads: net.predict(windows, batch_size, threads)
+elif args.engine == 'int8':
+    from quantize_methods import QuantizedClassifier
+    net = QuantizedClassifier(args.model_deploy, args.pre_trained, scales = args.quantized, raw_scale = 255)
+    predict = lambda windows, batch_size, threads: net.predict(windows, batch_size, threads)
+else:
+    # batching and threads are the server's own, only the calls are timed here
+    from server_methods import InferenceClient
+    client = InferenceClient(args.server)
+    predict = lambda windows, batch_size, threads: client.classify(windows)
+load_time = time.time() - start
+
+print >> sys.stderr, "Loaded the %s engine in %.2f s" % (args.engine, load_time)
+
+rng = np.random.RandomState(0)
+cases = {}
+
+def windows_of(size, n):
+    # n windows cut from synthetic radargrams, as localise.py sees them
+    image = synthetic_radargram(1000, 2000, rng=rng)[:,:,np.newaxis]
+    windows, _, _ = extract_windows(image, size // 2, size, size)
+
+    return windows[rng.randint(0, len(windows), n)]
+
+for size in [int(s) for s in args.sizes.split(',')]:
+    windows = windows_of(size, args.windows)
+    for threads in [int(t) for t in args.threads.split(',')]:
+        for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+            # one warm up call, then the windows in calls of batch_size
+            predict(windows[:batch_size], batch_size, threads)
+            times = []
+            for offset in range(0, len(windows), batch_size):
+                times.extend(timed(lambda: predict(windows[offset:offset + batch_size], batch_size, threads)))
+
+            name = "classify/size%d/batch%d/threads%d" % (size, batch_size, threads)
+            cases[name] = latency_summary(times)
+            cases[name]["windows_per_s"] = len(windows) / sum(times)
+            print >> sys.stderr, "%-36s %8.1f windows/s  p50 %8.1f ms  p99 %8.1f ms" % (
+                name, cases[name]["windows_per_s"], cases[name]["p50_ms"], cases[name]["p99_ms"])
+
+for shape in [r for r in args.radargrams.split(',') if r != '']:
+    height, width = [int(d) for d in shape.split('x')]
+    image = synthetic_radargram(height, width, rng=rng)[:,:,np.newaxis]
+    for threads in [int(t) for t in args.threads.split(',')]:
+        # sliding windows as localise.py, 128 pixel windows 64 apart
+        def localise():
+            windows, _, _ = extract_windows(image, 64, 128, 128)
+            predict(windows, 256, threads)
+            return len(windows)
+        n_windows = localise()
+        times = timed(localise, args.repeats)
+
+        name = "localise/%s/threads%d" % (shape, threads)
+        cases[name] = latency_summary(times)
+        cases[name]["radargrams_per_s"] = len(times) / sum(times)
+        cases[name]["windows_per_s"] = n_windows * len(times) / sum(times)
+        print >> sys.stderr, "%-36s %8.2f radargrams/s  %8.1f windows/s" % (
+            name, cases[name]["radargrams_per_s"], cases[name]["windows_per_s"])
+
+results = {"meta": meta(engine=args.engine, deploy=args.model_deploy, weights=args.pre_trained,
+                        load_s=load_time, peak_rss_mb=peak_rss_mb()),
+           "cases": cases}
+save_results(args.output, results)
+
+if args.baseline is not None and not report_regressions(results, args.baseline, args.tolerance):
+    sys.exit(1)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+################################################################################
+# benchmark-pipeline.py
+#
+# Times the data stages of the pipeline on synthetic inputs, so that it runs
+# offline without gprMax or caffe. Merged .out B-scans, .csv radargrams with
+# their mine positions and .png radargrams are fabricated at the requested
+# scale, then every stage is run as the shell pipelines run it, as its own
+# process, and timed:
+#
+#   generate      gpr-gen-new.py writing .in files
+#   post_process  post_process.py on each .out file
+#   process_data  process-data.py on the .csv files
+#   load_data     loading_methods.load_data and windows on the .csv files
+#   split_files   train-test-split-files.py on the .png files
+#   split_caffe   train-test-split-caffe.py on the .png files
+#
+# Each stage reports files/s, MB/s of the data it reads (of the .in files it
+# writes for generate), wall and cpu seconds and the peak resident memory of
+# its processes, as JSON. A stage that fails, for example on a missing module,
+# is reported with its error and does not stop the others. With --baseline the
+# exit status is 1 if any stage regressed.
+################################################################################
+
+from __future__ import division
+import argparse
+import numpy as np
+import os, sys, shutil, tempfile
+import h5py
+import cv2
+from benchmark_methods import synthetic_radargram, run_measured, meta, save_results, report_regressions
+
+#   Usage:
+#
+#     benchmark-pipeline.py -o <str>
+#
+#   where
+#     --files <int> optional, number of files of each dataset (20)
+#     -n
+#
+#     --samples <int> optional, time samples of each B-scan (3400, 16 ns at
+#     -sa             the time step of a 2 mm grid)
+#
+#     --traces <int> optional, traces of each B-scan (95)
+#     -tr
+#
+#     --stages <str> optional, comma separated stages to run (all)
+#     -st
+#
+#     --workdir <str> optional, directory for the synthetic datasets, a
+#     -w              temporary directory that is removed afterwards by default
+#
+#     --output <str> optional, json file for the results ("-" for stdout)
+#     -o
+#
+#     --baseline <str> optional, json results to compare against
+#
+#     --tolerance <float> optional, allowed slow down against the baseline (0.2)
+#
+
+STAGES = ["generate", "post_process", "process_data", "load_data", "split_files", "split_caffe"]
+
+parser = argparse.ArgumentParser(description='benchmark the data pipeline on synthetic inputs')
+
+parser.add_argument('-n', '--files', dest='files', default=20, type=int, action='store', help='number of files of each dataset')
+
+parser.add_argument('-sa', '--samples', dest='samples', default=3400, type=int, action='store', help='time samples of each B-scan')
+
+parser.add_argument('-tr', '--traces', dest='traces', default=95, type=int, action='store', help='traces of each B-scan')
+
+parser.add_argument('-st', '--stages', dest='stages', default=",".join(STAGES), action='store', help='comma separated stages to run')
+
+parser.add_argument('-w', '--workdir', dest='workdir', default=None, action='store', help='directory for the synthetic datasets')
+
+parser.add_argument('-o', '--output', dest='output', default='-', action='store', help='json file for the results')
+
+parser.add_argument('--baseline', dest='baseline', default=None, action='store', help='json results to compare against')
+
+parser.add_argument('--tolerance', dest='tolerance', default=0.2, type=float, action='store', help='allowed slow down against the baseline')
+
+args = parser.parse_args()
+
+stages = args.stages.split(',')
+for stage in stages:
+    if stage not in STAGES:
+        raise ValueError('unknown stage ' + stage + ', stages are ' + ", ".join(STAGES))
+
+scripts = os.path.dirname(os.path.abspath(__file__))
+workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="gpr-benchmark-")
+rng = np.random.RandomState(0)
+
+# the stages plot with matplotlib, without a display
+env = dict(os.environ, MPLBACKEND="Agg")
+
+def directory(*parts):
+    path = os.path.join(workdir, *parts)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+def names(n):
+    # half with and half without a mine, named as the pipeline names them
+    return ["with%d" % i if i % 2 == 0 else "without%d" % i for i in range(n)]
+
+def bscan():
+    # (samples, traces) field values of the size and range of a gprMax B-scan
+    return ((synthetic_radargram(args.samples, args.traces, rng=rng) - 0.5) * 200).astype(np.float32)
+
+def make_out_files(path):
+    for name in names(args.files):
+        with h5py.File(os.path.join(path, name + ".out"), 'w') as f:
+            f.attrs['dt'] = 16e-9 / args.samples
+            f.attrs['Iterations'] = args.samples
+            f.attrs['nrx'] = 1
+            f.create_dataset('/rxs/rx1/Ez', data=bscan())
+
+def make_csv_files(path, mine_path):
+    for name in names(args.files):
+        np.savetxt(os.path.join(path, name + ".csv"), bscan(), delimiter=",")
+        if "without" not in name:
+            # x_begin, y_begin, x_end, y_end and trace spacing in metres
+            x = rng.uniform(0.1, 1.6)
+            y = rng.uniform(0.3, 0.5)
+            np.savetxt(os.path.join(mine_path, name + "_minepos.csv"),
+                       [x, y, x + 0.305, y + 0.108, 0.02], delimiter=",")
+
+def make_png_files(path):
+    for name in names(args.files):
+        cv2.imwrite(os.path.join(path, name + ".png"), (synthetic_radargram(1000, 2000, rng=rng) * 255).astype(np.uint8))
+
+def size_of(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+def listed(path, extension):
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(extension))
+
+def python(script, *arguments):
+    return [sys.executable, os.path.join(scripts, script)] + list(arguments)
+
+def run_stage(commands, files, data_bytes, cwd=None):
+    # run the commands of a stage in turn, stopping at the first failure
+    runs = []
+    for command in commands:
+        runs.append(run_measured(command, cwd=cwd, env=env))
+        if runs[-1]["returncode"] != 0:
+            break
+
+    wall = sum(run["wall_s"] for run in runs)
+    result = {"files": files,
+              "bytes": data_bytes,
+              "processes": len(runs),
+              "wall_s": wall,
+              "cpu_s": sum(run["cpu_s"] for run in runs),
+              "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+              "status": "ok"}
+    if runs[-1]["returncode"] != 0:
+        result["status"] = "failed"
+        result["error"] = runs[-1]["stderr"].strip().split("\n")[-1]
+    else:
+        result["files_per_s"] = files / wall
+        result["megabytes_per_s"] = data_bytes / (1024 * 1024) / wall
+
+    return result
+
+LOAD_DATA = """
+import sys
+import numpy as np
+sys.path.insert(0, %r)
+from loading_methods import load_data, windows
+X, Y = load_data(%r, %r, "radargrams", 0)
+windows(X, np.zeros((X.shape[1], X.shape[2])), 64, 0)
+"""
+
+print >> sys.stderr, "Fabricating %d files of each dataset in %s ..." % (args.files, workdir)
+out_dir = directory("out")
+csv_dir = directory("csv")
+mine_dir = directory("mines")
+png_dir = directory("png")
+make_out_files(out_dir)
+make_csv_files(csv_dir, mine_dir)
+make_png_files(png_dir)
+
+cases = {}
+for stage in stages:
+    print >> sys.stderr, "Running " + stage + " ..."
+    if stage == "generate":
+        target = directory("generate")
+        # with a rough surface, gpr-gen-new.py skips the rest of each file without one
+        result = run_stage([python("gpr-gen-new.py", "-n", "with", "-w", str(args.files), "-mt", "anti_tank",
+                                   "-r", "y", "-o", target)], args.files, 0)
+        if result["status"] == "ok":
+            result["bytes"] = size_of(listed(target, ".in"))
+            result["megabytes_per_s"] = result["bytes"] / (1024 * 1024) / result["wall_s"]
+    elif stage == "post_process":
+        target = directory("post_process")
+        files = listed(out_dir, ".out")
+        result = run_stage([python("post_process.py", f, "Ez", target, "n") for f in files],
+                           len(files), size_of(files))
+    elif stage == "process_data":
+        target = directory("process_data")
+        files = listed(csv_dir, ".csv")
+        result = run_stage([python("process-data.py", "-i", csv_dir, "-o", target, "-m", mine_dir)],
+                           len(files), size_of(files))
+    elif stage == "load_data":
+        files = listed(csv_dir, ".csv")
+        result = run_stage([[sys.executable, "-c", LOAD_DATA % (scripts, "csv", workdir)]],
+                           len(files), size_of(files))
+    elif stage == "split_files":
+        target = directory("split_files")
+        files = listed(png_dir, ".png")
+        result = run_stage([python("train-test-split-files.py", "-i", png_dir, "-o", target)],
+                           len(files), size_of(files))
+    else:
+        target = directory("split_caffe")
+        files = listed(png_dir, ".png")
+        result = run_stage([python("train-test-split-caffe.py", "-i", png_dir, "-o", target)],
+                           len(files), size_of(files))
+
+    cases[stage] = result
+    if result["status"] == "ok":
+        print >> sys.stderr, "%-13s %8.2f files/s  %8.2f MB/s  peak %7.1f MB" % (
+            stage, result["files_per_s"], result["megabytes_per_s"], result["peak_rss_mb"])
+    else:
+        print >> sys.stderr, "%-13s failed: %s" % (stage, result["error"])
+
+if args.workdir is None:
+    shutil.rmtree(workdir)
+
+results = {"meta": meta(files=args.files, samples=args.samples, traces=args.traces), "cases": cases}
+save_results(args.output, results)
+
+if args.baseline is not None and not report_regressions(results, args.baseline, args.tolerance):
+    sys.exit(1)
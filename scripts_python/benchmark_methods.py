@@ -0,0 +1,154 @@
+################################################################################
+# benchmark_methods.py
+#
+# Shared pieces of the benchmark scripts: synthetic radargrams, latency
+# percentiles, peak memory of this process or of a measured child, and JSON
+# results that can be saved and compared against a stored baseline. Results
+# are {"meta": {...}, "cases": {name: {metric: value}}}; metrics ending in
+# _per_s are better higher, metrics ending in _ms, _s or _mb are better lower,
+# anything else is only reported.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import json
+import platform
+import resource
+import time
+import sys
+import os
+import subprocess
+
+def synthetic_radargram(height, width, n_targets=3, noise=0.05, rng=None):
+    # (height, width) float32 image in [0 1] that looks like a post_process.py
+    # radargram: a flat ground reflection near the top, hyperbolas under the
+    # targets and gaussian noise around a mid grey background
+    if rng is None:
+        rng = np.random.RandomState(0)
+    rows = np.arange(height, dtype=np.float32)[:,np.newaxis]
+    cols = np.arange(width, dtype=np.float32)[np.newaxis,:]
+
+    image = np.zeros((height, width), dtype=np.float32)
+    ground = 0.08 * height
+    image += np.exp(-((rows - ground) / (0.01 * height))**2) * np.ones_like(cols)
+    for _ in range(n_targets):
+        c0 = rng.uniform(0.1, 0.9) * width
+        r0 = rng.uniform(0.2, 0.7) * height
+        slope = rng.uniform(0.5, 2.0) * height / width
+        apex = np.sqrt(r0**2 + (slope * (cols - c0))**2)
+        # a wavelet of alternating polarity along the hyperbola
+        distance = (rows - apex) / (0.006 * height)
+        image += 0.8 * np.exp(-distance**2 / 4) * np.cos(distance) * np.exp(-np.abs(cols - c0) / (0.3 * width))
+    image += noise * rng.randn(height, width).astype(np.float32)
+
+    return np.clip(0.5 + 0.4 * image, 0, 1).astype(np.float32)
+
+def latency_summary(times):
+    # percentiles of per call times in seconds, in milliseconds
+    times = np.asarray(times) * 1000
+
+    return {"p50_ms": float(np.percentile(times, 50)),
+            "p95_ms": float(np.percentile(times, 95)),
+            "p99_ms": float(np.percentile(times, 99)),
+            "mean_ms": float(np.mean(times))}
+
+def peak_rss_mb():
+    # peak resident memory of this process so far, linux reports kilobytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def timed(function, repeats=1):
+    # list of wall times of repeated calls
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+
+    return times
+
+def run_measured(command, cwd=None, env=None):
+    # run a command to completion, returns its wall and cpu seconds, its peak
+    # resident memory in MB, its exit status and the end of its stderr. The
+    # child is reaped with os.wait4 so that its own rusage is read.
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=devnull, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+
+    return {"wall_s": time.time() - start,
+            "cpu_s": usage.ru_utime + usage.ru_stime,
+            "peak_rss_mb": usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024,
+            "returncode": process.returncode,
+            "stderr": stderr[-2000:]}
+
+def meta(**kwargs):
+    info = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "numpy": np.__version__}
+    info.update(kwargs)
+
+    return info
+
+def save_results(filename, results):
+    if filename == "-":
+        print json.dumps(results, indent=2, sort_keys=True)
+        return
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def direction(metric):
+    # +1 if higher is better, -1 if lower is better, 0 if only reported
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_ms", "_s", "_mb")):
+        return -1
+
+    return 0
+
+def regressions(results, baseline, tolerance=0.1):
+    # (case, metric, baseline, now) of every metric of a case in both results
+    # that is worse than the baseline by more than tolerance
+    found = []
+    for case, metrics in sorted(results["cases"].items()):
+        if case not in baseline["cases"]:
+            continue
+        # a case that ran in the baseline and fails now is a regression
+        if baseline["cases"][case].get("status", "ok") == "ok" and metrics.get("status", "ok") != "ok":
+            found.append((case, "status", "ok", metrics["status"]))
+            continue
+        for metric, value in sorted(metrics.items()):
+            before = baseline["cases"][case].get(metric)
+            sign = direction(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)):
+                continue
+            if sign == 0 or before <= 0:
+                continue
+            if sign > 0 and value < before * (1 - tolerance):
+                found.append((case, metric, before, value))
+            elif sign < 0 and value > before * (1 + tolerance):
+                found.append((case, metric, before, value))
+
+    return found
+
+def report_regressions(results, baseline_file, tolerance):
+    # print the comparison against a baseline file, True if nothing regressed
+    baseline = load_results(baseline_file)
+    found = regressions(results, baseline, tolerance)
+    shared = len(set(results["cases"]) & set(baseline["cases"]))
+    print >> sys.stderr, "Compared %d cases against %s, tolerance %.0f%%" % (shared, baseline_file, 100 * tolerance)
+    for case, metric, before, value in found:
+        print >> sys.stderr, "REGRESSION %s %s: %s -> %s" % (case, metric, before, value)
+    if len(found) == 0:
+        print >> sys.stderr, "No regressions"
+
+    return len(found) == 0
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+################################################################################
+# calibrate-cascade.py
+#
+# Fits the cheap first stage of the localisation cascade on a directory of
+# training images, picks its threshold on a directory of validation images to
+# keep a target recall of the mine images and reports the throughput against
+# recall trade-off. Images are labelled by name, "without" in the name is a
+# clean image, as in model-caffe.py.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import os, sys
+import argparse
+import cv2
+from cascade_methods import FirstStage, tradeoff, time_per_window
+sys.dont_write_bytecode = True
+
+#   Usage:
+#
+#     calibrate-cascade.py -tr <str> -v <str>
+#
+#   where
+#     --train <str> this is the directory of images to fit the first stage on
+#     -tr
+#
+#     --val <str> this is the directory of images to calibrate the threshold on
+#     -v
+#
+#     --output <str> optional, npz file to save the first stage to (cascade.npz),
+#     -o             passed to localise.py --cascade
+#
+#     --recall <float> optional, target recall of the mine images (0.99)
+#     -r
+#
+#     --size <int> optional, windows are averaged down to size x size (8)
+#     -s
+#
+#     --deploy <str> optional, caffe model definition and trained weights. If
+#     --weights      given the CNN is timed on the validation images and the
+#                    recall of the whole cascade is reported against the CNN
+#                    alone, otherwise the CNN rate has to be given with --cnnrate
+#
+#     --cnnrate <float> optional, CNN windows per second used for the projected
+#     -c                throughput when no caffe model is given
+#
+#     --batchsize <int> optional, number of images per CNN forward pass (256)
+#     -b
+#
+
+parser = argparse.ArgumentParser(description='Process some inputs.')
+
+parser.add_argument('-tr','--train', dest='trainDir', metavar='trainDir', type=str,
+                   help='string for training image directory', required=True)
+
+parser.add_argument('-v','--val', dest='valDir', metavar='valDir', type=str,
+                   help='string for validation image directory', required=True)
+
+parser.add_argument('-o','--output', dest='outputFile', metavar='outputFile', type=str,
+                   help='string for first stage output file', default="cascade.npz")
+
+parser.add_argument('-r','--recall', dest='recall', metavar='recall', type=float,
+                   help='target recall of the mine images', default=0.99)
+
+parser.add_argument('-s','--size', dest='size', metavar='size', type=int,
+                   help='size of the averaged down window', default=8)
+
+parser.add_argument('--deploy', dest='deploy', metavar='deploy', type=str,
+                   help='string for caffe model definition file', default=None)
+
+parser.add_argument('--weights', dest='weights', metavar='weights', type=str,
+                   help='string for caffe trained weights file', default=None)
+
+parser.add_argument('-c','--cnnrate', dest='cnnRate', metavar='cnnRate', type=float,
+                   help='CNN windows per second', default=None)
+
+parser.add_argument('-b','--batchsize', dest='batchSize', metavar='batchSize', type=int,
+                   help='number of images per forward pass', default=256)
+
+args = parser.parse_args()
+
+def load_images(image_dir):
+    # greyscale images in [0 1] stacked as (n, height, width), with their labels.
+    # Images of different sizes are resized to the size of the first.
+    names = sorted([f for f in os.listdir(image_dir) if f.endswith(".png")])
+    if len(names) == 0:
+        raise ValueError('no .png images in '+image_dir)
+
+    first = cv2.imread(os.path.join(image_dir, names[0]), 0)
+    images = np.empty((len(names),) + first.shape, dtype=np.float32)
+    for i, name in enumerate(names):
+        image = cv2.imread(os.path.join(image_dir, name), 0)
+        if image.shape != first.shape:
+            image = cv2.resize(image, (first.shape[1], first.shape[0]), interpolation=cv2.INTER_AREA)
+        images[i] = image / 255.0
+
+    labels = np.array([0 if "without" in name else 1 for name in names])
+
+    return images, labels
+
+print "Loading images ..."
+X_train, Y_train = load_images(args.trainDir)
+X_val, Y_val = load_images(args.valDir)
+
+print "Fitting first stage on "+str(len(Y_train))+" images ..."
+stage = FirstStage(size=(args.size, args.size)).fit(X_train, Y_train)
+scores = stage.score(X_val)
+
+# seconds per window of the first stage and of the CNN
+stage_time = time_per_window(stage.score, X_val)
+cnn_scores = None
+if args.deploy is not None and args.weights is not None:
+    import caffe
+    from inference_methods import predict_images
+    caffe.set_mode_cpu()
+    net = caffe.Classifier(args.deploy, args.weights, raw_scale=255)
+    cnn = lambda windows: predict_images(net, windows[:,:,:,np.newaxis], args.batchSize)[:,1]
+    cnn_scores = cnn(X_val)
+    cnn_time = time_per_window(cnn, X_val, repeats=1)
+elif args.cnnRate is not None:
+    cnn_time = 1 / args.cnnRate
+else:
+    cnn_time = None
+
+print ""
+print "First stage : %.0f windows/s" % (1 / stage_time)
+if cnn_time is not None:
+    print "CNN         : %.0f windows/s" % (1 / cnn_time)
+print ""
+
+# projected throughput of the cascade is one first stage evaluation per window
+# plus a CNN evaluation for each window passed on
+print "target  threshold  recall  passed  windows/s  speedup"
+for result in tradeoff(scores, Y_val, [0.9, 0.95, 0.98, 0.99, 0.995, 1.0]):
+    line = "%6.3f  %9.3f  %6.3f  %6.3f" % (result["target"], result["threshold"], result["recall"], result["pass_rate"])
+    if cnn_time is not None:
+        cascade_time = stage_time + result["pass_rate"] * cnn_time
+        line += "  %9.0f  %6.1fx" % (1 / cascade_time, cnn_time / cascade_time)
+    print line
+
+stage.calibrate(X_val, Y_val, args.recall)
+print ""
+print "Threshold for recall %.3f : %.3f" % (args.recall, stage.threshold)
+
+if cnn_scores is not None:
+    # recall of the CNN alone against the CNN behind the first stage
+    cnn_positive = cnn_scores > 0.5
+    cascade_positive = cnn_positive & (scores >= stage.threshold)
+    print "CNN recall     : %.3f" % np.mean(cnn_positive[Y_val == 1])
+    print "Cascade recall : %.3f" % np.mean(cascade_positive[Y_val == 1])
+
+print "Saving first stage to "+args.outputFile+" ..."
+stage.save(args.outputFile)
@@ -0,0 +1,142 @@
+################################################################################
+# cascade_methods.py
+#
+# Cheap first stage of a two stage detection cascade. A linear model on a few
+# window statistics and the window averaged down to a small grid rejects the
+# obviously clean windows, only the survivors are passed on to the CNN. Its
+# threshold is calibrated on validation data to keep a target recall of the
+# mine windows.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import time
+from sklearn.linear_model import LogisticRegression
+
+def window_features(windows, size=(8, 8)):
+    # (n, features) float32 array for an (n, height, width[, channels]) stack of
+    # windows: mean, standard deviation, energy, range, mean absolute vertical
+    # and horizontal gradient, and the window block averaged down to size
+    windows = np.asarray(windows, dtype=np.float32)
+    n, height, width = windows.shape[:3]
+    if windows.ndim > 3:
+        windows = windows.reshape(n, height, width, -1).mean(axis=3)
+
+    flat = windows.reshape(n, -1)
+    stats = np.column_stack((flat.mean(axis=1),
+                             flat.std(axis=1),
+                             (flat**2).mean(axis=1),
+                             flat.max(axis=1) - flat.min(axis=1),
+                             np.abs(np.diff(windows, axis=1)).reshape(n, -1).mean(axis=1),
+                             np.abs(np.diff(windows, axis=2)).reshape(n, -1).mean(axis=1)))
+
+    # block means, the remainder rows and columns are dropped
+    bh = max(1, height // size[0])
+    bw = max(1, width // size[1])
+    rows = min(size[0], height)
+    cols = min(size[1], width)
+    blocks = windows[:, :bh*rows, :bw*cols].reshape(n, rows, bh, cols, bw).mean(axis=(2, 4))
+
+    return np.hstack((stats, blocks.reshape(n, -1))).astype(np.float32)
+
+def recall_threshold(scores, labels, recall):
+    # largest threshold that still passes at least the target fraction of the
+    # positive windows (score >= threshold)
+    positive = np.sort(np.asarray(scores)[np.asarray(labels) == 1])
+    if len(positive) == 0:
+        raise ValueError('no positive windows to calibrate the threshold on')
+
+    k = len(positive) - int(np.ceil(recall * len(positive)))
+
+    return float(positive[max(k, 0)])
+
+def tradeoff(scores, labels, recalls):
+    # threshold, achieved recall and fraction of all windows passed on for each
+    # target recall
+    scores = np.asarray(scores)
+    labels = np.asarray(labels)
+    results = []
+    for target in recalls:
+        threshold = recall_threshold(scores, labels, target)
+        passed = scores >= threshold
+        results.append({"target": target,
+                        "threshold": threshold,
+                        "recall": float(np.mean(passed[labels == 1])),
+                        "pass_rate": float(np.mean(passed))})
+
+    return results
+
+def time_per_window(function, windows, repeats=3):
+    # best of repeats wall clock seconds per window
+    best = np.inf
+    for _ in range(repeats):
+        start = time.time()
+        function(windows)
+        best = min(best, time.time() - start)
+
+    return best / max(1, len(windows))
+
+class FirstStage(object):
+    # logistic regression on window_features, standardised with the training
+    # mean and std. Scoring is plain numpy, a window is passed on to the CNN if
+    # its score is at least the threshold.
+
+    def __init__(self, size=(8, 8), C=1.0):
+        self.size = tuple(size)
+        self.C = C
+        self.mean = None
+        self.std = None
+        self.coef = None
+        self.intercept = 0.0
+        self.threshold = -np.inf
+
+    def fit(self, windows, labels):
+        X = window_features(windows, self.size)
+        self.mean = X.mean(axis=0)
+        self.std = X.std(axis=0)
+        self.std[self.std == 0] = 1
+
+        # mine windows are rare, weight the classes so they are not ignored
+        clf = LogisticRegression(C=self.C, solver='liblinear', class_weight='balanced')
+        clf.fit((X - self.mean) / self.std, labels)
+        self.coef = clf.coef_[0].astype(np.float32)
+        self.intercept = float(clf.intercept_[0])
+
+        return self
+
+    def score(self, windows):
+        X = window_features(windows, self.size)
+        return np.dot((X - self.mean) / self.std, self.coef) + self.intercept
+
+    def passes(self, windows):
+        return self.score(windows) >= self.threshold
+
+    def calibrate(self, windows, labels, recall):
+        self.threshold = recall_threshold(self.score(windows), labels, recall)
+        return self
+
+    def get_state(self, prefix="stage1_"):
+        return {prefix+"size": np.array(self.size),
+                prefix+"C": np.array(self.C),
+                prefix+"mean": self.mean,
+                prefix+"std": self.std,
+                prefix+"coef": self.coef,
+                prefix+"intercept": np.array(self.intercept),
+                prefix+"threshold": np.array(self.threshold)}
+
+    def set_state(self, state, prefix="stage1_"):
+        self.size = tuple(int(s) for s in state[prefix+"size"])
+        self.C = float(state[prefix+"C"])
+        self.mean = np.asarray(state[prefix+"mean"], dtype=np.float32)
+        self.std = np.asarray(state[prefix+"std"], dtype=np.float32)
+        self.coef = np.asarray(state[prefix+"coef"], dtype=np.float32)
+        self.intercept = float(state[prefix+"intercept"])
+        self.threshold = float(state[prefix+"threshold"])
+
+        return self
+
+    def save(self, filename):
+        np.savez_compressed(filename, **self.get_state())
+
+    def load(self, filename):
+        return self.set_state(np.load(filename))
@@ -0,0 +1,111 @@
+################################################################################
+# clutter_methods.py
+#
+# Background (clutter) removal for B-scans. The batch filter subtracts the mean
+# trace and the dominant eigenimages of a complete B-scan, as post_process.py
+# does. The online filter does the same for A-scans arriving one at a time,
+# keeping a running mean trace and a low rank subspace updated by incremental
+# SVD with forgetting, at a constant cost per trace.
+################################################################################
+
+from __future__ import division
+import numpy as np
+
+def clutter_filter(bscan, n_components=2):
+    # mean trace subtraction then removal of the dominant eigenimages, for a
+    # complete 2D (time, traces) array
+    bscan = np.asarray(bscan, dtype=np.float64)
+    bscan = bscan - np.mean(bscan, axis=1)[:,np.newaxis]
+    if n_components > 0:
+        U, sigma, V = np.linalg.svd(bscan, full_matrices=False)
+        bscan = bscan - np.dot(U[:,:n_components] * sigma[:n_components], V[:n_components])
+
+    return bscan
+
+class OnlineClutterFilter(object):
+    # clutter filter for one A-scan at a time. The mean trace and the rank
+    # dominant left singular vectors of the mean removed traces are updated with
+    # each trace (Brand's incremental SVD, with the mean update of Ross et al.),
+    # and the trace is returned with the mean and its projection on to the
+    # subspace removed. Earlier traces are down weighted by forget per trace, 1
+    # weights all traces equally as the batch filter does. A trace costs
+    # O(samples * rank + rank^3) however many traces have been seen.
+
+    def __init__(self, rank=2, forget=0.99, orthogonalise=100):
+        self.rank = rank
+        self.forget = forget
+        self.orthogonalise = orthogonalise
+        self.count = 0.0
+        self.traces = 0
+        self.mean = None
+        self.U = None
+        self.s = None
+
+    def update(self, trace):
+        # add one (samples,) trace and return it filtered
+        trace = np.asarray(trace, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros(trace.shape[0])
+            self.U = np.zeros((trace.shape[0], 0))
+            self.s = np.zeros(0)
+
+        # the scatter of the mean removed traces gains (n/(n+1))(x - mean)(x - mean)^T
+        # where n is the forgotten count, so the subspace sees the new trace
+        # scaled against the old mean
+        n = self.forget * self.count
+        delta = trace - self.mean
+        self._update_subspace(np.sqrt(n / (n + 1)) * delta)
+        self.mean += delta / (n + 1)
+        self.count = n + 1
+        self.traces += 1
+
+        if self.orthogonalise and self.traces % self.orthogonalise == 0:
+            self._reorthogonalise()
+
+        centred = trace - self.mean
+
+        return centred - np.dot(self.U, np.dot(self.U.T, centred))
+
+    def transform(self, block):
+        # filter a (samples, traces) block trace by trace
+        block = np.asarray(block, dtype=np.float64)
+        filtered = np.empty(block.shape)
+        for i in range(block.shape[1]):
+            filtered[:,i] = self.update(block[:,i])
+
+        return filtered
+
+    def _update_subspace(self, column):
+        if self.rank == 0:
+            return
+
+        # component of the new column outside the current subspace
+        p = np.dot(self.U.T, column)
+        residual = column - np.dot(self.U, p)
+        rho = np.linalg.norm(residual)
+
+        k = len(self.s)
+        K = np.zeros((k + 1, k + 1))
+        K[:k,:k] = np.diag(np.sqrt(self.forget) * self.s)
+        K[:k,k] = p
+        K[k,k] = rho
+
+        Uk, sk, _ = np.linalg.svd(K)
+        if rho > 1e-12 * max(1, np.linalg.norm(column)):
+            basis = np.hstack((self.U, residual[:,np.newaxis] / rho))
+        else:
+            basis = np.hstack((self.U, np.zeros((self.U.shape[0], 1))))
+
+        keep = min(self.rank, k + 1)
+        self.U = np.dot(basis, Uk[:,:keep])
+        self.s = sk[:keep]
+
+        # the zero column above only carries a zero singular value
+        nonzero = self.s > 0
+        self.U = self.U[:,nonzero]
+        self.s = self.s[nonzero]
+
+    def _reorthogonalise(self):
+        # rounding slowly erodes the orthogonality of U over many updates
+        Q, R = np.linalg.qr(self.U)
+        self.U = Q * np.sign(np.diag(R))
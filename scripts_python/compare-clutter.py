@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+################################################################################
+# compare-clutter.py
+#
+# Compares the online clutter filter, fed one A-scan at a time, against the
+# batch filter post_process.py applies to the complete B-scan of a recorded
+# .out file. Reports the time per trace, the difference of the filtered
+# B-scans and how far the tracked subspace is from the batch eigenimages.
+################################################################################
+
+from __future__ import division
+import argparse
+import time
+import h5py
+import numpy as np
+import matplotlib.pyplot as plt
+from clutter_methods import clutter_filter, OnlineClutterFilter
+
+#   Usage:
+#
+#     compare-clutter.py -i <str>
+#
+#   where
+#     --input <str> this is the merged gprMax .out file of a recorded B-scan
+#     -i
+#
+#     --field <str> optional, field to compare, i.e. Ex, Ey, Ez (Ez)
+#     -f
+#
+#     --rank <int> optional, number of eigenimages removed (2, as post_process.py)
+#     -r
+#
+#     --forget <str> optional, comma separated forgetting factors of the online
+#     -fg            filter to compare ("1,0.99,0.95"), 1 weights all traces equally
+#
+#     --output <str> optional, png file to plot the batch and online B-scans and
+#     -o             their difference to, for the first forgetting factor
+#
+
+parser = argparse.ArgumentParser(description='compare online and batch clutter removal')
+
+parser.add_argument('-i', '--input', required=True, dest='input', action='store', help='merged .out file')
+
+parser.add_argument('-f', '--field', dest='field', default='Ez', action='store', help='field to compare')
+
+parser.add_argument('-r', '--rank', dest='rank', default=2, type=int, action='store', help='number of eigenimages removed')
+
+parser.add_argument('-fg', '--forget', dest='forget', default='1,0.99,0.95', action='store', help='comma separated forgetting factors')
+
+parser.add_argument('-o', '--output', dest='output', default=None, action='store', help='png file for the comparison plot')
+
+args = parser.parse_args()
+
+def rescale(b_scan):
+    # 0-255 as post_process.py normalises the radargram
+    return (b_scan - b_scan.min()) / (b_scan.max() - b_scan.min()) * 255
+
+def relative_error(a, b):
+    return np.linalg.norm(a - b) / np.linalg.norm(b)
+
+f = h5py.File(args.input, 'r')
+data = np.asarray(f['/rxs/rx1/' + args.field], dtype=np.float64)
+f.close()
+samples, traces = data.shape
+
+print "B-scan: %d samples x %d traces" % (samples, traces)
+
+start = time.time()
+batch = clutter_filter(data, args.rank)
+print "Batch filter: %.3f s for the whole B-scan" % (time.time() - start)
+
+# subspace of the batch eigenimages
+centred = data - np.mean(data, axis=1)[:,np.newaxis]
+batch_U = np.linalg.svd(centred, full_matrices=False)[0][:,:args.rank]
+
+print ""
+print "forget  us/trace  max us  error  error 2nd half  error final state  angle deg  max grey diff"
+
+plotted = False
+for forget in [float(value) for value in args.forget.split(',')]:
+    online = OnlineClutterFilter(args.rank, forget)
+    filtered = np.empty(data.shape)
+    times = np.empty(traces)
+    for i in range(traces):
+        start = time.time()
+        filtered[:,i] = online.update(data[:,i])
+        times[i] = time.time() - start
+
+    # error of the causal output, after the filter has seen half the line, and
+    # with the final mean and subspace applied to every trace (as batch does)
+    half = traces // 2
+    final = data - online.mean[:,np.newaxis]
+    final = final - np.dot(online.U, np.dot(online.U.T, final))
+
+    # largest principal angle between the final and the batch subspaces
+    if args.rank > 0:
+        cosines = np.linalg.svd(np.dot(batch_U.T, online.U), compute_uv=False)
+        angle = np.degrees(np.arccos(np.clip(np.min(cosines), -1, 1)))
+    else:
+        angle = 0.0
+
+    print "%6.3f  %8.1f  %6.1f  %5.3f  %14.3f  %17.3f  %9.2f  %13.1f" % (
+        forget, 1e6 * np.mean(times), 1e6 * np.max(times),
+        relative_error(filtered, batch), relative_error(filtered[:,half:], batch[:,half:]),
+        relative_error(final, batch), angle, np.max(np.abs(rescale(filtered) - rescale(batch))))
+
+    if args.output is not None and not plotted:
+        fig, axes = plt.subplots(1, 3, figsize=(30, 10))
+        for ax, image, title in zip(axes, (batch, filtered, filtered - batch),
+                                    ("Batch", "Online, forget %g" % forget, "Difference")):
+            ax.imshow(image, cmap='gray', interpolation='bicubic', aspect='auto')
+            ax.set_title(title, fontsize=25)
+            ax.set_xlabel('Trace number', fontsize=20)
+        fig.savefig(args.output, bbox_inches='tight')
+        plotted = True
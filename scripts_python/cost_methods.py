@@ -0,0 +1,162 @@
+################################################################################
+# cost_methods.py
+#
+# Predicted run time of gprMax simulations from their .in files, for running
+# the longest first and for campaign ETAs. The time of a B-scan grows with the
+# cells of the domain, the iterations of the time window, the number of traces
+# and the geometry to build, so a scene is described by
+#
+#   cells x iterations x traces   the FDTD updates
+#   cells x traces                building the grid and materials of each trace
+#   objects x traces              building the geometry of each trace
+#   traces                        start up and output of each trace
+#
+# and the time is a non negative combination of these, fitted separately for
+# cpu and gpu runs to the simulate records of a trace (trace_methods). Before
+# any run is recorded rough defaults are used, which still order the scenes.
+# Predicting needs the standard library only, so that the pipeline runners can
+# order their tasks anywhere, fitting needs numpy and scipy. Works under python
+# 2 and 3.
+################################################################################
+
+from __future__ import division
+import heapq
+import json
+import math
+import os
+import re
+
+FEATURES = ["updates", "cells", "objects", "traces"]
+
+# seconds per unit of each feature before calibration, about 50 million cell
+# updates a second on a cpu and 1 billion on a gpu
+DEFAULTS = {"cpu": [2e-8, 1e-6, 1e-2, 1.0],
+            "gpu": [1e-9, 1e-7, 1e-2, 1.0]}
+
+# commands that add geometry to the grid
+GEOMETRY = ("#box", "#sphere", "#cylinder", "#cylindrical_sector", "#triangle", "#edge", "#plate",
+            "#fractal_box", "#add_surface_roughness", "#add_surface_water", "#add_grass", "#geometry_objects_read")
+
+SPEED_OF_LIGHT = 299792458.0
+
+def parse_scene(filename):
+    # {command: [values of each occurrence]} of a .in file, comments and
+    # python blocks skipped
+    commands = {}
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith("#") or ":" not in line:
+                continue
+            name, values = line.split(":", 1)
+            commands.setdefault(name.strip(), []).append(values.split())
+
+    return commands
+
+def scene_features(commands, traces=1):
+    # FEATURES of a parsed scene run with the given number of traces
+    domain = [float(v) for v in commands["#domain"][0][:3]]
+    dx = [float(v) for v in commands["#dx_dy_dz"][0][:3]]
+    cells = [max(1, int(round(d / s))) for d, s in zip(domain, dx)]
+
+    # time step at the CFL limit, over the dimensions more than one cell thick
+    dt = 1 / (SPEED_OF_LIGHT * math.sqrt(sum(1 / s**2 for s, n in zip(dx, cells) if n > 1)))
+    window = commands["#time_window"][0][0]
+    if re.match(r"^\d+$", window):
+        iterations = int(window)
+    else:
+        iterations = int(math.ceil(float(window) / dt)) + 1
+
+    n_cells = float(cells[0] * cells[1] * cells[2])
+    objects = sum(len(commands.get(name, [])) for name in GEOMETRY)
+
+    return [n_cells * iterations * traces, n_cells * traces, objects * traces, float(traces)]
+
+def command_traces(command):
+    # traces of a gprMax command line, -n, 1 if not given
+    found = re.search(r"-n\s+(\d+)", command or "")
+
+    return int(found.group(1)) if found else 1
+
+def command_device(command):
+    return "gpu" if re.search(r"(^|\s)-gpu(\s|$)", command or "") else "cpu"
+
+def makespan(durations, workers, running=()):
+    # time until durations are done on workers that take the next in turn,
+    # after the remaining times of tasks already running
+    finish = sorted(list(running)[:workers]) + [0.0] * max(0, workers - len(running))
+    heapq.heapify(finish)
+    for duration in durations:
+        heapq.heappush(finish, heapq.heappop(finish) + duration)
+
+    return max(finish) if finish else 0.0
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+class CostModel(object):
+    # predicted seconds of a simulation, coefficients per device
+
+    def __init__(self, filename=None):
+        self.coefficients = dict((device, list(c)) for device, c in DEFAULTS.items())
+        self.samples = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as f:
+                saved = json.load(f)
+            self.coefficients.update(saved["coefficients"])
+            self.samples = saved.get("samples", {})
+
+    def save(self, filename):
+        temporary = filename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"features": FEATURES, "coefficients": self.coefficients, "samples": self.samples},
+                      f, indent=2, sort_keys=True)
+        os.rename(temporary, filename)
+
+    def predict(self, features, device="cpu"):
+        return float(sum(c * x for c, x in zip(self.coefficients[device], features)))
+
+    def predict_file(self, filename, command=None, traces=None):
+        # seconds to simulate a .in file with the traces and device of its
+        # command, None if the file cannot be parsed
+        try:
+            features = scene_features(parse_scene(filename), traces or command_traces(command))
+        except (IOError, OSError, KeyError, IndexError, ValueError, ZeroDivisionError):
+            return None
+
+        return self.predict(features, command_device(command))
+
+    def fit(self, records, stage="simulate"):
+        # fit to the successful records of stage whose .in file still exists,
+        # returns {device: (runs, relative error)}. A device keeps its
+        # coefficients until it has at least as many runs as features.
+        import numpy as np
+        from scipy.optimize import nnls
+
+        rows = {}
+        for record in records:
+            if record.get("stage") != stage or record.get("status") != "ok" or not record.get("file"):
+                continue
+            try:
+                features = scene_features(parse_scene(record["file"]), command_traces(record.get("command")))
+            except (IOError, OSError, KeyError, IndexError, ValueError, ZeroDivisionError):
+                continue
+            rows.setdefault(command_device(record.get("command")), []).append((features, record["wall_s"]))
+
+        fitted = {}
+        for device, samples in rows.items():
+            if len(samples) < len(FEATURES):
+                continue
+            X = np.array([s[0] for s in samples])
+            y = np.array([s[1] for s in samples])
+            # scale the columns so that they weigh alike in the fit
+            scale = X.max(axis=0)
+            scale[scale == 0] = 1
+            coefficients, _ = nnls(X / scale, y)
+            self.coefficients[device] = list(coefficients / scale)
+            self.samples[device] = len(samples)
+            predicted = X.dot(self.coefficients[device])
+            fitted[device] = (len(samples), float(np.median(np.abs(predicted - y) / np.maximum(y, 1e-9))))
+
+        return fitted
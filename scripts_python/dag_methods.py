@@ -0,0 +1,437 @@
+################################################################################
+# dag_methods.py
+#
+# Incremental runner for the pipeline stages. Each stage of a config declares
+# the files it reads and writes, and stages that read what another writes run
+# after it. A stage with foreach runs once per matching file, and when the files
+# come from another foreach stage each one is handed on as soon as it is
+# written, so a B-scan is post processed while the next is still simulating.
+#
+# A task is skipped when a hash of its command and the contents of its inputs
+# matches the last successful run and its outputs are still as that run left
+# them. The state is saved after every task, so an interrupted run resumes
+# where it stopped. The files of a stage marked longest_first run in order of
+# their predicted cost, largest first, with an ETA after each one. A task that
+# exits with the reject_status of its stage, such as a simulation stopped by
+# simulation-watchdog.py, is rejected: it counts as finished without outputs
+# and is not run again until its inputs change.
+################################################################################
+
+from __future__ import division
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+from multiprocessing.pool import ThreadPool
+from trace_methods import run_traced
+from cost_methods import makespan, format_duration
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+def expand(text, variables):
+    # replace {name} by its variable, repeatedly so that variables can refer to
+    # each other. Unknown names are left for the per file expansion.
+    for _ in range(20):
+        expanded = PLACEHOLDER.sub(lambda m: str(variables[m.group(1)]) if m.group(1) in variables else m.group(0), text)
+        if expanded == text:
+            return expanded
+        text = expanded
+
+    raise ValueError('variables refer to each other in a loop: ' + text)
+
+def item_variables(path):
+    # placeholders of a foreach file
+    name = os.path.basename(path)
+    return {"input": path, "name": name, "stem": os.path.splitext(name)[0], "dir": os.path.dirname(path)}
+
+def as_glob(pattern):
+    # a pattern with its per file placeholders as wildcards
+    return PLACEHOLDER.sub("*", pattern)
+
+def patterns_meet(a, b):
+    a, b = as_glob(a), as_glob(b)
+    return a == b or fnmatch.fnmatch(a, b) or fnmatch.fnmatch(b, a)
+
+def load_config(filename, overrides=None):
+    # a JSON config of {"variables": {...}, "jobs": n, "state": path, "trace":
+    # path, "cost_model": path, "stages": [...]}, with the variables given on
+    # the command line taking precedence. {here} is the directory of the config
+    # file.
+    with open(filename) as f:
+        config = json.load(f)
+
+    variables = {"here": os.path.dirname(os.path.abspath(filename))}
+    variables.update(config.get("variables", {}))
+    variables.update(overrides or {})
+
+    stages = []
+    for stage in config["stages"]:
+        if "name" not in stage or "command" not in stage:
+            raise ValueError('every stage needs a name and a command')
+        stages.append({"name": stage["name"],
+                       "command": expand(stage["command"], variables),
+                       "cwd": expand(stage["cwd"], variables) if "cwd" in stage else None,
+                       "foreach": expand(stage["foreach"], variables) if "foreach" in stage else None,
+                       "inputs": [expand(p, variables) for p in stage.get("inputs", [])],
+                       "outputs": [expand(p, variables) for p in stage.get("outputs", [])],
+                       "clean": [expand(p, variables) for p in stage.get("clean", [])],
+                       "after": list(stage.get("after", [])),
+                       "longest_first": bool(stage.get("longest_first", False)),
+                       "reject_status": stage.get("reject_status")})
+
+    names = [stage["name"] for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError('stage names must be unique')
+
+    state = expand(config.get("state", "{here}/.pipeline"), variables)
+    trace = expand(config["trace"], variables) if "trace" in config else None
+    cost_model = expand(config["cost_model"], variables) if "cost_model" in config else None
+
+    return stages, variables, int(config.get("jobs", 1)), state, trace, cost_model
+
+class State(object):
+    # record of every successful task and a cache of file hashes keyed by size
+    # and modification time, saved by atomic rename after every change
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filename = os.path.join(directory, "state.json")
+        self.lock = threading.Lock()
+        self.data = {"tasks": {}, "hashes": {}}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.data = json.load(f)
+
+    def file_hash(self, path):
+        info = os.stat(path)
+        with self.lock:
+            cached = self.data["hashes"].get(path)
+        if cached is not None and cached[0] == info.st_size and cached[1] == info.st_mtime:
+            return cached[2]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.data["hashes"][path] = [info.st_size, info.st_mtime, digest.hexdigest()]
+
+        return digest.hexdigest()
+
+    def task(self, task_id):
+        with self.lock:
+            return self.data["tasks"].get(task_id)
+
+    def finished(self, task_id, key, outputs):
+        with self.lock:
+            self.data["tasks"][task_id] = {"key": key, "outputs": outputs, "time": time.time()}
+            self.save()
+
+    def forget(self, task_id):
+        with self.lock:
+            self.data["tasks"].pop(task_id, None)
+            self.save()
+
+    def save(self):
+        # called with the lock held
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temporary = self.filename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.rename(temporary, self.filename)
+
+class Pipeline(object):
+    # runs the stages of load_config with up to jobs tasks at once. force names
+    # stages whose tasks run even when up to date, keep_going carries on with
+    # the stages that do not depend on a failed one. cost gives the predicted
+    # seconds of a task of a longest_first stage, or None.
+
+    def __init__(self, stages, state_dir, jobs=1, force=(), keep_going=False, cost=None, log=sys.stdout):
+        self.stages = stages
+        self.by_name = dict((stage["name"], stage) for stage in stages)
+        self.state = State(state_dir)
+        self.jobs = jobs
+        self.force = set(force)
+        self.keep_going = keep_going
+        self.cost = cost
+        self.log = log
+        self.print_lock = threading.Lock()
+
+        for stage in stages:
+            stage["deps"] = self._dependencies(stage)
+            stage["status"] = "waiting"
+            stage["tasks"] = {}
+        self._check_acyclic()
+
+    def _dependencies(self, stage):
+        deps = set(stage["after"])
+        reads = stage["inputs"] + ([stage["foreach"]] if stage["foreach"] else [])
+        for other in self.stages:
+            if other is stage:
+                continue
+            if any(patterns_meet(read, written) for read in reads for written in other["outputs"]):
+                deps.add(other["name"])
+        for name in deps:
+            if name not in self.by_name:
+                raise ValueError('stage ' + stage["name"] + ' runs after unknown stage ' + name)
+
+        return sorted(deps)
+
+    def _check_acyclic(self):
+        visiting, visited = set(), set()
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError('stages depend on each other in a loop through ' + name)
+            visiting.add(name)
+            for dep in self.by_name[name]["deps"]:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+        for stage in self.stages:
+            visit(stage["name"])
+
+    def say(self, text):
+        # a closed log, such as a pipe to head, does not stop the run
+        with self.print_lock:
+            try:
+                self.log.write(time.strftime("%H:%M:%S ") + text + "\n")
+                self.log.flush()
+            except (IOError, OSError):
+                pass
+
+    def run(self):
+        # True if every stage finished
+        pool = ThreadPool(self.jobs)
+        events = Queue.Queue()
+        running = 0
+        self.stopping = False
+        try:
+            while True:
+                if not self.stopping:
+                    for stage in self.stages:
+                        for task in self._ready_tasks(stage):
+                            running += 1
+                            pool.apply_async(self._run_task, (task,), callback=events.put)
+                if running == 0:
+                    break
+                task = events.get()
+                running -= 1
+                stage = self.by_name[task["stage"]]
+                stage["tasks"][task["id"]] = task
+                if task["status"] == "failed" and not self.keep_going:
+                    self.stopping = True
+                if stage["longest_first"] and task["status"] == "ran":
+                    self._report_eta(stage)
+        finally:
+            pool.close()
+            pool.join()
+
+        for stage in self.stages:
+            self._update_status(stage)
+
+        failed = [s["name"] for s in self.stages if s["status"] != "done"]
+        if failed:
+            self.say("not finished: " + ", ".join(failed))
+
+        return len(failed) == 0
+
+    def _update_status(self, stage):
+        deps = [self.by_name[name] for name in stage["deps"]]
+        for dep in deps:
+            self._update_status(dep)
+        if stage["status"] in ("done", "failed", "blocked"):
+            return
+        if any(dep["status"] in ("failed", "blocked") for dep in deps):
+            stage["status"] = "blocked"
+            return
+
+        tasks = stage["tasks"].values()
+        if any(task.get("status") == "failed" for task in tasks):
+            stage["status"] = "failed"
+        elif all(dep["status"] == "done" for dep in deps) and stage.get("expanded") and \
+                all(task.get("status") in ("ran", "skipped", "rejected") for task in tasks):
+            stage["status"] = "done"
+            self.say("[%s] done" % stage["name"])
+
+    def _ready_tasks(self, stage):
+        # tasks of the stage that can start now and have not been started
+        self._update_status(stage)
+        if stage["status"] != "waiting":
+            return []
+
+        deps = [self.by_name[name] for name in stage["deps"]]
+        deps_done = all(dep["status"] == "done" for dep in deps)
+
+        if stage["foreach"] is None:
+            if not deps_done or stage.get("expanded"):
+                return []
+            stage["expanded"] = True
+            return [self._task(stage, None)]
+
+        # files handed on by upstream foreach stages as their tasks finish,
+        # once every other upstream stage is done
+        streaming = [dep for dep in deps if dep["foreach"] is not None]
+        if deps_done:
+            items = sorted(glob.glob(as_glob(stage["foreach"])))
+            stage["expanded"] = True
+        elif all(dep["status"] == "done" for dep in deps if dep not in streaming):
+            items = []
+            for dep in streaming:
+                for task in dep["tasks"].values():
+                    if task.get("status") in ("ran", "skipped"):
+                        items.extend(p for p in task["outputs"] if fnmatch.fnmatch(p, as_glob(stage["foreach"])))
+        else:
+            return []
+
+        started = stage.setdefault("started", set())
+        tasks = []
+        for item in items:
+            if item not in started:
+                started.add(item)
+                task = self._task(stage, item)
+                stage["tasks"][task["id"]] = task
+                tasks.append(task)
+
+        if stage["longest_first"] and self.cost is not None:
+            for task in tasks:
+                task["cost"] = self.cost(task)
+            tasks.sort(key=lambda task: -(task["cost"] or 0))
+
+        return tasks
+
+    def _report_eta(self, stage):
+        # predicted time left of a longest_first stage, with the predictions
+        # scaled by how the tasks run so far compare with theirs
+        tasks = [task for task in stage["tasks"].values() if task.get("cost") is not None]
+        ran = [task for task in tasks if task["status"] == "ran"]
+        if len(ran) == 0:
+            return
+        factor = sum(task["elapsed"] for task in ran) / max(sum(task["cost"] for task in ran), 1e-9)
+
+        now = time.time()
+        running = [max(0, task["cost"] * factor - (now - task["start"])) for task in tasks if task["status"] == "running"]
+        queued = [task["cost"] * factor for task in tasks if task["status"] == "queued"]
+        self.say("[%s] %d left, ETA %s" % (stage["name"], len(running) + len(queued),
+                                          format_duration(makespan(queued, self.jobs, running))))
+
+    def _task(self, stage, item):
+        variables = item_variables(item) if item is not None else {}
+        task = {"stage": stage["name"],
+                "item": item,
+                "id": stage["name"] + (":" + item if item is not None else ""),
+                "command": expand(stage["command"], variables),
+                "cwd": expand(stage["cwd"], variables) if stage["cwd"] else None,
+                "inputs": [expand(p, variables) for p in stage["inputs"]] + ([item] if item is not None else []),
+                "outputs": [expand(p, variables) for p in stage["outputs"]],
+                "clean": [expand(p, variables) for p in stage["clean"]],
+                "reject_status": stage["reject_status"],
+                "status": "queued"}
+        stage["tasks"][task["id"]] = task
+
+        return task
+
+    def _key(self, task, inputs):
+        content = {"command": task["command"], "cwd": task["cwd"],
+                   "inputs": [[path, self.state.file_hash(path)] for path in inputs]}
+
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _up_to_date(self, task, key):
+        if task["stage"] in self.force:
+            return None
+        record = self.state.task(task["id"])
+        if record is None or record["key"] != key:
+            return None
+        for path, digest in record["outputs"].items():
+            if not os.path.exists(path) or self.state.file_hash(path) != digest:
+                return None
+
+        return record
+
+    def _run_task(self, task):
+        # runs in a pool thread, returns the task with its status and outputs
+        label = "[%s]" % task["stage"] + (" " + os.path.basename(task["item"]) if task["item"] else "")
+        if self.stopping:
+            # queued before a failure stopped the run
+            task["status"] = "cancelled"
+            task["outputs"] = []
+            return task
+
+        try:
+            inputs = []
+            for pattern in task["inputs"]:
+                matched = sorted(glob.glob(pattern))
+                if len(matched) == 0:
+                    raise IOError('no input matches ' + pattern)
+                inputs.extend(matched)
+            key = self._key(task, inputs)
+
+            record = self._up_to_date(task, key)
+            if record is not None:
+                task["status"] = "skipped"
+                task["outputs"] = sorted(record["outputs"])
+                self.say(label + " up to date")
+                return task
+
+            self.state.forget(task["id"])
+            for pattern in task["clean"]:
+                for path in glob.glob(pattern):
+                    shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+            # the directories the task writes to, and its log
+            logs = os.path.join(self.state.directory, "logs", task["stage"])
+            for directory in [os.path.dirname(p) for p in task["outputs"]] + [logs]:
+                if glob.has_magic(directory) or directory == "" or os.path.isdir(directory):
+                    continue
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass
+            log = os.path.join(logs, (os.path.basename(task["item"]) if task["item"] else task["stage"]) + ".log")
+
+            self.say(label + " running")
+            # the start is set first, the main thread reads it of every running task
+            start = task["start"] = time.time()
+            task["status"] = "running"
+            returncode = run_traced(task["command"], task["stage"], task["item"], cwd=task["cwd"], log=log)
+            if task["reject_status"] is not None and returncode == task["reject_status"]:
+                self.state.finished(task["id"], key, {})
+                task["status"] = "rejected"
+                task["outputs"] = []
+                self.say(label + " rejected, see " + log)
+                return task
+            if returncode != 0:
+                raise RuntimeError('exit status %d, see %s' % (returncode, log))
+
+            outputs = {}
+            for pattern in task["outputs"]:
+                matched = glob.glob(pattern)
+                if len(matched) == 0:
+                    raise IOError('declared output ' + pattern + ' was not written, see ' + log)
+                for path in matched:
+                    outputs[path] = self.state.file_hash(path)
+            self.state.finished(task["id"], key, outputs)
+
+            task["status"] = "ran"
+            task["outputs"] = sorted(outputs)
+            task["elapsed"] = time.time() - start
+            self.say(label + " ran in %.1f s" % task["elapsed"])
+        except Exception as e:
+            task["status"] = "failed"
+            task["outputs"] = []
+            self.say(label + " FAILED: " + str(e))
+
+        return task
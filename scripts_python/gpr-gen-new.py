@@ -5,7 +5,8 @@
 #
 # This file generates the .in files used by the NEW gprMax to create
 # radargrams. It takes a number of inputsl: with/without mine, RADAR frequency
-# and mine type.
+# and mine type. With --receivers a scene has several receivers at different
+# offsets and heights, so that one simulation gives several B-scans.
 #
 ################################################################################
 
@@ -20,7 +21,7 @@ import time
 
 #   Usage:
 #
-#     gpr-gen-new.py --name <str> [ --frequency <int> ] [ --with <int> ] [ --without <int> ] [ --mine_type <str> ] [ --out <str> ]
+#     gpr-gen-new.py --name <str> [ --frequency <int> ] [ --with <int> ] [ --without <int> ] [ --mine_type <str> ] [ --out <str> ] [ --receivers <int> ]
 #
 #     where:
 #
@@ -53,6 +54,12 @@ import time
 #                 appear then the default behaviour is to write to
 #                 the current directory.
 #
+#     --receivers <int> will be the number of receivers in each Model, placed
+#     -rx         at the offsets from the source and heights of RX_LAYOUT.
+#                 The --receivers parameter is optional. If it does not
+#                 appear then the default value of '1' is used, the
+#                 receiver 4cm from the source.
+#
 #   Examples
 #
 #   (1)     gpr-gen-new.py --name test --frequency 1 --with 1 --mine_type anti-personnel
@@ -89,6 +96,7 @@ import time
 #           --without, -x
 #           --mine_tpye, -mt
 #           --out, -o
+#           --receivers, -rx
 #
 #   Here are examples 1,2,3 and 4 written using their short-forms,
 #
@@ -142,6 +150,9 @@ parser.add_argument('-r','--rough',dest='rough_surface',action='store',
 parser.add_argument('-fi', '--fileid', dest='fileid', action='store',
                     help='id of file')
 
+parser.add_argument('-rx', '--receivers', dest='receivers', action='store',
+                    help='Number of receivers in each Model', default=1, type=int)
+
 args = parser.parse_args()
 
 #
@@ -184,6 +195,20 @@ rough_tag = str((args.rough_surface))
 domainDepthVal = 1.0
 domainDistanceVal = 2.0                               
 
+#
+# Source position and the receiver (offset from the source, height) of each
+# receiver. The source and receivers move 2cm per trace, so the offsets stay
+# within 5cm for the last trace to keep clear of the PML; the heights keep
+# clear of a rough surface.
+#
+srcX = 0.05
+srcY = 0.8
+RX_LAYOUT = [(0.04, 0.8), (0.02, 0.75), (-0.02, 0.85), (0.04, 0.75), (0.02, 0.85), (-0.02, 0.8)]
+
+if args.receivers < 1 or args.receivers > len(RX_LAYOUT):
+    print "Error -> --receivers must be between 1 and " + str(len(RX_LAYOUT))
+    exit(0)
+
 #################################
 # DEFINE MINE TYPE
 #################################
@@ -325,8 +350,10 @@ for fileCount in xrange(0, filesToBeCreated):
     f.write("#time_window: 16e-9" + NL)                                                        
     f.write("#pml_cells: 10 10 0 10 10 0" + NL)
     f.write("#waveform: ricker 1 " + str(args.frequency) + "e9"+ " my_ricker" + NL); 
-    f.write("#hertzian_dipole: z 0.05 0.8 0 my_ricker"+ NL)                  
-    f.write("#rx: 0.09 0.8 0" + NL)        
+    f.write("#hertzian_dipole: z " + str(srcX) + " " + str(srcY) + " 0 my_ricker"+ NL)
+    # gprMax names the receivers rx1, rx2, ... in this order
+    for offset, height in RX_LAYOUT[:args.receivers]:
+        f.write("#rx: " + str(round(srcX + offset, 3)) + " " + str(height) + " 0" + NL)
     f.write("#src_steps: 0.02 0 0" + NL)                       
     f.write("#rx_steps: 0.02 0 0" + NL)
     f.write("#material: 15.0 0.0 1.0 0.0 shale" + NL)
@@ -343,8 +370,6 @@ for fileCount in xrange(0, filesToBeCreated):
     #
     if rough_tag == 'y':
         f.write("#add_surface_roughness: 0 0.7 0 2.0 0.7 0.001 2.0 1 1 0.65 0.71 soil_box" + NL)
-    elif rough_tag == 'n':
-        continue
     #
     # Do we add a landmine in this image?
     # If so then we add it to a random x, y location
@@ -0,0 +1,139 @@
+################################################################################
+# hyperbola_methods.py
+#
+# Hyperbola proposals for localisation. A buried target shows up in a B-scan as
+# a hyperbola with its apex above the target and a width set by the velocity of
+# the soil. The strongest pixels of the clutter filtered B-scan vote for every
+# apex and velocity they are consistent with in a Hough style accumulator, and
+# the peaks of the accumulator are ranked candidate regions for the CNN. Pooled
+# accumulator maxima also make a fixed length feature vector for the SVM.
+################################################################################
+
+from __future__ import division
+import numpy as np
+from scipy.ndimage import maximum_filter
+import cv2
+from clutter_methods import clutter_filter
+
+# soil velocities in m/s, relative permittivity from about 25 down to 4
+DEFAULT_VELOCITIES = np.linspace(0.06e9, 0.15e9, 8)
+
+def velocity_slopes(velocities, dx, dt):
+    # slope of the hyperbola asymptotes in rows per column, for a column spacing
+    # of dx metres and a row spacing of dt seconds (two way travel time)
+    return 2 * dx / (np.asarray(velocities, dtype=np.float64) * dt)
+
+def edge_points(bscan, fraction=0.05):
+    # rows, columns and weights in [0 1] of the strongest fraction of pixels
+    magnitude = np.abs(bscan)
+    threshold = np.percentile(magnitude, 100 * (1 - fraction))
+    rows, cols = np.nonzero(magnitude > threshold)
+    if len(rows) == 0:
+        return rows, cols, np.zeros(0)
+
+    weights = magnitude[rows, cols]
+
+    return rows, cols, weights / weights.max()
+
+def hough_hyperbola(rows, cols, weights, shape, slopes, aperture, chunk_size=4096):
+    # accumulator of shape (slopes, height, width). Cell (k, r0, c0) is the mean
+    # weight of the points on the hyperbola
+    #     r = sqrt(r0^2 + (slopes[k] * (c - c0))^2)
+    # over the columns within aperture of the apex. Every point votes for every
+    # apex column in its aperture at once, one np.bincount per chunk of points.
+    height, width = shape
+    offsets = np.arange(-aperture, aperture + 1)
+    acc = np.zeros((len(slopes), height * width))
+
+    for k, slope in enumerate(slopes):
+        for start in range(0, len(rows), chunk_size):
+            r = rows[start:start + chunk_size, np.newaxis].astype(np.float64)
+            c0 = cols[start:start + chunk_size, np.newaxis] - offsets[np.newaxis,:]
+            r0_squared = r**2 - (slope * offsets[np.newaxis,:])**2
+
+            valid = (r0_squared >= 0) & (c0 >= 0) & (c0 < width)
+            r0 = np.round(np.sqrt(r0_squared[valid])).astype(int)
+            w = np.broadcast_to(weights[start:start + chunk_size, np.newaxis], valid.shape)[valid]
+
+            acc[k] += np.bincount(r0 * width + c0[valid], weights=w, minlength=height * width)
+
+    # number of columns of each apex aperture that lie inside the image
+    apex = np.arange(width)
+    support = np.minimum(apex + aperture, width - 1) - np.maximum(apex - aperture, 0) + 1
+
+    return acc.reshape(len(slopes), height, width) / support[np.newaxis,np.newaxis,:]
+
+def hyperbola_accumulator(bscan, dx, dt, velocities=DEFAULT_VELOCITIES, max_size=256,
+                          aperture=64, fraction=0.05, n_components=2):
+    # accumulator of a 2D (time, traces) B-scan with dx metres per column and dt
+    # seconds per row. The B-scan is shrunk so its longest side is at most
+    # max_size first, returns the accumulator and the (row, column) scale factors
+    # back to the B-scan. aperture is in B-scan columns.
+    height, width = bscan.shape
+    scale = min(1, max_size / max(height, width))
+    small = np.asarray(bscan, dtype=np.float32)
+    if scale < 1:
+        small = cv2.resize(small, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                           interpolation=cv2.INTER_AREA)
+    row_scale = height / small.shape[0]
+    col_scale = width / small.shape[1]
+
+    filtered = clutter_filter(small, n_components)
+    rows, cols, weights = edge_points(filtered, fraction)
+    slopes = velocity_slopes(velocities, dx * col_scale, dt * row_scale)
+    acc = hough_hyperbola(rows, cols, weights, small.shape, slopes,
+                          max(1, int(round(aperture / col_scale))))
+
+    return acc, row_scale, col_scale
+
+def hyperbola_proposals(bscan, dx, dt, velocities=DEFAULT_VELOCITIES, n_proposals=10,
+                        min_score=0.1, separation=32, **kwargs):
+    # ranked hyperbola apexes of a 2D (time, traces) B-scan, as arrays of apex
+    # column, apex row, velocity and score in the pixels of the B-scan. Only the
+    # best velocity is kept at each apex and apexes closer than separation pixels
+    # to a better one are dropped.
+    acc, row_scale, col_scale = hyperbola_accumulator(bscan, dx, dt, velocities, **kwargs)
+
+    size = (acc.shape[0],
+            2 * max(1, int(round(separation / row_scale))) + 1,
+            2 * max(1, int(round(separation / col_scale))) + 1)
+    peaks = (acc == maximum_filter(acc, size=size, mode='constant')) & (acc > min_score)
+    k, r, c = np.nonzero(peaks)
+
+    order = np.argsort(acc[k, r, c])[::-1][:n_proposals]
+    k, r, c = k[order], r[order], c[order]
+
+    return ((c + 0.5) * col_scale, (r + 0.5) * row_scale,
+            np.asarray(velocities)[k], acc[k, r, c])
+
+def proposal_windows(apex_x, apex_y, shape, winW, winH):
+    # top left corners of the (winH, winW) windows around each apex, centred on
+    # the apex column with the apex a quarter of the way down, clipped to the image
+    xs = np.clip(np.round(np.asarray(apex_x) - winW / 2), 0, max(0, shape[1] - winW)).astype(int)
+    ys = np.clip(np.round(np.asarray(apex_y) - winH / 4), 0, max(0, shape[0] - winH)).astype(int)
+
+    return xs, ys
+
+def hyperbola_features(images, dx, dt, velocities=DEFAULT_VELOCITIES, grid=(4, 4), max_size=64,
+                       aperture=None, fraction=0.05, n_components=0):
+    # fixed length descriptor of every image of a (height, width, images) stack,
+    # the largest accumulator score of each velocity in each cell of a grid over
+    # the apex positions. Returns a float32 (images, velocities * cells) array.
+    # The aperture defaults to half the image width.
+    height, width = images.shape[:2]
+    if aperture is None:
+        aperture = width // 2
+
+    features = np.empty((images.shape[2], len(velocities) * grid[0] * grid[1]), dtype=np.float32)
+    for i in range(images.shape[2]):
+        acc, _, _ = hyperbola_accumulator(images[:,:,i], dx, dt, velocities, max_size,
+                                          aperture, fraction, n_components)
+
+        # max pool the accumulator over the grid cells
+        row_edges = np.linspace(0, acc.shape[1], grid[0] + 1)[:-1].astype(int)
+        col_edges = np.linspace(0, acc.shape[2], grid[1] + 1)[:-1].astype(int)
+        pooled = np.maximum.reduceat(np.maximum.reduceat(acc, row_edges, axis=1), col_edges, axis=2)
+
+        features[i] = pooled.ravel()
+
+    return features
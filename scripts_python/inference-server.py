@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+################################################################################
+# inference-server.py
+#
+# Keeps the mine classifier loaded and serves it on loopback HTTP or a Unix
+# socket, so the cost of loading the net is paid once when the server starts
+# and not once per radargram. Windows of requests arriving together are scored
+# in one micro-batch. localise.py --server sends its windows here.
+#
+#   POST /classify  body .npy (n, height, width[, 1]) windows in [0 1],
+#                   returns .npy (n, classes) probabilities
+#   POST /heatmap   body .npy (height, width[, 1]) radargram in [0 1], query
+#                   step and size, returns .npy mean mine probability per pixel
+#   GET  /metrics   json queue depth, counters and latency percentiles
+#   GET  /health    "ok"
+################################################################################
+
+from __future__ import division
+import argparse
+import numpy as np
+import os, sys, time
+import json
+import signal
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from localise_methods import extract_windows, Heatmap
+from server_methods import MicroBatcher, to_npy, from_npy
+
+#   Usage:
+#
+#     inference-server.py --deploy <str> --weights <str>
+#
+#   where
+#     --deploy <str> caffe model definition and trained weights
+#     --weights
+#
+#     --address <str> optional, host:port to listen on (127.0.0.1:8765), or
+#     -a              the path of a Unix socket
+#
+#     --engine <str> optional, "caffe" (default), "numpy" or "int8" as in
+#     -e             localise.py
+#
+#     --quantized <str> optional, int8 engine, input scales saved by
+#                       quantize-net.py
+#
+#     --max_batch <int> optional, most windows joined into one micro-batch (256)
+#     -b
+#
+#     --max_wait <float> optional, most milliseconds a request waits for
+#     -w                 others to join its micro-batch (10)
+#
+
+parser = argparse.ArgumentParser(description='serve the mine classifier')
+
+parser.add_argument('--deploy', dest='model_deploy', default='/home/pwhc/skycap/gprlearn/models/caffe_files/deploy.prototxt', action='store', help='caffe model definition file')
+
+parser.add_argument('--weights', dest='pre_trained', default='/home/pwhc/skycap/Results/Fifth_Model/stage5/saved_models/snapshot_iter_140.caffemodel', action='store', help='caffe trained weights file')
+
+parser.add_argument('-a', '--address', dest='address', default='127.0.0.1:8765', action='store', help='host:port or Unix socket path to listen on')
+
+parser.add_argument('-e', '--engine', dest='engine', default='caffe', action='store', help='"caffe", "numpy" or "int8"')
+
+parser.add_argument('--quantized', dest='quantized', default=None, action='store', help='int8 engine, input scales saved by quantize-net.py')
+
+parser.add_argument('--caffe_root', dest='caffe_root', default=os.environ.get('CAFFE_ROOT', '/home/pwhc/skycap/deep-learning/caffe/'), action='store', help='caffe build directory, defaults to $CAFFE_ROOT')
+
+parser.add_argument('-b', '--max_batch', dest='max_batch', default=256, type=int, action='store', help='most windows in one micro-batch')
+
+parser.add_argument('-w', '--max_wait', dest='max_wait', default=10, type=float, action='store', help='most milliseconds a request waits for a micro-batch')
+
+args = parser.parse_args()
+
+if args.engine not in ('caffe', 'numpy', 'int8'):
+    raise ValueError('engine must be "caffe", "numpy" or "int8"')
+
+if args.engine == 'int8' and args.quantized is None:
+    raise ValueError('the int8 engine needs the scales saved by quantize-net.py, --quantized')
+
+print "Loading caffe model: " + str(args.pre_trained.split('/')[-1])
+start = time.time()
+
+if args.engine == 'caffe':
+    sys.path.insert(0, os.path.join(args.caffe_root, 'python'))
+    import caffe
+    from inference_methods import predict_images
+    caffe.set_mode_cpu()
+    net = caffe.Classifier(args.model_deploy, args.pre_trained, raw_scale = 255)
+    predict = lambda windows: predict_images(net, windows, args.max_batch)
+elif args.engine == 'numpy':
+    from numpy_net_methods import NumpyClassifier
+    net = NumpyClassifier(args.model_deploy, args.pre_trained, raw_scale = 255)
+    predict = lambda windows: net.predict(windows, args.max_batch)
+else:
+    from quantize_methods import QuantizedClassifier
+    net = QuantizedClassifier(args.model_deploy, args.pre_trained, scales = args.quantized, raw_scale = 255)
+    predict = lambda windows: net.predict(windows, args.max_batch)
+
+print "Loaded in %.1f s" % (time.time() - start)
+
+batcher = MicroBatcher(predict, args.max_batch, args.max_wait / 1000)
+
+def as_windows(array, ndim):
+    # add the channel axis the nets expect
+    return array[..., np.newaxis] if array.ndim == ndim else array
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _reply(self, status, body, content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path == "/metrics":
+            self._reply(200, json.dumps(batcher.metrics(), sort_keys=True), "application/json")
+        elif path == "/health":
+            self._reply(200, "ok\n", "text/plain")
+        else:
+            self._reply(404, "unknown path " + path + "\n", "text/plain")
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        try:
+            if url.path == "/classify":
+                windows = as_windows(from_npy(self._body()), 3)
+                self._reply(200, to_npy(batcher.submit(windows)))
+            elif url.path == "/heatmap":
+                image = as_windows(from_npy(self._body()), 2)
+                step = int(query.get("step", [64])[0])
+                size = int(query.get("size", [128])[0])
+                windows, xs, ys = extract_windows(image, step, size, size)
+                heatmap = Heatmap(image.shape[:2])
+                heatmap.add(xs, ys, size, size, batcher.submit(windows)[:,1])
+                self._reply(200, to_npy(heatmap.mean().astype(np.float32)))
+            else:
+                self._reply(404, "unknown path " + url.path + "\n", "text/plain")
+        except Exception as e:
+            self._reply(400, str(e) + "\n", "text/plain")
+
+    def log_message(self, format, *args):
+        # a Unix socket client has no host
+        host = self.client_address[0] if self.client_address else "unix"
+        sys.stderr.write("%s - - [%s] %s\n" % (host, self.log_date_time_string(), format % args))
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # one thread per connection, so that requests can meet in a micro-batch
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ThreadedUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+if ":" in args.address and not args.address.startswith("/"):
+    host, port = args.address.rsplit(":", 1)
+    server = ThreadedHTTPServer((host, int(port)), Handler)
+else:
+    if os.path.exists(args.address):
+        os.remove(args.address)
+    server = ThreadedUnixHTTPServer(args.address, Handler)
+
+# stop cleanly on kill as on ctrl-c, so the socket file is removed
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+print "Serving on " + args.address + " ..."
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    batcher.stop()
+    if not (":" in args.address and not args.address.startswith("/")):
+        os.remove(args.address)
@@ -0,0 +1,173 @@
+################################################################################
+# inference_methods.py
+#
+# Batched inference for caffe.Classifier nets. Images are decoded and
+# preprocessed in a thread pool while the net runs forward passes on whole
+# batches, the input blob is reshaped once for the batch size rather than the
+# net being called once per image.
+#
+# Also converts the window classifier in to a fully convolutional net that
+# scores every window position of a whole radargram in one forward pass.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import tempfile
+import os
+from multiprocessing.pool import ThreadPool
+import caffe
+from caffe.proto import caffe_pb2
+from google.protobuf import text_format
+
+def prepare_image(net, image):
+    # the same resize, centre crop and transform as caffe.Classifier.predict
+    # with oversample=False, for a single (height, width, channels) image
+    image = caffe.io.resize_image(image, net.image_dims)
+
+    center = np.array(net.image_dims) / 2.0
+    crop = np.tile(center, (1, 2))[0] + np.concatenate([-net.crop_dims / 2.0, net.crop_dims / 2.0])
+    crop = crop.astype(int)
+    image = image[crop[0]:crop[2], crop[1]:crop[3], :]
+
+    return net.transformer.preprocess(net.inputs[0], image)
+
+def load_and_prepare(net, image_name, color=False):
+    return prepare_image(net, caffe.io.load_image(image_name, color))
+
+def set_batch_size(net, batch_size):
+    # reshape the input blob (and the rest of the net) only when it changes
+    data = net.blobs[net.inputs[0]]
+    if data.data.shape[0] != batch_size:
+        data.reshape(batch_size, *data.data.shape[1:])
+        net.reshape()
+
+def forward_batches(net, batches, n_images, batch_size):
+    # run each preprocessed (n, channels, height, width) batch through the net and
+    # collect the output scores in one contiguous array
+    set_batch_size(net, batch_size)
+    data = net.blobs[net.inputs[0]].data
+    scores = None
+    start = 0
+
+    for batch in batches:
+        n = batch.shape[0]
+        data[:n] = batch
+        out = net.forward()[net.outputs[0]]
+        out = out.reshape(out.shape[0], -1)
+        if scores is None:
+            scores = np.empty((n_images, out.shape[1]), dtype=np.float32)
+        scores[start:start + n] = out[:n]
+        start += n
+
+    return scores
+
+def prepared_batches(pool, inputs, prepare, batch_size):
+    # double buffered, the next batch is prepared in the pool while the caller
+    # runs the current one through the net
+    pending = pool.map_async(prepare, inputs[0:batch_size])
+    for start in range(0, len(inputs), batch_size):
+        batch = np.array(pending.get(), dtype=np.float32)
+        if start + batch_size < len(inputs):
+            pending = pool.map_async(prepare, inputs[start + batch_size:start + 2*batch_size])
+        yield batch
+
+def predict(net, inputs, prepare, batch_size=64, threads=4):
+    # class scores for a list of inputs, shape (inputs, classes). prepare turns
+    # one input in to a preprocessed (channels, height, width) image.
+    if len(inputs) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+
+    batch_size = max(1, min(batch_size, len(inputs)))
+    pool = ThreadPool(threads)
+    try:
+        batches = prepared_batches(pool, list(inputs), prepare, batch_size)
+        return forward_batches(net, batches, len(inputs), batch_size)
+    finally:
+        pool.close()
+        pool.join()
+
+def predict_images(net, images, batch_size=64, threads=4):
+    # scores for images already loaded as (height, width, channels) arrays
+    return predict(net, images, lambda image: prepare_image(net, image), batch_size, threads)
+
+def predict_files(net, image_names, batch_size=64, threads=4, color=False):
+    # scores for image files, decoded in the thread pool
+    return predict(net, image_names, lambda name: load_and_prepare(net, name, color),
+                   batch_size, threads)
+
+################################################################################
+# fully convolutional conversion
+################################################################################
+
+def net_stride(net_param):
+    # product of the strides of every convolution and pooling layer, i.e. the
+    # distance in input pixels between neighbouring outputs of the dense net
+    stride = 1
+    for layer in net_param.layer:
+        if layer.type == "Convolution":
+            strides = layer.convolution_param.stride
+            stride *= strides[0] if len(strides) > 0 else 1
+        elif layer.type == "Pooling":
+            stride *= layer.pooling_param.stride or 1
+
+    return stride
+
+def fully_convolutional(model_deploy, pre_trained):
+    # recast every InnerProduct layer as a Convolution, the first one with a
+    # kernel covering its whole input blob and the rest as 1x1, then copy the
+    # trained weights across. Returns the dense net, the window size it was
+    # trained on and its stride.
+    net = caffe.Net(model_deploy, pre_trained, caffe.TEST)
+
+    net_param = caffe_pb2.NetParameter()
+    with open(model_deploy) as f:
+        text_format.Merge(f.read(), net_param)
+
+    converted = []
+    for layer in net_param.layer:
+        if layer.type != "InnerProduct":
+            continue
+        bottom_shape = net.blobs[layer.bottom[0]].data.shape
+        num_output = layer.inner_product_param.num_output
+
+        layer.type = "Convolution"
+        layer.ClearField("inner_product_param")
+        layer.convolution_param.num_output = num_output
+        if len(bottom_shape) == 4:
+            layer.convolution_param.kernel_h = bottom_shape[2]
+            layer.convolution_param.kernel_w = bottom_shape[3]
+        else:
+            layer.convolution_param.kernel_size.append(1)
+
+        # new name so caffe does not try to load the InnerProduct weights itself
+        converted.append((layer.name, layer.name + "-conv"))
+        layer.name = layer.name + "-conv"
+
+    # caffe.Net needs the definition on disk
+    fd, fc_deploy = tempfile.mkstemp(suffix=".prototxt")
+    with os.fdopen(fd, "w") as f:
+        f.write(text_format.MessageToString(net_param))
+    fc_net = caffe.Net(fc_deploy, pre_trained, caffe.TEST)
+    os.remove(fc_deploy)
+
+    for name, fc_name in converted:
+        for i in range(len(net.params[name])):
+            fc_net.params[fc_name][i].data.flat = net.params[name][i].data.flat
+
+    window = net.blobs[net.inputs[0]].data.shape[2:]
+
+    return fc_net, window, net_stride(net_param)
+
+def dense_scores(fc_net, image, raw_scale=255, mean=None):
+    # class scores for every window position of a 2D greyscale image in one
+    # forward pass, shape (classes, rows, cols). Output (i, j) is the window
+    # with its top left corner at (j*stride, i*stride) of the image.
+    data = np.asarray(image, dtype=np.float32) * raw_scale
+    if mean is not None:
+        data = data - mean
+
+    fc_net.blobs[fc_net.inputs[0]].reshape(1, 1, data.shape[0], data.shape[1])
+    fc_net.reshape()
+    fc_net.blobs[fc_net.inputs[0]].data[0,0] = data
+
+    return fc_net.forward()[fc_net.outputs[0]][0].copy()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+################################################################################
+# job-queue.py
+#
+# Fills and reports on the SQLite queue of simulation jobs that
+# queue-worker.py processes on every simulation host. Each .in file becomes
+# one job, the command with its {input}, {name}, {stem} and {dir}, queued with
+# its predicted cost so that the longest are leased first. Without --enqueue
+# it prints the jobs of each status and the predicted work left.
+################################################################################
+
+from __future__ import print_function
+import argparse
+import glob
+import os
+import sys
+from queue_methods import JobQueue, STATUSES
+from dag_methods import expand, item_variables
+from cost_methods import CostModel, format_duration
+
+#   Usage:
+#
+#     job-queue.py -q <str> [-e <str> -c <str>]
+#
+#   where
+#     --queue <str> this is the SQLite file of the queue, on a filesystem
+#     -q            every worker host sees
+#
+#     --enqueue <str> optional, directory of .in files or a glob of the files
+#     -e              to add, quoted for the shell
+#
+#     --command <str> optional, shell command of each job, e.g.
+#     -c              "python3 -m gprMax {input} -n 95 -gpu"
+#
+#     --max-attempts <int> optional, times a job is tried (3)
+#
+#     --cost-model <str> optional, coefficients calibrated by
+#                        simulation-cost.py, rough defaults without
+#
+#     --retry-failed optional, queue the failed jobs again
+#
+#     --list <str> optional, print the jobs with this status
+#
+
+parser = argparse.ArgumentParser(description='fill and report on the simulation job queue')
+
+parser.add_argument('-q', '--queue', required=True, dest='queue', action='store', help='SQLite file of the queue')
+
+parser.add_argument('-e', '--enqueue', dest='enqueue', default=None, action='store', help='directory or glob of .in files to add')
+
+parser.add_argument('-c', '--command', dest='command', default=None, action='store', help='shell command of each job')
+
+parser.add_argument('--max-attempts', dest='max_attempts', default=3, type=int, action='store', help='times a job is tried')
+
+parser.add_argument('--cost-model', dest='cost_model', default=None, action='store', help='coefficients calibrated by simulation-cost.py')
+
+parser.add_argument('--retry-failed', dest='retry_failed', default=False, action='store_true', help='queue the failed jobs again')
+
+parser.add_argument('--list', dest='list', default=None, choices=STATUSES, action='store', help='print the jobs with this status')
+
+args = parser.parse_args()
+
+if args.enqueue is not None and args.command is None:
+    parser.error('--enqueue needs the --command of the jobs')
+
+queue = JobQueue(args.queue)
+model = CostModel(args.cost_model)
+
+if args.enqueue is not None:
+    pattern = os.path.join(args.enqueue, "*.in") if os.path.isdir(args.enqueue) else args.enqueue
+    jobs = []
+    for filename in sorted(glob.glob(pattern)):
+        filename = os.path.abspath(filename)
+        command = expand(args.command, item_variables(filename))
+        jobs.append((filename, command, model.predict_file(filename, command)))
+    added = queue.enqueue(jobs, args.max_attempts)
+    print("Queued %d of %d jobs" % (added, len(jobs)))
+
+if args.retry_failed:
+    print("Queued %d failed jobs again" % queue.retry_failed())
+
+counts = queue.counts()
+print(", ".join("%d %s" % (counts[status], status) for status in STATUSES))
+
+left = [job["cost"] for job in queue.jobs() if job["status"] in ("queued", "leased") and job["cost"] is not None]
+if left:
+    print("Predicted work left %s" % format_duration(sum(left)))
+
+if args.list is not None:
+    for job in queue.jobs(args.list):
+        print("%-40s attempts %d  %s  %s" % (os.path.basename(job["input"]), job["attempts"],
+                                             job["worker"] or "", job["error"] or ""))
+
+queue.close()
@@ -47,7 +47,7 @@ def read_mine_position(data_type,filename,col_num, dataDir):
 
 def resize(data, (new_height, new_width)):
     if len(data.shape) > 2:
-        new_array = np.zeros((new_height, new_width, data.shape[2]))
+        new_array = np.zeros((new_height, new_width, data.shape[2]), dtype=data.dtype)
         for i in range(data.shape[2]):
             new_array[:,:,i] = cv2.resize(data[:,:,i], (new_height,new_width))
 
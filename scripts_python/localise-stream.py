@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+################################################################################
+# localise-stream.py
+#
+# Localises mine signatures along a survey line of any length, reading the
+# traces a block at a time. Only the overlap the next window needs is kept in
+# memory, and each detection is written out as soon as it is final, so the
+# memory used does not depend on the length of the line.
+################################################################################
+
+from __future__ import division
+import argparse
+import numpy as np
+import os, sys, time
+import h5py
+import cv2
+from cascade_methods import FirstStage
+from localise_methods import StreamLocaliser, TraceNormaliser
+
+#   Usage:
+#
+#     localise-stream.py -i <str> -o <str>
+#
+#   where
+#     --input <str> this is the survey line, a merged gprMax .out file or a
+#     -i            (time, traces) .npy file of raw traces, or a radargram
+#                   image already rendered by post_process.py
+#
+#     --output <str> this is the csv file detections are appended to as
+#     -o             x,y,width,height,score,trace in radargram pixels, "-" for
+#                    stdout
+#
+#     --chunk <int> optional, number of traces read at a time (10)
+#     -k
+#
+#     --field <str> optional, field of a .out file (Ez)
+#     -f
+#
+#     --height <int> optional, rows the time axis of raw traces is resized to,
+#     -ht            as in the radargrams the net was trained on (1000)
+#
+#     --tracepixels <float> optional, radargram columns per raw trace (2000/95)
+#     -tp
+#
+#     --engine <str> optional, "caffe" (default), "numpy" to run the net
+#     -e             without a caffe build or "int8" to run it quantized with
+#                    the input scales given by --quantized
+#
+#     --forget <float> optional, forgetting factor of the running background
+#     -fg              removed from raw traces (0.99)
+#
+#     --rank <int> optional, number of eigenimages removed from raw traces by
+#     -rk          the online clutter filter, 0 removes only the mean trace (2)
+#
+
+parser = argparse.ArgumentParser(description='localise mine signatures along a survey line')
+
+parser.add_argument('-i', '--input', required=True, dest='input', action='store', help='survey line .out, .npy or image file')
+
+parser.add_argument('-o', '--output', required=True, dest='output', action='store', help='csv file for detections, "-" for stdout')
+
+parser.add_argument('-k', '--chunk', dest='chunk', default=10, type=int, action='store', help='number of traces read at a time')
+
+parser.add_argument('-f', '--field', dest='field', default='Ez', action='store', help='field of a .out file')
+
+parser.add_argument('-ht', '--height', dest='height', default=1000, type=int, action='store', help='rows the time axis of raw traces is resized to')
+
+parser.add_argument('-tp', '--tracepixels', dest='trace_pixels', default=2000/95, type=float, action='store', help='radargram columns per raw trace')
+
+parser.add_argument('-fg', '--forget', dest='forget', default=0.99, type=float, action='store', help='forgetting factor of the running background')
+
+parser.add_argument('-rk', '--rank', dest='rank', default=2, type=int, action='store', help='number of eigenimages removed from raw traces')
+
+parser.add_argument('--deploy', dest='model_deploy', default='/home/pwhc/skycap/gprlearn/models/caffe_files/deploy.prototxt', action='store', help='caffe model definition file')
+
+parser.add_argument('--weights', dest='pre_trained', default='/home/pwhc/skycap/Results/Fifth_Model/stage5/saved_models/snapshot_iter_140.caffemodel', action='store', help='caffe trained weights file')
+
+parser.add_argument('-c', '--cascade', dest='cascade', default=None, action='store', help='first stage saved by calibrate-cascade.py')
+
+parser.add_argument('-t', '--threshold', dest='threshold', default=0.5, type=float, action='store', help='mine probability above which a window is a detection')
+
+parser.add_argument('-b', '--batch_size', dest='batch_size', default=256, type=int, action='store', help='number of windows per forward pass')
+
+parser.add_argument('-e', '--engine', dest='engine', default='caffe', action='store', help='"caffe", "numpy" to run the net without a caffe build or "int8" to run it quantized')
+
+parser.add_argument('--quantized', dest='quantized', default=None, action='store', help='int8 engine, input scales saved by quantize-net.py')
+
+parser.add_argument('--caffe_root', dest='caffe_root', default=os.environ.get('CAFFE_ROOT', '/home/pwhc/skycap/deep-learning/caffe/'), action='store', help='caffe build directory, defaults to $CAFFE_ROOT')
+
+args = parser.parse_args()
+
+if args.engine not in ('caffe', 'numpy', 'int8'):
+    raise ValueError('engine must be "caffe", "numpy" or "int8"')
+
+if args.engine == 'int8' and args.quantized is None:
+    raise ValueError('the int8 engine needs the scales saved by quantize-net.py, --quantized')
+
+# caffe is only needed by the caffe engine
+if args.engine == 'caffe':
+    sys.path.insert(0, os.path.join(args.caffe_root, 'python'))
+    import caffe
+    from inference_methods import predict_images
+elif args.engine == 'numpy':
+    from numpy_net_methods import NumpyClassifier
+else:
+    from quantize_methods import QuantizedClassifier
+
+def trace_blocks(filename, chunk):
+    # (time, traces) blocks of a survey line, only one block is read at a time
+    if filename.endswith(".out"):
+        with h5py.File(filename, 'r') as f:
+            data = f['/rxs/rx1/' + args.field]
+            for start in range(0, data.shape[1], chunk):
+                yield np.asarray(data[:, start:start + chunk])
+    else:
+        data = np.load(filename, mmap_mode='r')
+        for start in range(0, data.shape[1], chunk):
+            yield np.asarray(data[:, start:start + chunk])
+
+def rendered_blocks(filename, chunk):
+    # (height, columns, 1) blocks in [0 1] as the net expects them
+    if not filename.endswith((".out", ".npy")):
+        # already rendered, the image is read whole and handed out in blocks
+        image = cv2.imread(filename, 0)
+        step = max(1, int(round(chunk * args.trace_pixels)))
+        for start in range(0, image.shape[1], step):
+            yield image[:, start:start + step, np.newaxis] / 255.0
+        return
+
+    normaliser = TraceNormaliser(args.forget, args.rank)
+    traces = 0
+    for block in trace_blocks(filename, chunk):
+        # columns are counted over the whole line so that rounding does not drift
+        start = int(round(traces * args.trace_pixels))
+        traces += block.shape[1]
+        width = int(round(traces * args.trace_pixels)) - start
+
+        block = normaliser.transform(block)
+        block = cv2.resize(block, (width, args.height), interpolation=cv2.INTER_LINEAR)
+        yield block[:,:,np.newaxis]
+
+if args.engine == 'numpy':
+    net = NumpyClassifier(args.model_deploy, args.pre_trained, raw_scale = 255)
+elif args.engine == 'int8':
+    net = QuantizedClassifier(args.model_deploy, args.pre_trained, scales = args.quantized, raw_scale = 255)
+else:
+    caffe.set_mode_cpu()
+    net = caffe.Classifier(args.model_deploy, args.pre_trained, raw_scale = 255)
+
+def cnn(windows):
+    # convnet mine probability of each window
+    if args.engine != 'caffe':
+        return net.predict(windows, args.batch_size)[:,1]
+
+    return predict_images(net, windows, args.batch_size)[:,1]
+
+first_stage = None
+if args.cascade is not None:
+    first_stage = FirstStage().load(args.cascade)
+
+def classify(windows):
+    # windows rejected by the first stage score 0 without reaching the convnet
+    scores = np.zeros(len(windows), dtype=np.float32)
+    survivors = np.arange(len(windows))
+    if first_stage is not None:
+        survivors = np.nonzero(first_stage.passes(windows))[0]
+    if len(survivors) > 0:
+        scores[survivors] = cnn(windows[survivors])
+
+    return scores
+
+localiser = StreamLocaliser(classify, 64, 128, 128, args.threshold)
+
+out = sys.stdout if args.output == '-' else open(args.output, 'a')
+
+def write(detections):
+    for (x, y, w, h, score) in detections:
+        out.write("%d,%d,%d,%d,%.4f,%.1f\n" % (x, y, w, h, score, x / args.trace_pixels))
+    out.flush()
+
+print >> sys.stderr, "Localising mine signatures along " + args.input + " ..."
+
+start = time.time()
+columns = 0
+detections = 0
+for block in rendered_blocks(args.input, args.chunk):
+    arrived = time.time()
+    columns += block.shape[1]
+    found = localiser.push(block)
+    write(found)
+    detections += len(found)
+    print >> sys.stderr, "columns %d, detections %d, block latency %.2f s" % (columns, detections, time.time() - arrived)
+
+found = localiser.flush()
+write(found)
+detections += len(found)
+
+print >> sys.stderr, "%d detections in %d columns, %d windows scored, %.1f s" % (detections, columns, localiser.evaluations, time.time() - start)
+
+if out is not sys.stdout:
+    out.close()
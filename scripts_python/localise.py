@@ -7,10 +7,11 @@ import os
 import imutils
 import time
 import sys
-caffe_root = '/home/pwhc/skycap/deep-learning/caffe/'
-sys.path.insert(0, caffe_root +'python')
-import caffe
 import matplotlib.pylab as plt
+from cascade_methods import FirstStage
+from hyperbola_methods import hyperbola_proposals, proposal_windows
+from trace_methods import Stage
+from localise_methods import extract_windows, windows_at, window_positions, resize_image, pyramid, Heatmap, adaptive_search
 
 parser = argparse.ArgumentParser(description='localise mine signature')
 
@@ -18,8 +19,66 @@ parser.add_argument('-i', '--image', required=True, dest='radargram', action='st
 
 parser.add_argument('-d', '--directory', required=True, dest='output_dir', action='store',help='directory to store radargram with localised mine sig')
 
+parser.add_argument('-m', '--mode', dest='mode', default='sliding', action='store', help='"sliding" to classify each window separately, "adaptive" to refine a coarse grid of windows only around likely signatures, "hyperbola" to classify only windows around hyperbola proposals or "dense" to score the whole radargram in one pass of a fully convolutional net')
+
+parser.add_argument('--deploy', dest='model_deploy', default='/home/pwhc/skycap/gprlearn/models/caffe_files/deploy.prototxt', action='store', help='caffe model definition file')
+
+parser.add_argument('--weights', dest='pre_trained', default='/home/pwhc/skycap/Results/Fifth_Model/stage5/saved_models/snapshot_iter_140.caffemodel', action='store', help='caffe trained weights file')
+
+parser.add_argument('-s', '--scales', dest='scales', default='1', action='store', help='comma separated pyramid scales, e.g. "1,0.75,0.5" to also find signatures larger than one window')
+
+parser.add_argument('-b', '--batch_size', dest='batch_size', default=256, type=int, action='store', help='number of windows per forward pass')
+
+parser.add_argument('-t', '--threshold', dest='threshold', default=0.5, type=float, action='store', help='mine probability above which a window is a detection')
+
+parser.add_argument('--coarse_step', dest='coarse_step', default=128, type=int, action='store', help='adaptive mode, window spacing of the first coarse grid')
+
+parser.add_argument('--min_step', dest='min_step', default=16, type=int, action='store', help='adaptive mode, smallest window spacing to refine to')
+
+parser.add_argument('--proposals', dest='proposals', default=10, type=int, action='store', help='hyperbola mode, maximum number of hyperbola proposals to classify')
+
+parser.add_argument('--min_score', dest='min_score', default=0.1, type=float, action='store', help='hyperbola mode, smallest accumulator score of a proposal')
+
+parser.add_argument('--traces', dest='traces', default=95, type=int, action='store', help='hyperbola mode, number of traces across the radargram, 0.02 m apart')
+
+parser.add_argument('--time_window', dest='time_window', default=16e-9, type=float, action='store', help='hyperbola mode, time window in seconds down the radargram')
+
+parser.add_argument('-c', '--cascade', dest='cascade', default=None, action='store', help='first stage saved by calibrate-cascade.py, windows it rejects are not passed to the convnet (sliding, adaptive and hyperbola modes)')
+
+parser.add_argument('-e', '--engine', dest='engine', default='caffe', action='store', help='"caffe", "numpy" to run the net without a caffe build or "int8" to run it quantized (not in dense mode)')
+
+parser.add_argument('--quantized', dest='quantized', default=None, action='store', help='int8 engine, input scales saved by quantize-net.py')
+
+parser.add_argument('--caffe_root', dest='caffe_root', default=os.environ.get('CAFFE_ROOT', '/home/pwhc/skycap/deep-learning/caffe/'), action='store', help='caffe build directory, defaults to $CAFFE_ROOT')
+
+parser.add_argument('--server', dest='server', default=None, action='store', help='host:port or Unix socket of inference-server.py, windows are scored there instead of loading the net here (not in dense mode)')
+
 args = parser.parse_args()
 
+if args.mode not in ('sliding', 'adaptive', 'hyperbola', 'dense'):
+	raise ValueError('mode must be "sliding", "adaptive", "hyperbola" or "dense"')
+
+if args.engine not in ('caffe', 'numpy', 'int8'):
+	raise ValueError('engine must be "caffe", "numpy" or "int8"')
+
+if args.engine == 'int8' and args.quantized is None:
+	raise ValueError('the int8 engine needs the scales saved by quantize-net.py, --quantized')
+
+if (args.engine != 'caffe' or args.server is not None) and args.mode == 'dense':
+	raise ValueError('dense mode needs the caffe engine')
+
+# caffe is only needed by the caffe engine
+if args.server is not None:
+	from server_methods import InferenceClient
+elif args.engine == 'caffe':
+	sys.path.insert(0, os.path.join(args.caffe_root, 'python'))
+	import caffe
+	from inference_methods import fully_convolutional, dense_scores, predict_images
+elif args.engine == 'numpy':
+	from numpy_net_methods import NumpyClassifier
+else:
+	from quantize_methods import QuantizedClassifier
+
 # directory to store scaled images with bounding boxes
 os.mkdir(args.output_dir)
 
@@ -27,100 +86,260 @@ os.mkdir(args.output_dir)
 image = cv2.imread(args.radargram)
 
 # set path to model definition file, pretrained weights and image to be classified
-model_deploy = '/home/pwhc/skycap/gprlearn/models/caffe_files/deploy.prototxt'
-pre_trained = '/home/pwhc/skycap/Results/Fifth_Model/stage5/saved_models/snapshot_iter_140.caffemodel'
+model_deploy = args.model_deploy
+pre_trained = args.pre_trained
+
+if args.server is not None:
+	print "Scoring windows on the inference server at " + args.server
+else:
+	print "Loading caffe model: " + str(pre_trained.split('/')[-1])
+
+if args.server is not None:
+	# the net stays loaded in inference-server.py
+	net = InferenceClient(args.server)
+elif args.engine == 'numpy':
+	# the same net and preprocessing in numpy
+	net = NumpyClassifier(model_deploy, pre_trained, raw_scale = 255)
+elif args.engine == 'int8':
+	net = QuantizedClassifier(model_deploy, pre_trained, scales = args.quantized, raw_scale = 255)
+elif args.mode in ('sliding', 'adaptive', 'hyperbola'):
+	# set caffe to cpu mode
+	caffe.set_mode_cpu()
+
+	# define convnet
+	net = caffe.Classifier(	model_deploy,       # defines the structure of the model
+	                		pre_trained,		# contains the trained weights
+		                	raw_scale = 255)    # define scale of image
+else:
+	caffe.set_mode_cpu()
+
+	# InnerProduct layers recast as convolutions, one pass scores every window
+	fc_net, net_window, net_stride = fully_convolutional(model_deploy, pre_trained)
+
+# cheap first stage of the cascade
+first_stage = None
+if args.cascade is not None:
+	first_stage = FirstStage().load(args.cascade)
+
+def cnn(windows):
+	# convnet mine probability of each window
+	if args.server is not None:
+		return net.classify(windows)[:,1]
+	if args.engine != 'caffe':
+		return net.predict(windows, args.batch_size)[:,1]
+
+	return predict_images(net, windows, args.batch_size)[:,1]
+
+def classify(windows):
+	# mine probability of each window and the number of convnet evaluations,
+	# windows rejected by the first stage score 0 without reaching the convnet
+	if first_stage is None:
+		return cnn(windows), len(windows)
+
+	scores = np.zeros(len(windows), dtype=np.float32)
+	survivors = np.nonzero(first_stage.passes(windows))[0]
+	if len(survivors) > 0:
+		scores[survivors] = cnn(windows[survivors])
+
+	return scores, len(survivors)
+
+
+def localise(grey,stepSize,winW,winH,scales):
+
+	print ""
+	print "Localising mine signature with sliding windows ..."
+	print ""
 
-print "Loading caffe model: " + str(pre_trained.split('/')[-1])
+	heatmap = Heatmap(grey.shape[:2])
 
-# set caffe to cpu mode
-caffe.set_mode_cpu()
+	# create lists for bouding box co-ordinates
+	image_predictions = []
+	image_posX = []
+	image_posY = []
+	image_size = []
+	evaluations = 0
 
-# define convnet
-net = caffe.Classifier(	model_deploy,       # defines the structure of the model
-                		pre_trained,		# contains the trained weights
-	                	raw_scale = 255)    # define scale of image
+	# slide the window over each layer of the pyramid, all windows of a layer are
+	# cut out at once and classified in batches
+	for (scale, layer) in pyramid(grey, scales, winW, winH):
+		windows, xs, ys = extract_windows(layer, stepSize, winW, winH)
 
+		# convnet mine probability for every window
+		scores, n = classify(windows)
+		evaluations += n
 
-def sliding_window(image, stepSize, windowSize):
+		# save highest scoring windows and coordinates, back in radargram pixels
+		keep = scores > args.threshold
+		heatmap.add(xs[keep] / scale, ys[keep] / scale, winW / scale, winH / scale, scores[keep])
 
-	# slide a window across the image
-	for y in xrange(0, image.shape[0], stepSize):
-		for x in xrange(0, image.shape[1], stepSize):
-			# yield the current window
-			yield (x, y, image[y:y + windowSize[1], x:x + windowSize[0]])
+		image_predictions.extend(scores[keep])
+		image_posX.extend(np.round(xs[keep] / scale).astype(int))
+		image_posY.extend(np.round(ys[keep] / scale).astype(int))
+		image_size.extend([int(round(winW / scale))] * np.count_nonzero(keep))
 
+	print "Network evaluations: " + str(evaluations)
 
-def updte_heatmap(heatmap,prediction,x,y,winW,winH):
+	return image_predictions, image_posX, image_posY, image_size, heatmap.mean()
 
-	window = heatmap[y:y + winW, x:x + winH]
+def localise_adaptive(grey,coarse_step,min_step,winW,winH,scales):
+
+	print ""
+	print "Localising mine signature with a coarse to fine window search ..."
+	print ""
 
-	idx = np.where(window > 0)
+	heatmap = Heatmap(grey.shape[:2])
+	layers = dict(pyramid(grey, scales, winW, winH))
+	counter = {'evaluations': 0}
 
-	if len(idx[0] > 0):
-		window[idx] = np.divide(window[idx] + prediction, 2)
+	def score_windows(xs, ys, scale):
+		# windows are given in radargram pixels, cut them out of the pyramid layer
+		layer = layers.get(scale)
+		if layer is None:
+			layer = layers[scale] = resize_image(grey, scale)
+		windows = windows_at(layer, np.round(xs * scale), np.round(ys * scale), winW, winH)
+		scores, n = classify(windows)
+		counter['evaluations'] += n
 
-	idx = np.where(window == 0)
+		return scores
 
-	window[idx] = prediction
+	xs, ys, ss, scores, best = adaptive_search(score_windows, grey.shape[:2], winW, winH,
+	                                           [round(scale, 4) for scale in scales],
+	                                           coarse_step, min_step, args.threshold)
 
-	heatmap[y:y + winW, x:x + winH] = window
+	keep = scores > args.threshold
+	heatmap.add(xs[keep], ys[keep], winW / ss[keep], winH / ss[keep], scores[keep])
 
-	return heatmap 
+	# number of windows the sliding search would have scored at the finest step
+	full = 0
+	for (scale, layer) in pyramid(grey, scales, winW, winH):
+		step = max(1, int(round(min_step * scale)))
+		full += len(window_positions(layer.shape[0], winH, step)) * len(window_positions(layer.shape[1], winW, step))
 
-def localise(image,stepSize,winW,winH):
+	print "Network evaluations: " + str(counter['evaluations']) + " (" + str(full) + " for a full grid at step " + str(min_step) + ")"
+	print "Best boxes: " + str(len(best))
+
+	image_predictions = list(scores[keep])
+	image_posX = list(xs[keep].astype(int))
+	image_posY = list(ys[keep].astype(int))
+	image_size = list(np.round(winW / ss[keep]).astype(int))
+
+	return image_predictions, image_posX, image_posY, image_size, heatmap.mean()
+
+def localise_hyperbola(grey,winW,winH,scales):
 
 	print ""
-	print "Localising mine signature with sliding windows ..."
+	print "Localising mine signature around hyperbola proposals ..."
 	print ""
 
-	heatmap = np.zeros([image.shape[0],image.shape[1]])
+	heatmap = Heatmap(grey.shape[:2])
+
+	# the radargram has already been clutter filtered by post_process.py
+	dx = args.traces * 0.02 / grey.shape[1]
+	dt = args.time_window / grey.shape[0]
+	apex_x, apex_y, velocity, votes = hyperbola_proposals(grey[:,:,0], dx, dt, n_proposals=args.proposals,
+	                                                      min_score=args.min_score, n_components=0)
+	for i in range(len(apex_x)):
+		print "Proposal: apex (%d, %d), velocity %.3f m/ns, score %.3f" % (apex_x[i], apex_y[i], velocity[i] / 1e9, votes[i])
 
-	# create lists for bouding box co-ordinates
 	image_predictions = []
 	image_posX = []
 	image_posY = []
+	image_size = []
+	evaluations = 0
 
-	# loop over the sliding window for each layer of the pyramid
-	for (x, y, window) in sliding_window(image, stepSize, windowSize=(winW, winH)):
+	# only the windows around each proposal are classified, at every scale
+	for (scale, layer) in pyramid(grey, scales, winW, winH):
+		if len(apex_x) == 0:
+			break
+		xs, ys = proposal_windows(apex_x * scale, apex_y * scale, layer.shape[:2], winW, winH)
+		scores, n = classify(windows_at(layer, xs, ys, winW, winH))
+		evaluations += n
+
+		keep = scores > args.threshold
+		heatmap.add(xs[keep] / scale, ys[keep] / scale, winW / scale, winH / scale, scores[keep])
+
+		image_predictions.extend(scores[keep])
+		image_posX.extend(np.round(xs[keep] / scale).astype(int))
+		image_posY.extend(np.round(ys[keep] / scale).astype(int))
+		image_size.extend([int(round(winW / scale))] * np.count_nonzero(keep))
+
+	print "Network evaluations: " + str(evaluations)
+
+	return image_predictions, image_posX, image_posY, image_size, heatmap.mean()
+
+def localise_dense(grey,winW,winH,scales):
+
+	print ""
+	print "Localising mine signature with a fully convolutional net ..."
+	print ""
+
+	heatmap = Heatmap(grey.shape[:2])
+
+	image_predictions = []
+	image_posX = []
+	image_posY = []
+	image_size = []
 
-	    # convnet prediction on window
-		prediction = net.predict([window],oversample=False)
+	# scaled so that one window of the radargram is the size of the window the
+	# net was trained on
+	net_scale = net_window[0] / winH
 
-		# save highest scoring windows and coordinates
-		if prediction[0][0] > 0.5:
+	for (scale, layer) in pyramid(grey, [scale * net_scale for scale in scales], net_window[1], net_window[0]):
+		# mine probability for every window position, neighbouring positions are
+		# net_stride pixels apart in the scaled image
+		scores = dense_scores(fc_net, layer[:,:,0])[1]
 
-			heatmap = updte_heatmap(heatmap,prediction[0][1],x,y,winW,winH)
+		rows, cols = np.nonzero(scores > args.threshold)
+		xs = cols * net_stride / scale
+		ys = rows * net_stride / scale
+		size = net_window[0] / scale
+		heatmap.add(xs, ys, size, size, scores[rows, cols])
 
-			image_predictions.append(prediction[0][1])
-			image_posX.append(x)
-			image_posY.append(y)
+		image_predictions.extend(scores[rows, cols])
+		image_posX.extend(np.round(xs).astype(int))
+		image_posY.extend(np.round(ys).astype(int))
+		image_size.extend([int(round(size))] * len(rows))
 
-	return image, image_predictions, image_posX, image_posY,heatmap
+	return image_predictions, image_posX, image_posY, image_size, heatmap.mean()
 
-def visualise(output_dir,image_name,image,preictions,posX,posY,winW,winH):
+def visualise(output_dir,image_name,image,preictions,posX,posY,size):
 
 	# naming convention to scaled images
 	name = image_name.split('/')[-1].split('.')[0]
 
-	# pull out coordinates of 
-	top_left_x = min(posX) 
-	top_left_y = min(posY)
-	bottom_right_x = max(posX)
-	bottom_right_y = max(posY)
+	# visualise bounding box around all positive windows of the image
+	if len(posX) > 0:
+		top_left_x = min(posX)
+		top_left_y = min(posY)
+		bottom_right_x = max(np.add(posX, size))
+		bottom_right_y = max(np.add(posY, size))
 
-	# visualise bounding boxes for image
-	for i in range(len(posX)):
-		cv2.rectangle(image, (top_left_x, top_left_y), (bottom_right_x + winW, bottom_right_y + winH), (0, 255, 0),2)
+		cv2.rectangle(image, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), (0, 255, 0),2)
 	cv2.imshow("Window", image)
 	cv2.waitKey(0)
 	cv2.imwrite(output_dir+'/'+name+'.png',image)
 	cv2.destroyAllWindows()
 
-resised_images, predictions, posX, posY, heatmap = localise(image,64,128,128)
+# greyscale radargram in [0 1], as the classifier was trained on
+if args.engine != 'caffe' or args.server is not None:
+	grey = (cv2.imread(args.radargram, 0) / 255.0).astype(np.float32)[:,:,np.newaxis]
+else:
+	grey = caffe.io.load_image(args.radargram,False)
+scales = [float(scale) for scale in args.scales.split(',')]
+
+# timed in the trace when $GPR_TRACE is set
+with Stage("localise." + args.mode, file=args.radargram, engine=args.engine):
+	if args.mode == 'sliding':
+		predictions, posX, posY, size, heatmap = localise(grey,64,128,128,scales)
+	elif args.mode == 'hyperbola':
+		predictions, posX, posY, size, heatmap = localise_hyperbola(grey,128,128,scales)
+	elif args.mode == 'adaptive':
+		predictions, posX, posY, size, heatmap = localise_adaptive(grey,args.coarse_step,args.min_step,128,128,scales)
+	else:
+		predictions, posX, posY, size, heatmap = localise_dense(grey,128,128,scales)
 
 print heatmap.shape
 print heatmap
 plt.imshow(heatmap,format='jpg')
 
-visualise(args.output_dir,args.radargram,image,predictions, posX, posY, 128, 128)
-			
\ No newline at end of file
+visualise(args.output_dir,args.radargram,image,predictions, posX, posY, size)
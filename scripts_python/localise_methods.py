@@ -0,0 +1,380 @@
+################################################################################
+# localise_methods.py
+#
+# Window extraction, image pyramids and heatmap accumulation used to localise
+# mine signatures in radargrams. Windows are cut out as strided views and the
+# heatmap is updated in bulk for a whole batch of window scores. Also holds
+# non-maximum suppression, a coarse to fine adaptive window search and a
+# streaming localiser for survey lines that arrive a block of traces at a time.
+################################################################################
+
+from __future__ import division
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import cv2
+from scipy.signal import lfilter
+from clutter_methods import OnlineClutterFilter
+
+def window_positions(length, window, step):
+    # start positions of the windows along one axis, the last window is aligned
+    # with the edge so that the whole axis is covered
+    if length <= window:
+        return np.array([0])
+
+    positions = np.arange(0, length - window + 1, step)
+    if positions[-1] != length - window:
+        positions = np.append(positions, length - window)
+
+    return positions
+
+def pad_to_window(image, winW, winH):
+    # edge pad images smaller than one window
+    pad_y = max(0, winH - image.shape[0])
+    pad_x = max(0, winW - image.shape[1])
+    if pad_y == 0 and pad_x == 0:
+        return image
+
+    padding = ((0, pad_y), (0, pad_x)) + ((0, 0),) * (image.ndim - 2)
+    return np.pad(image, padding, mode='edge')
+
+def window_view(image, winW, winH):
+    # strided view of every possible (winH, winW) window, indexed [y, x]
+    shape = (image.shape[0] - winH + 1, image.shape[1] - winW + 1, winH, winW) + image.shape[2:]
+    return as_strided(image, shape=shape, strides=image.strides[:2] + image.strides)
+
+def extract_windows(image, stepSize, winW, winH):
+    # every (winH, winW) window of a (height, width[, channels]) image on a grid
+    # with spacing stepSize. Returns the windows as one (n, winH, winW[, channels])
+    # array and their x and y positions.
+    image = pad_to_window(np.ascontiguousarray(image), winW, winH)
+    ys = window_positions(image.shape[0], winH, stepSize)
+    xs = window_positions(image.shape[1], winW, stepSize)
+
+    grid_y, grid_x = np.meshgrid(ys, xs, indexing='ij')
+    grid_y = grid_y.ravel()
+    grid_x = grid_x.ravel()
+
+    return window_view(image, winW, winH)[grid_y, grid_x], grid_x, grid_y
+
+def windows_at(image, xs, ys, winW, winH):
+    # the windows with top left corners at (xs[i], ys[i]), clipped to the image
+    image = pad_to_window(np.ascontiguousarray(image), winW, winH)
+    xs = np.clip(np.asarray(xs, dtype=int), 0, image.shape[1] - winW)
+    ys = np.clip(np.asarray(ys, dtype=int), 0, image.shape[0] - winH)
+
+    return window_view(image, winW, winH)[ys, xs]
+
+def resize_image(image, scale):
+    # cv2 drops a trailing single channel, put it back
+    dims = (max(1, int(round(image.shape[1] * scale))), max(1, int(round(image.shape[0] * scale))))
+    resized = cv2.resize(image, dims, interpolation=cv2.INTER_AREA)
+    if image.ndim == 3 and resized.ndim == 2:
+        resized = resized[:,:,np.newaxis]
+
+    return resized
+
+def pyramid(image, scales, winW, winH):
+    # image at each scale, levels smaller than one window are skipped
+    for scale in scales:
+        if scale == 1:
+            yield scale, image
+            continue
+
+        level = resize_image(image, scale)
+        if level.shape[0] < winH or level.shape[1] < winW:
+            continue
+
+        yield scale, level
+
+class Heatmap(object):
+    # mean window score at each pixel, kept as a sum and a count buffer. Each
+    # window adds to its rectangle through the four corners of a 2D difference
+    # array, so a batch of any number of windows is one np.add.at scatter and the
+    # cost of reading the map is one cumulative sum per axis.
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.sum_diff = np.zeros((shape[0] + 1, shape[1] + 1))
+        self.count_diff = np.zeros((shape[0] + 1, shape[1] + 1))
+
+    def add(self, x, y, w, h, scores):
+        # x, y, w, h and scores can be scalars or arrays with one entry per window
+        x, y, w, h, scores = np.broadcast_arrays(*[np.asarray(v) for v in (x, y, w, h, scores)])
+        x0 = np.clip(np.round(x).astype(int), 0, self.shape[1])
+        y0 = np.clip(np.round(y).astype(int), 0, self.shape[0])
+        x1 = np.clip(np.round(x + w).astype(int), 0, self.shape[1])
+        y1 = np.clip(np.round(y + h).astype(int), 0, self.shape[0])
+
+        rows = np.concatenate((y0, y0, y1, y1))
+        cols = np.concatenate((x0, x1, x0, x1))
+        signs = np.concatenate((np.ones_like(scores), -np.ones_like(scores),
+                                -np.ones_like(scores), np.ones_like(scores)))
+
+        np.add.at(self.sum_diff, (rows, cols), signs * np.tile(scores, 4))
+        np.add.at(self.count_diff, (rows, cols), signs)
+
+    def count(self):
+        return np.cumsum(np.cumsum(self.count_diff, axis=0), axis=1)[:-1,:-1]
+
+    def mean(self):
+        total = np.cumsum(np.cumsum(self.sum_diff, axis=0), axis=1)[:-1,:-1]
+        count = self.count()
+
+        heatmap = np.zeros(self.shape)
+        covered = count > 0.5
+        heatmap[covered] = total[covered] / count[covered]
+
+        return heatmap
+
+def non_max_suppression(xs, ys, ws, hs, scores, overlap=0.3):
+    # greedy non-maximum suppression, returns the indices of the kept boxes in
+    # order of decreasing score. A box is dropped if its intersection over union
+    # with a higher scoring kept box is above overlap.
+    xs, ys, ws, hs, scores = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (xs, ys, ws, hs, scores)])
+    x2 = xs + ws
+    y2 = ys + hs
+    areas = ws * hs
+
+    # stable, so that ties are broken the same way however the boxes are split
+    order = np.argsort(-scores, kind='mergesort')
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        inter_w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(xs[i], xs[rest]))
+        inter_h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(ys[i], ys[rest]))
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter)
+
+        order = rest[iou <= overlap]
+
+    return np.array(keep, dtype=int)
+
+def adaptive_search(score_windows, shape, winW, winH, scales, coarse_step, min_step=8,
+                    threshold=0.5, scale_step=2**0.25, overlap=0.3):
+    # coarse to fine window search. score_windows(xs, ys, scale) returns the mine
+    # scores of the windows of size (winW/scale, winH/scale) with top left corners
+    # at (xs, ys) in image pixels. A coarse grid is scored at every scale, then the
+    # neighbourhood of every window scoring above threshold is scored at half the
+    # step and at the neighbouring scales (kept within the range of scales). This
+    # repeats until the best boxes after non-maximum suppression stop changing or
+    # the step drops below min_step. Returns the evaluated windows as arrays
+    # (x, y, scale, score) and the indices of the best boxes in them.
+    scores = {}
+    min_scale = min(scales)
+    max_scale = max(scales)
+
+    def clip(x, y, scale):
+        x = int(np.clip(round(x), 0, max(0, shape[1] - round(winW / scale))))
+        y = int(np.clip(round(y), 0, max(0, shape[0] - round(winH / scale))))
+        return (x, y, round(scale, 4))
+
+    def evaluate(candidates):
+        new = set(candidate for candidate in candidates if candidate not in scores)
+        for scale in set(candidate[2] for candidate in new):
+            at_scale = [candidate for candidate in new if candidate[2] == scale]
+            xs = np.array([candidate[0] for candidate in at_scale])
+            ys = np.array([candidate[1] for candidate in at_scale])
+            for candidate, score in zip(at_scale, score_windows(xs, ys, scale)):
+                scores[candidate] = float(score)
+
+    def windows():
+        keys = list(scores.keys())
+        table = np.array([key + (scores[key],) for key in keys], dtype=float).reshape(-1, 4)
+        return table[:,0], table[:,1], table[:,2], table[:,3]
+
+    def best_boxes():
+        xs, ys, ss, sc = windows()
+        positive = np.nonzero(sc > threshold)[0]
+        keep = non_max_suppression(xs[positive], ys[positive], winW / ss[positive],
+                                   winH / ss[positive], sc[positive], overlap)
+        return positive[keep]
+
+    # coarse grid at every scale
+    candidates = []
+    for scale in scales:
+        for y in window_positions(shape[0], int(round(winH / scale)), coarse_step):
+            for x in window_positions(shape[1], int(round(winW / scale)), coarse_step):
+                candidates.append(clip(x, y, scale))
+    evaluate(candidates)
+
+    step = coarse_step
+    best = None
+    while True:
+        xs, ys, ss, sc = windows()
+        boxes = best_boxes()
+        current = set(zip(xs[boxes], ys[boxes], ss[boxes]))
+        if current == best or step // 2 < min_step:
+            break
+        best = current
+        step = step // 2
+
+        # refine position and scale around every window above threshold
+        candidates = []
+        for i in np.nonzero(sc > threshold)[0]:
+            for scale in (ss[i] / scale_step, ss[i], ss[i] * scale_step):
+                if scale < min_scale - 1e-6 or scale > max_scale + 1e-6:
+                    continue
+                # keep the window centre when changing scale
+                cx = xs[i] + winW / ss[i] / 2 - winW / scale / 2
+                cy = ys[i] + winH / ss[i] / 2 - winH / scale / 2
+                for dy in (-step, 0, step):
+                    for dx in (-step, 0, step):
+                        candidates.append(clip(cx + dx, cy + dy, scale))
+        evaluate(candidates)
+
+    return xs, ys, ss, sc, boxes
+
+class TraceNormaliser(object):
+    # renders raw (time, traces) blocks the way post_process.py renders a whole
+    # B-scan: the background is removed and the result scaled in to [0 1]. The
+    # background is an exponentially weighted running mean of the traces, and
+    # with rank > 0 also the dominant eigenimages tracked by an online clutter
+    # filter. The scale is a running maximum of the absolute amplitude, so each
+    # block only depends on the traces before it.
+
+    def __init__(self, forget=0.99, rank=0):
+        self.forget = forget
+        self.mean = None
+        self.scale = 0.0
+        self.clutter = OnlineClutterFilter(rank, forget) if rank > 0 else None
+
+    def transform(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if self.clutter is not None:
+            block = self.clutter.transform(block)
+        else:
+            if self.mean is None:
+                self.mean = block[:,0].copy()
+
+            # mean[k] = forget*mean[k-1] + (1 - forget)*trace[k] along the block
+            means, _ = lfilter([1 - self.forget], [1, -self.forget], block, axis=1,
+                               zi=self.forget * self.mean[:,np.newaxis])
+            self.mean = means[:,-1]
+            block = block - means
+
+        # running maximum of the absolute amplitude, trace by trace
+        scales = np.maximum.accumulate(np.concatenate(([self.scale], np.amax(np.abs(block), axis=0))))[1:]
+        self.scale = scales[-1]
+        scales[scales == 0] = 1
+
+        return np.clip(0.5 + 0.5 * block / scales, 0, 1).astype(np.float32)
+
+class StreamLocaliser(object):
+    # sliding windows over a radargram that arrives a block of columns at a
+    # time, for survey lines of any length. classify(windows) returns the mine
+    # score of each window of an (n, winH, winW[, channels]) stack. Between
+    # blocks only the columns the next window still needs are kept. Detections
+    # go through non-maximum suppression with their neighbours and are returned
+    # as soon as no later window can change whether they are suppressed, so the
+    # result is the same as for the whole line at once while neither the buffer
+    # nor the detections held back grow with its length.
+
+    def __init__(self, classify, stepSize, winW, winH, threshold=0.5, overlap=0.3):
+        self.classify = classify
+        self.step = stepSize
+        self.winW = winW
+        self.winH = winH
+        self.threshold = threshold
+        self.overlap = overlap
+
+        self.buffer = None
+        self.offset = 0         # line column of the first buffered column
+        self.next_x = 0         # line column of the next window to score
+        self.last_x = None      # line column of the last window scored
+        self.evaluations = 0
+
+        # (x, y, score) of detections held back and of emitted detections that
+        # can still overlap them
+        self.pending = np.zeros((0, 3))
+        self.emitted = np.zeros((0, 3))
+
+    def push(self, block):
+        # add a (height, columns[, channels]) block, returns the detections that
+        # are now final as a list of (x, y, width, height, score)
+        block = np.asarray(block)
+        if self.buffer is None:
+            self.buffer = block
+        else:
+            self.buffer = np.concatenate((self.buffer, block), axis=1)
+
+        end = self.offset + self.buffer.shape[1]
+        self._score(np.arange(self.next_x, end - self.winW + 1, self.step))
+
+        return self._emit(final=False)
+
+    def flush(self):
+        # the last window is aligned with the end of the line, as in
+        # window_positions, then every detection held back is returned
+        if self.buffer is not None:
+            end_x = max(0, self.offset + self.buffer.shape[1] - self.winW)
+            if self.last_x is None or end_x > self.last_x:
+                self._score(np.array([end_x]))
+
+        return self._emit(final=True)
+
+    def _score(self, xs):
+        if len(xs) == 0:
+            return
+
+        buffer = pad_to_window(np.ascontiguousarray(self.buffer), self.winW, self.winH)
+        ys = window_positions(buffer.shape[0], self.winH, self.step)
+        grid_y, grid_x = np.meshgrid(ys, xs, indexing='ij')
+        grid_y = grid_y.ravel()
+        grid_x = grid_x.ravel()
+
+        windows = window_view(buffer, self.winW, self.winH)[grid_y, grid_x - self.offset]
+        scores = np.asarray(self.classify(windows)).ravel()
+        self.evaluations += len(windows)
+
+        keep = scores > self.threshold
+        self.pending = np.vstack((self.pending, np.column_stack((grid_x[keep], grid_y[keep], scores[keep]))))
+
+        # drop the columns no later window needs, the window aligned with the
+        # end of the line can start anywhere after the last one scored
+        self.last_x = xs[-1]
+        self.next_x = xs[-1] + self.step
+        drop = min(self.last_x + 1 - self.offset, self.buffer.shape[1])
+        self.buffer = self.buffer[:, drop:]
+        self.offset += drop
+
+    def _emit(self, final):
+        if len(self.pending) == 0:
+            return []
+
+        # emitted detections are final, they go first so that they suppress any
+        # held back detection overlapping them
+        boxes = np.vstack((self.emitted, self.pending))
+        scores = np.concatenate((np.full(len(self.emitted), np.inf), self.pending[:,2]))
+        keep = non_max_suppression(boxes[:,0], boxes[:,1], self.winW, self.winH, scores, self.overlap)
+        kept = np.zeros(len(boxes), dtype=bool)
+        kept[keep] = True
+        kept = kept[len(self.emitted):]
+
+        # a detection is complete once every window that could overlap it has
+        # been scored, and decided once it and every higher scoring detection
+        # that could suppress it are complete
+        complete = np.ones(len(self.pending), dtype=bool) if final else self.pending[:,0] + self.winW <= self.next_x
+        inter_w = np.maximum(0, self.winW - np.abs(self.pending[:,0][:,np.newaxis] - self.pending[:,0]))
+        inter_h = np.maximum(0, self.winH - np.abs(self.pending[:,1][:,np.newaxis] - self.pending[:,1]))
+        inter = inter_w * inter_h
+        suppresses = inter / (2 * self.winW * self.winH - inter) > self.overlap
+
+        done = np.zeros(len(self.pending), dtype=bool)
+        order = np.argsort(-self.pending[:,2], kind='mergesort')
+        for rank, i in enumerate(order):
+            done[i] = complete[i] and np.all(done[order[:rank]][suppresses[i, order[:rank]]])
+
+        out = self.pending[done & kept]
+        out = out[np.argsort(out[:,0], kind='mergesort')]
+
+        # emitted detections are kept only while they can overlap one held back
+        # or one still to come
+        self.pending = self.pending[~done]
+        self.emitted = np.vstack((self.emitted, out))
+        first_x = min([self.next_x] + list(self.pending[:,0]))
+        self.emitted = self.emitted[self.emitted[:,0] + self.winW > first_x]
+
+        return [(int(x), int(y), self.winW, self.winH, float(score)) for x, y, score in out]
@@ -0,0 +1,503 @@
+################################################################################
+# numpy_net_methods.py
+#
+# Forward only inference of caffe nets in numpy, so that a trained model can be
+# run without a caffe build. The model definition is read from the .prototxt
+# text format and the trained weights are decoded straight from the protobuf
+# wire format of the .caffemodel. Convolutions are lowered to one GEMM per
+# layer with im2col, all layers work on batched float32 NCHW arrays.
+#
+# Supported layers: Convolution, ReLU, Pooling (MAX, AVE), InnerProduct,
+# Softmax, Dropout and Flatten, which covers deploy.prototxt.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import re
+from numpy.lib.stride_tricks import as_strided
+from multiprocessing.pool import ThreadPool
+import cv2
+
+################################################################################
+# prototxt parsing
+################################################################################
+
+TOKENS = re.compile(r'\s*(?:#[^\n]*|"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'|([{}:])|([^\s{}:"\'#]+))')
+
+def parse_prototxt(text):
+    # protobuf text format as nested dicts, every field maps to a list of its
+    # values since any field may be repeated. Numbers become int or float,
+    # strings and enum names stay str and true/false become bool.
+    stack = [{}]
+    key = None
+    pos = 0
+    while pos < len(text):
+        match = TOKENS.match(text, pos)
+        if match is None or match.end() == pos:
+            if text[pos:].strip() == "":
+                break
+            raise ValueError('cannot parse prototxt at: ' + text[pos:pos + 40])
+        pos = match.end()
+        double, single, symbol, word = match.groups()
+
+        if symbol == "{":
+            message = {}
+            stack[-1].setdefault(key, []).append(message)
+            stack.append(message)
+            key = None
+        elif symbol == "}":
+            stack.pop()
+        elif symbol == ":":
+            continue
+        elif double is not None or single is not None:
+            value = double if double is not None else single
+            stack[-1].setdefault(key, []).append(value.decode('string_escape'))
+            key = None
+        elif word is not None:
+            if key is None:
+                key = word
+            else:
+                stack[-1].setdefault(key, []).append(_scalar(word))
+                key = None
+
+    return stack[0]
+
+def _scalar(word):
+    if word in ("true", "false"):
+        return word == "true"
+    try:
+        return int(word)
+    except ValueError:
+        pass
+    try:
+        return float(word)
+    except ValueError:
+        return word
+
+def field(message, key, default=None):
+    # first value of a field of a parsed message
+    values = message.get(key, [])
+    return values[0] if len(values) > 0 else default
+
+def spatial(param, key, default):
+    # a (h, w) pair from key_h/key_w or the repeated key of a layer param
+    if key + "_h" in param or key + "_w" in param:
+        return (field(param, key + "_h", default), field(param, key + "_w", default))
+    values = param.get(key + ("_size" if key == "kernel" else ""), [])
+    if len(values) == 0:
+        return (default, default)
+    if len(values) == 1:
+        return (values[0], values[0])
+
+    return (values[0], values[1])
+
+################################################################################
+# caffemodel decoding
+################################################################################
+
+def _varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _fields(data, start, end):
+    # (field number, wire type, value) of a message in data[start:end]. Varint
+    # values are ints, fixed values ints of their bytes and length delimited
+    # values (start, end) ranges so that nothing is copied.
+    pos = start
+    while pos < end:
+        key, pos = _varint(data, pos)
+        number = key >> 3
+        wire = key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 1:
+            value = (pos, pos + 8)
+            pos += 8
+        elif wire == 2:
+            length, pos = _varint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire == 5:
+            value = (pos, pos + 4)
+            pos += 4
+        else:
+            raise ValueError('unsupported protobuf wire type %d' % wire)
+        yield number, wire, value
+
+def _packed_varints(data, start, end):
+    values = []
+    pos = start
+    while pos < end:
+        value, pos = _varint(data, pos)
+        values.append(value)
+
+    return values
+
+def _blob(data, start, end):
+    # BlobProto as a float32 array
+    legacy = [0, 0, 0, 0]
+    shape = None
+    chunks = []
+    for number, wire, value in _fields(data, start, end):
+        if 1 <= number <= 4 and wire == 0:
+            legacy[number - 1] = value
+        elif number == 5:
+            # packed floats, or one float per field when unpacked
+            chunks.append(np.frombuffer(data, dtype='<f4', count=(value[1] - value[0]) // 4, offset=value[0]))
+        elif number == 8:
+            chunks.append(np.frombuffer(data, dtype='<f8', count=(value[1] - value[0]) // 8,
+                                        offset=value[0]).astype(np.float32))
+        elif number == 7 and wire == 2:
+            shape = []
+            for dim_number, dim_wire, dim in _fields(data, value[0], value[1]):
+                if dim_number == 1:
+                    shape.extend(_packed_varints(data, dim[0], dim[1]) if dim_wire == 2 else [dim])
+
+    values = np.concatenate(chunks).astype(np.float32) if len(chunks) > 0 else np.zeros(0, np.float32)
+    if shape is None:
+        shape = legacy
+
+    return values.reshape([int(d) for d in shape]) if int(np.prod(shape)) == values.size else values
+
+def read_caffemodel(filename):
+    # trained blobs of each layer of a .caffemodel, {layer name: [arrays]}.
+    # Reads both the current (LayerParameter) and the V1 (layers) formats.
+    with open(filename, 'rb') as f:
+        data = bytearray(f.read())
+
+    blobs = {}
+    for number, wire, value in _fields(data, 0, len(data)):
+        if wire != 2 or number not in (100, 2):
+            continue
+        # name and blobs fields of LayerParameter (1, 7) and V1LayerParameter (4, 6)
+        name_field, blob_field = (1, 7) if number == 100 else (4, 6)
+        name = None
+        layer_blobs = []
+        for layer_number, layer_wire, layer_value in _fields(data, value[0], value[1]):
+            if layer_number == name_field and layer_wire == 2:
+                name = str(data[layer_value[0]:layer_value[1]])
+            elif layer_number == blob_field and layer_wire == 2:
+                layer_blobs.append(_blob(data, layer_value[0], layer_value[1]))
+        if name is not None and len(layer_blobs) > 0:
+            blobs[name] = layer_blobs
+
+    return blobs
+
+################################################################################
+# layers, all on float32 NCHW arrays
+################################################################################
+
+def im2col(x, kernel, stride, pad):
+    # (channels*kh*kw, n*oh*ow) columns of a padded (n, channels, h, w) batch so
+    # that a convolution is one matrix product
+    n, c, h, w = x.shape
+    if pad[0] > 0 or pad[1] > 0:
+        x = np.pad(x, ((0, 0), (0, 0), (pad[0], pad[0]), (pad[1], pad[1])), mode='constant')
+    x = np.ascontiguousarray(x)
+    oh = (x.shape[2] - kernel[0]) // stride[0] + 1
+    ow = (x.shape[3] - kernel[1]) // stride[1] + 1
+
+    s = x.strides
+    view = as_strided(x, shape=(c, kernel[0], kernel[1], n, oh, ow),
+                      strides=(s[1], s[2], s[3], s[0], s[2] * stride[0], s[3] * stride[1]))
+
+    return view.reshape(c * kernel[0] * kernel[1], n * oh * ow), oh, ow
+
+def convolution(x, weights, bias, kernel, stride, pad, group=1, max_columns=1 << 24):
+    # im2col + GEMM. The batch is split so that the columns of one piece hold at
+    # most max_columns values, which bounds the memory of the unrolled input.
+    n, c = x.shape[:2]
+    out_channels = weights.shape[0]
+    cols_per_image = c * kernel[0] * kernel[1] * \
+        ((x.shape[2] + 2 * pad[0] - kernel[0]) // stride[0] + 1) * \
+        ((x.shape[3] + 2 * pad[1] - kernel[1]) // stride[1] + 1)
+    piece = max(1, max_columns // max(1, cols_per_image))
+
+    outputs = []
+    for start in range(0, n, piece):
+        part = x[start:start + piece]
+        group_out = []
+        for g in range(group):
+            in_slice = part[:, g * c // group:(g + 1) * c // group]
+            w = weights[g * out_channels // group:(g + 1) * out_channels // group]
+            cols, oh, ow = im2col(in_slice, kernel, stride, pad)
+            group_out.append(np.dot(w.reshape(w.shape[0], -1), cols).reshape(w.shape[0], len(part), oh, ow))
+        out = np.concatenate(group_out, axis=0) if group > 1 else group_out[0]
+        if bias is not None:
+            out += bias.reshape(-1, 1, 1, 1)
+        outputs.append(out.transpose(1, 0, 2, 3))
+
+    return np.ascontiguousarray(np.concatenate(outputs, axis=0) if len(outputs) > 1 else outputs[0])
+
+def pool_size(length, kernel, stride, pad):
+    # caffe rounds the pooled size up and drops a last window starting in the padding
+    size = int(np.ceil((length + 2 * pad - kernel) / stride)) + 1
+    if pad > 0 and (size - 1) * stride >= length + pad:
+        size -= 1
+
+    return size
+
+def pooling(x, method, kernel, stride, pad):
+    # MAX or AVE pooling with caffe's output size, windows running past the end
+    # of the (padded) input are clipped as in caffe
+    n, c, h, w = x.shape
+    oh = pool_size(h, kernel[0], stride[0], pad[0])
+    ow = pool_size(w, kernel[1], stride[1], pad[1])
+
+    # pad so that every window of the output fits
+    bottom = max(0, (oh - 1) * stride[0] + kernel[0] - h - pad[0])
+    right = max(0, (ow - 1) * stride[1] + kernel[1] - w - pad[1])
+    fill = -np.inf if method == "MAX" else 0
+    padded = np.pad(x, ((0, 0), (0, 0), (pad[0], bottom), (pad[1], right)), mode='constant', constant_values=fill)
+
+    out = None
+    for i in range(kernel[0]):
+        for j in range(kernel[1]):
+            part = padded[:, :, i:i + stride[0] * oh:stride[0], j:j + stride[1] * ow:stride[1]]
+            if out is None:
+                out = part.copy()
+            elif method == "MAX":
+                np.maximum(out, part, out=out)
+            else:
+                out += part
+
+    if method == "AVE":
+        # caffe divides by the window clipped to the padded input, not the image
+        rows = np.minimum(np.arange(oh) * stride[0] - pad[0] + kernel[0], h + pad[0]) - (np.arange(oh) * stride[0] - pad[0])
+        cols = np.minimum(np.arange(ow) * stride[1] - pad[1] + kernel[1], w + pad[1]) - (np.arange(ow) * stride[1] - pad[1])
+        out /= np.outer(rows, cols).astype(np.float32)
+
+    return out
+
+def inner_product(x, weights, bias, transpose=False):
+    x = x.reshape(x.shape[0], -1)
+    out = np.dot(x, weights) if transpose else np.dot(x, weights.T)
+    if bias is not None:
+        out += bias
+
+    return out
+
+def softmax(x, axis=1):
+    out = x - np.max(x, axis=axis, keepdims=True)
+    np.exp(out, out=out)
+    out /= np.sum(out, axis=axis, keepdims=True)
+
+    return out
+
+################################################################################
+# net
+################################################################################
+
+class NumpyNet(object):
+    # caffe net read from a deploy .prototxt and a trained .caffemodel. forward
+    # takes a float32 (n, channels, height, width) batch and returns the output
+    # blob, every intermediate blob is kept in blobs until the next forward.
+
+    def __init__(self, model_deploy, pre_trained=None, max_columns=1 << 24):
+        with open(model_deploy) as f:
+            definition = parse_prototxt(f.read())
+        weights = read_caffemodel(pre_trained) if pre_trained is not None else {}
+        self.max_columns = max_columns
+
+        # net inputs, from input/input_shape, input/input_dim or an Input layer
+        self.inputs = list(definition.get("input", []))
+        self.input_shapes = {}
+        shapes = [[int(d) for d in shape.get("dim", [])] for shape in definition.get("input_shape", [])]
+        dims = definition.get("input_dim", [])
+        for i, name in enumerate(self.inputs):
+            if i < len(shapes):
+                self.input_shapes[name] = tuple(shapes[i])
+            elif len(dims) >= 4 * (i + 1):
+                self.input_shapes[name] = tuple(int(d) for d in dims[4 * i:4 * i + 4])
+
+        self.layers = []
+        for layer in definition.get("layer", []):
+            kind = field(layer, "type")
+            name = field(layer, "name")
+            if any(field(include, "phase") == "TRAIN" for include in layer.get("include", [])):
+                continue
+            if kind == "Input":
+                top = field(layer, "top")
+                self.inputs.append(top)
+                shape = field(field(layer, "input_param", {}), "shape", {})
+                self.input_shapes[top] = tuple(int(d) for d in shape.get("dim", []))
+                continue
+            if kind in ("Data", "ImageData", "HDF5Data", "MemoryData", "Accuracy", "SoftmaxWithLoss"):
+                continue
+            if kind not in ("Convolution", "ReLU", "Pooling", "InnerProduct", "Softmax", "Dropout", "Flatten"):
+                raise ValueError('layer ' + name + ' of unsupported type ' + str(kind))
+
+            blobs = weights.get(name, [])
+            if kind in ("Convolution", "InnerProduct") and pre_trained is not None and len(blobs) == 0:
+                raise ValueError('no trained weights for layer ' + name)
+            self.layers.append({"name": name, "type": kind,
+                                "bottom": layer.get("bottom", []), "top": layer.get("top", []),
+                                "layer": layer, "blobs": blobs})
+
+        self.outputs = [self.layers[-1]["top"][0]] if len(self.layers) > 0 else []
+        self.blobs = {}
+        self._prepare()
+
+    def _prepare(self):
+        # weights reshaped once for the forward pass
+        for layer in self.layers:
+            blobs = layer["blobs"]
+            layer["bias"] = None
+            if layer["type"] == "Convolution":
+                param = field(layer["layer"], "convolution_param", {})
+                layer["kernel"] = spatial(param, "kernel", 1)
+                layer["stride"] = spatial(param, "stride", 1)
+                layer["pad"] = spatial(param, "pad", 0)
+                layer["group"] = field(param, "group", 1)
+                num_output = field(param, "num_output")
+                if len(blobs) > 0:
+                    layer["weights"] = blobs[0].reshape(num_output, -1, layer["kernel"][0], layer["kernel"][1])
+                    if field(param, "bias_term", True) and len(blobs) > 1:
+                        layer["bias"] = blobs[1].ravel()
+            elif layer["type"] == "InnerProduct":
+                param = field(layer["layer"], "inner_product_param", {})
+                layer["transpose"] = field(param, "transpose", False)
+                num_output = field(param, "num_output")
+                if len(blobs) > 0:
+                    shape = (-1, num_output) if layer["transpose"] else (num_output, -1)
+                    layer["weights"] = blobs[0].reshape(shape)
+                    if field(param, "bias_term", True) and len(blobs) > 1:
+                        layer["bias"] = blobs[1].ravel()
+            elif layer["type"] == "Pooling":
+                param = field(layer["layer"], "pooling_param", {})
+                layer["method"] = field(param, "pool", "MAX")
+                layer["method"] = {0: "MAX", 1: "AVE", 2: "STOCHASTIC"}.get(layer["method"], layer["method"])
+                layer["global"] = field(param, "global_pooling", False)
+                layer["kernel"] = spatial(param, "kernel", 1)
+                layer["stride"] = spatial(param, "stride", 1)
+                layer["pad"] = spatial(param, "pad", 0)
+                if layer["method"] not in ("MAX", "AVE"):
+                    raise ValueError('unsupported pooling method ' + str(layer["method"]))
+            elif layer["type"] == "ReLU":
+                layer["slope"] = field(field(layer["layer"], "relu_param", {}), "negative_slope", 0)
+            elif layer["type"] == "Softmax":
+                layer["axis"] = field(field(layer["layer"], "softmax_param", {}), "axis", 1)
+
+    def forward(self, data):
+        # run a float32 (n, channels, height, width) batch through the net
+        blobs = {self.inputs[0]: np.ascontiguousarray(data, dtype=np.float32)}
+        for layer in self.layers:
+            x = blobs[layer["bottom"][0]]
+            kind = layer["type"]
+            if kind == "Convolution":
+                y = self._convolution(layer, x)
+            elif kind == "InnerProduct":
+                y = self._inner_product(layer, x)
+            elif kind == "Pooling":
+                if layer["global"]:
+                    kernel, stride, pad = x.shape[2:], (1, 1), (0, 0)
+                else:
+                    kernel, stride, pad = layer["kernel"], layer["stride"], layer["pad"]
+                y = pooling(x, layer["method"], kernel, stride, pad)
+            elif kind == "ReLU":
+                # in place when the layer is, as caffe does
+                y = x if layer["top"][0] == layer["bottom"][0] else x.copy()
+                if layer["slope"] == 0:
+                    np.maximum(y, 0, out=y)
+                else:
+                    y[y < 0] *= layer["slope"]
+            elif kind == "Softmax":
+                y = softmax(x, layer["axis"])
+            elif kind == "Flatten":
+                y = x.reshape(x.shape[0], -1)
+            else:
+                y = x
+            blobs[layer["top"][0]] = y
+
+        self.blobs = blobs
+
+        return blobs[self.outputs[0]]
+
+    def _convolution(self, layer, x):
+        return convolution(x, layer["weights"], layer["bias"], layer["kernel"], layer["stride"],
+                           layer["pad"], layer["group"], self.max_columns)
+
+    def _inner_product(self, layer, x):
+        return inner_product(x, layer["weights"], layer["bias"], layer["transpose"])
+
+    def forward_all(self, data, batch_size=64, threads=1):
+        # forward a large batch in pieces of batch_size, pieces run in parallel
+        # threads (numpy releases the GIL in BLAS and in large copies)
+        pieces = [data[start:start + batch_size] for start in range(0, len(data), batch_size)]
+        if len(pieces) == 0:
+            return np.zeros((0,), dtype=np.float32)
+        if threads <= 1 or len(pieces) == 1:
+            outputs = [self.forward(piece) for piece in pieces]
+        else:
+            # forward keeps no state between layers outside its own blobs, so
+            # pieces can run at once, blobs is left with whichever ends last
+            pool = ThreadPool(threads)
+            try:
+                outputs = pool.map(self.forward, pieces)
+            finally:
+                pool.close()
+                pool.join()
+
+        return np.concatenate(outputs, axis=0)
+
+class NumpyClassifier(NumpyNet):
+    # drop in for caffe.Classifier(...).predict(images, oversample=False): images
+    # are resized to image_dims, centre cropped to the net input, scaled by
+    # raw_scale and have the mean subtracted, then the output probabilities of
+    # the whole batch are returned.
+
+    def __init__(self, model_deploy, pre_trained, image_dims=None, mean=None, raw_scale=None, **kwargs):
+        NumpyNet.__init__(self, model_deploy, pre_trained, **kwargs)
+        self.crop_dims = np.array(self.input_shapes[self.inputs[0]][2:])
+        self.image_dims = np.array(image_dims if image_dims is not None else self.crop_dims)
+        self.mean = mean
+        self.raw_scale = raw_scale
+
+    def preprocess(self, images):
+        # (n, height, width[, channels]) images in [0 1] to a float32 NCHW batch
+        images = np.asarray(images, dtype=np.float32)
+        if images.ndim == 3:
+            images = images[:,:,:,np.newaxis]
+        n, h, w, c = images.shape
+
+        if (h, w) != tuple(self.image_dims):
+            resized = np.empty((n, self.image_dims[0], self.image_dims[1], c), dtype=np.float32)
+            for i in range(n):
+                image = cv2.resize(images[i], (int(self.image_dims[1]), int(self.image_dims[0])),
+                                   interpolation=cv2.INTER_LINEAR)
+                resized[i] = image.reshape(resized.shape[1:])
+            images = resized
+
+        # centre crop to the net input
+        top = (self.image_dims - self.crop_dims) // 2
+        images = images[:, top[0]:top[0] + self.crop_dims[0], top[1]:top[1] + self.crop_dims[1]]
+
+        data = images.transpose(0, 3, 1, 2)
+        if self.raw_scale is not None:
+            data = data * np.float32(self.raw_scale)
+        if self.mean is not None:
+            # a mean value per channel or a (channels, height, width) mean image
+            mean = np.asarray(self.mean, dtype=np.float32)
+            data = data - (mean.reshape(1, -1, 1, 1) if mean.ndim == 1 else mean[np.newaxis])
+
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+    def predict(self, images, batch_size=64, threads=1):
+        # class probabilities, shape (images, classes)
+        if len(images) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        out = []
+        for start in range(0, len(images), batch_size * max(1, threads)):
+            data = self.preprocess(images[start:start + batch_size * max(1, threads)])
+            out.append(self.forward_all(data, batch_size, threads))
+        out = np.concatenate(out, axis=0)
+
+        return out.reshape(out.shape[0], -1)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+################################################################################
+# pipeline.py
+#
+# Runs the pipeline described by a JSON config (pipeline-gen-new.json,
+# individual-pipeline.json or pipeline-caffe.json at the top of the repository)
+# with dag_methods. Stages run as soon as the stages they read from are done,
+# per file stages run up to --jobs files at once, and a task whose command and
+# inputs are unchanged since its last successful run is skipped, so running
+# the same config again resumes an interrupted run. Nothing is asked on the
+# terminal; every task is recorded in the trace and logged under the state
+# directory. The scenes of a longest_first stage are simulated longest first as
+# predicted by the cost model of the config, which is first recalibrated from
+# the simulations in the trace. The exit status is 1 if any stage did not
+# finish.
+################################################################################
+
+import argparse
+import os
+import subprocess
+import sys
+from dag_methods import load_config, Pipeline
+from trace_methods import TRACE_ENV, read_trace
+from cost_methods import CostModel
+
+#   Usage:
+#
+#     pipeline.py <config> [--set NAME=VALUE ...]
+#
+#   where
+#     config <str> this is the JSON description of the stages
+#
+#     --set <str> optional, overrides a variable of the config, e.g.
+#     -s          --set ROOT_DIR=/data/run2, can be given more than once
+#
+#     --jobs <int> optional, tasks run at once (the config's "jobs", else 1)
+#     -j
+#
+#     --force <str> optional, comma separated stages to run even when up to date
+#
+#     --keep-going optional, run what does not depend on a failed stage
+#     -k
+#
+#     --list optional, print the stages and what they depend on and exit
+#
+#     --summary optional, summarise the trace with trace-summary.py at the end
+#
+
+parser = argparse.ArgumentParser(description='run the stages of a pipeline config')
+
+parser.add_argument('config', help='JSON description of the stages')
+
+parser.add_argument('-s', '--set', dest='overrides', default=[], action='append', help='NAME=VALUE overriding a variable of the config')
+
+parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int, action='store', help='tasks run at once')
+
+parser.add_argument('--force', dest='force', default='', action='store', help='comma separated stages to run even when up to date')
+
+parser.add_argument('-k', '--keep-going', dest='keep_going', default=False, action='store_true', help='run what does not depend on a failed stage')
+
+parser.add_argument('--summary', dest='summary', default=False, action='store_true', help='summarise the trace at the end')
+
+parser.add_argument('--list', dest='list', default=False, action='store_true', help='print the stages and exit')
+
+args = parser.parse_args()
+
+overrides = {}
+for override in args.overrides:
+    if '=' not in override:
+        parser.error('--set takes NAME=VALUE, not ' + override)
+    name, value = override.split('=', 1)
+    overrides[name] = value
+
+stages, variables, jobs, state, trace, cost_model = load_config(args.config, overrides)
+
+force = [s for s in args.force.split(',') if s != '']
+for name in force:
+    if name not in [stage["name"] for stage in stages]:
+        parser.error('unknown stage ' + name)
+
+# the tasks record themselves in the trace of the config unless $GPR_TRACE is set
+if trace is not None and not os.environ.get(TRACE_ENV):
+    os.environ[TRACE_ENV] = trace
+
+cost = None
+if cost_model is not None and any(stage["longest_first"] for stage in stages) and not args.list:
+    model = CostModel(cost_model)
+    if os.environ.get(TRACE_ENV) and os.path.exists(os.environ[TRACE_ENV]):
+        fitted = model.fit(read_trace(os.environ[TRACE_ENV]))
+        for device, (runs, error) in sorted(fitted.items()):
+            print("Cost model calibrated on %d %s runs, median error %.0f%%" % (runs, device, 100 * error))
+        if fitted:
+            model.save(cost_model)
+    cost = lambda task: model.predict_file(task["item"], task["command"]) if task["item"] else None
+
+pipeline = Pipeline(stages, state, args.jobs or jobs, force, args.keep_going, cost)
+
+if args.list:
+    for stage in stages:
+        print("%-14s %s%s" % (stage["name"], "foreach " + stage["foreach"] + "  " if stage["foreach"] else "",
+                              "after " + ", ".join(stage["deps"]) if stage["deps"] else ""))
+    sys.exit(0)
+
+finished = pipeline.run()
+
+# the trace is that of the config unless $GPR_TRACE was set
+if args.summary and os.environ.get(TRACE_ENV) and os.path.exists(os.environ[TRACE_ENV]):
+    subprocess.call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "trace-summary.py"),
+                     "-i", os.environ[TRACE_ENV]])
+
+sys.exit(0 if finished else 1)
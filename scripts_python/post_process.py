@@ -6,6 +6,10 @@
 # processing technique is known as singular value decomposition where the 3
 # most dominant eigenimages are filtered and subtracted from the original B-scan
 #
+# A model with several receivers, /rxs/rx1 to /rxs/rxN, gives one radargram per
+# receiver, <name>.rx1.png to <name>.rxN.png, which share the scene id <name>
+# and its label; a model with one receiver gives <name>.png
+#
 ################################################################################
 
 import os
@@ -14,6 +18,8 @@ import h5py
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
+from clutter_methods import clutter_filter
+from trace_methods import Stage
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Plots B-scan.', usage='post-process data and save radargram or plot annotated figure of radargram')
@@ -27,43 +33,40 @@ args = parser.parse_args()
 file = args.outputfile
 dest_path = args.directory
 field = args.field
-path = '/rxs/rx1'
-
-# open raw B-scan file
-f = h5py.File(file, 'r')
-data = f[path + '/' + field]
-data_array = np.asarray(data)
 
+# open raw B-scan file, each step is timed in the trace when $GPR_TRACE is set
+with Stage("post_process.read", file):
+	f = h5py.File(file, 'r')
+	receivers = sorted(f['/rxs'].keys(), key=lambda name: int(name[2:]))
+	data_arrays = [np.asarray(f['/rxs/' + rx + '/' + field]) for rx in receivers]
 
-def post_process(array,dest_path):
 
-	# mean subtraction
-	mean_radar = np.mean(array,axis=1)
-	array = array - mean_radar[:,np.newaxis]
+def post_process(array,dest_path,suffix=""):
 
-	# calculate SVD
-	U, sigma, V = np.linalg.svd(array)
+	# mean subtraction, then subtract the 2 dominant eigen images
+	with Stage("post_process.filter", file):
+		b_scan = clutter_filter(array, 2)
 
-	# pull out dominant eigen images
-	eigen_image = np.matrix(U[:, :2]) * np.diag(sigma[:2]) * np.matrix(V[:2, :])
+		# normlise radargram (0-255)
+		maxVal = b_scan.max()
+		minVal = b_scan.min()
+		dynamic = maxVal-minVal
+		rescaled = np.divide((b_scan-minVal),dynamic)*255
 
-	# subtract from original b-scan
-	b_scan = array - eigen_image
+	with Stage("post_process.render", file):
+		render(rescaled,dest_path,suffix)
 
-	# normlise radargram (0-255)
-	maxVal = b_scan.max()
-	minVal = b_scan.min()
-	dynamic = maxVal-minVal
-	rescaled = np.divide((b_scan-minVal),dynamic)*255
+def render(rescaled,dest_path,suffix=""):
 
 	# Plot B-scan image
-	fig = plt.figure(num=file, figsize=(20, 10))
+	img_name = dest_path+"/"+file.split("/")[-1]+suffix+".png"
+	fig = plt.figure(num=img_name, figsize=(20, 10))
 	ax = plt.Axes(fig, [0., 0., 1., 1.])
 	ax.set_axis_off()
 	fig.add_axes(ax)
 	ax.imshow(rescaled,cmap='gray',interpolation='spline16',aspect='auto')
-	img_name = dest_path+"/"+file.split("/")[-1]+".png"
 	fig.savefig(img_name)
+	plt.close(fig)
 
 	# convert to greyscale
 	input_img = plt.imread(img_name)
@@ -99,8 +102,9 @@ def annotated_plot(array,dest_path):
 # if commandline flag 'figure' then annotate else
 annotate = str(args.figure)
 if annotate == 'y':
-	annotated_plot(data_array,dest_path)
+	annotated_plot(data_arrays[0],dest_path)
 elif annotate == 'n':
-	post_process(data_array,dest_path)
+	for rx, data_array in zip(receivers, data_arrays):
+		post_process(data_array,dest_path,"."+rx if len(receivers) > 1 else "")
 else:
 	raise ValueError('Incorrect flag')
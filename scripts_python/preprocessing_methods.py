@@ -0,0 +1,219 @@
+################################################################################
+# preprocessing_methods.py
+#
+# Preprocessing for the numpy image stacks (height, width, images) used by the
+# lasagne and SVM models. Statistics are fitted in a single streaming pass over
+# chunks of images and applied in place in float32, and can be saved alongside
+# a trained model so that inference reuses them.
+################################################################################
+
+from __future__ import division
+import numpy as np
+
+def load_float32(filename, chunk_size=1000):
+    # load a saved (height, width, images) array as float32 without ever holding
+    # the float64 copy in memory
+    data = np.load(filename, mmap_mode='r')
+    if data.dtype == np.float32:
+        return np.array(data)
+
+    out = np.empty(data.shape, dtype=np.float32)
+    if data.ndim < 3:
+        out[...] = data
+        return out
+
+    for start in range(0, data.shape[2], chunk_size):
+        out[:,:,start:start + chunk_size] = data[:,:,start:start + chunk_size]
+
+    return out
+
+def as_float32(data):
+    # float32 arrays are used as they are so that transforms happen in place
+    if data.dtype == np.float32 and data.flags.writeable:
+        return data
+
+    return data.astype(np.float32)
+
+class Preprocessor(object):
+    # mean image subtraction, optional per pixel standardisation, then scaling to
+    # the interval [0 1] using the min and max of the training data
+
+    def __init__(self, standardise=False, chunk_size=1000):
+        self.standardise = standardise
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.mean_image = None
+        self.m2_image = None
+        self.min_image = None
+        self.max_image = None
+        self.min_val = None
+        self.max_val = None
+
+    def partial_fit(self, chunk):
+        # merge the statistics of one (height, width, n) chunk in to the running
+        # totals (Welford / Chan et al. parallel update)
+        chunk = np.asarray(chunk, dtype=np.float64)
+        n_chunk = chunk.shape[2]
+        if n_chunk == 0:
+            return self
+
+        chunk_mean = np.mean(chunk, axis=2)
+        chunk_m2 = np.sum((chunk - chunk_mean[:,:,np.newaxis])**2, axis=2)
+        chunk_min = np.amin(chunk, axis=2)
+        chunk_max = np.amax(chunk, axis=2)
+
+        if self.count == 0:
+            self.mean_image = chunk_mean
+            self.m2_image = chunk_m2
+            self.min_image = chunk_min
+            self.max_image = chunk_max
+        else:
+            total = self.count + n_chunk
+            delta = chunk_mean - self.mean_image
+            self.mean_image = self.mean_image + delta*(n_chunk/total)
+            self.m2_image = self.m2_image + chunk_m2 + delta**2*(self.count*n_chunk/total)
+            self.min_image = np.minimum(self.min_image, chunk_min)
+            self.max_image = np.maximum(self.max_image, chunk_max)
+
+        self.count += n_chunk
+        self._update_range()
+
+        return self
+
+    def fit(self, data):
+        for start in range(0, data.shape[2], self.chunk_size):
+            self.partial_fit(data[:,:,start:start + self.chunk_size])
+
+        return self
+
+    def _update_range(self):
+        # the mean is per pixel, so the range of the centred data follows from the
+        # per pixel min and max without a second pass over the data
+        low = self.min_image - self.mean_image
+        high = self.max_image - self.mean_image
+        if self.standardise:
+            std = self.std_image()
+            low = low/std
+            high = high/std
+
+        self.min_val = float(np.amin(low))
+        self.max_val = float(np.amax(high))
+
+    def std_image(self):
+        std = np.sqrt(self.m2_image/max(self.count, 1))
+        std[std == 0] = 1
+
+        return std
+
+    def transform(self, data):
+        # transform in place chunk by chunk, a copy is only made if data is not
+        # already a writeable float32 array
+        data = as_float32(data)
+        mean = self.mean_image.astype(np.float32)[:,:,np.newaxis]
+        std = self.std_image().astype(np.float32)[:,:,np.newaxis]
+        min_val = np.float32(self.min_val)
+        # constant training data has no range to scale by
+        value_range = self.max_val - self.min_val
+        scale = np.float32(1/value_range if value_range != 0 else 1)
+
+        for start in range(0, data.shape[2], self.chunk_size):
+            chunk = data[:,:,start:start + self.chunk_size]
+            chunk -= mean
+            if self.standardise:
+                chunk /= std
+            chunk -= min_val
+            chunk *= scale
+
+        return data
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+    def get_state(self, prefix="pre_"):
+        # arrays to be stored in an npz file, prefixed so they can share a file
+        # with model parameters
+        return {prefix+"count": np.array(self.count),
+                prefix+"standardise": np.array(self.standardise),
+                prefix+"mean_image": self.mean_image,
+                prefix+"m2_image": self.m2_image,
+                prefix+"min_image": self.min_image,
+                prefix+"max_image": self.max_image}
+
+    def set_state(self, state, prefix="pre_"):
+        self.count = int(state[prefix+"count"])
+        self.standardise = bool(state[prefix+"standardise"])
+        self.mean_image = np.asarray(state[prefix+"mean_image"], dtype=np.float64)
+        self.m2_image = np.asarray(state[prefix+"m2_image"], dtype=np.float64)
+        self.min_image = np.asarray(state[prefix+"min_image"], dtype=np.float64)
+        self.max_image = np.asarray(state[prefix+"max_image"], dtype=np.float64)
+        self._update_range()
+
+        return self
+
+    def save(self, filename):
+        np.savez_compressed(filename, **self.get_state())
+
+    def load(self, filename):
+        state = np.load(filename)
+        return self.set_state(state)
+
+def fit_and_save(filename, X_train, standardise=False):
+    # statistics are always fitted on the training data at hand, the saved file
+    # is only written for inference and never read back when training
+    print "Fitting preprocessing statistics ..."
+    pre = Preprocessor(standardise)
+    pre.fit(X_train)
+    pre.save(filename)
+
+    return pre
+
+################################################################################
+# functional versions of the above, as used by the older model scripts
+################################################################################
+
+# subtract mean image from every image
+def zero_meaning(X_train, X_test):
+    print "Mean subtraction ..."
+    pre = Preprocessor()
+    pre.fit(X_train)
+    mean = pre.mean_image.astype(np.float32)[:,:,np.newaxis]
+
+    X_train = as_float32(X_train)
+    X_test = as_float32(X_test)
+    X_train -= mean
+    X_test -= mean
+
+    return X_train, X_test, pre.mean_image
+
+# normalise data to interval [0 1]
+def normaliser(*arg):
+    print "Normalising "+arg[1]+" data to range [0 1] ..."
+    data = as_float32(arg[0])
+    if len(arg) > 2:
+        min_val = arg[2]
+        max_val = arg[3]
+    else:
+        min_val = np.amin(data)
+        max_val = np.amax(data)
+
+    data -= np.float32(min_val)
+    data *= np.float32(1/(max_val - min_val))
+
+    return data, min_val, max_val
+
+# standardise every pixel to zero mean and unit variance
+def standardiser(*arg):
+    print "Standardising "+arg[1]+" data ..."
+    data = as_float32(arg[0])
+    if len(arg) > 2:
+        mean_image = arg[2]
+        std_image = arg[3]
+    else:
+        pre = Preprocessor(standardise=True).fit(data)
+        mean_image = pre.mean_image
+        std_image = pre.std_image()
+
+    data -= mean_image.astype(np.float32)[:,:,np.newaxis]
+    data /= std_image.astype(np.float32)[:,:,np.newaxis]
+
+    return data, mean_image, std_image
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+################################################################################
+# quantize-net.py
+#
+# Calibrates the int8 input scales of the mine classifier on a sample of a
+# directory of validation images, then compares the int8 net against the
+# float32 net on the rest: accuracy, agreement of the predicted classes, error
+# of the mine probability and windows per second. Images are labelled by name,
+# "without" in the name is a clean image, as in model-caffe.py. The scales are
+# saved for localise.py --engine int8.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import os, sys, time
+import argparse
+import cv2
+from numpy_net_methods import NumpyClassifier
+from quantize_methods import QuantizedClassifier
+sys.dont_write_bytecode = True
+
+#   Usage:
+#
+#     quantize-net.py -v <str> --deploy <str> --weights <str>
+#
+#   where
+#     --val <str> this is the directory of images to calibrate and evaluate on
+#     -v
+#
+#     --deploy <str> caffe model definition and trained weights
+#     --weights
+#
+#     --output <str> optional, npz file to save the input scales to (int8.npz),
+#     -o             passed to localise.py --quantized
+#
+#     --calibration <int> optional, number of images drawn at random to
+#     -n                  calibrate on, the rest are evaluated on (200)
+#
+#     --percentile <float> optional, percentile of the absolute activations an
+#     -p                   input scale clips at (99.99)
+#
+#     --batchsize <int> optional, number of images per forward pass (64)
+#     -b
+#
+#     --threads <int> optional, number of forward passes run at once (1)
+#     -th
+#
+
+parser = argparse.ArgumentParser(description='Process some inputs.')
+
+parser.add_argument('-v','--val', dest='valDir', metavar='valDir', type=str,
+                   help='string for validation image directory', required=True)
+
+parser.add_argument('--deploy', dest='deploy', metavar='deploy', type=str,
+                   help='string for caffe model definition file', required=True)
+
+parser.add_argument('--weights', dest='weights', metavar='weights', type=str,
+                   help='string for caffe trained weights file', required=True)
+
+parser.add_argument('-o','--output', dest='outputFile', metavar='outputFile', type=str,
+                   help='string for int8 scales output file', default="int8.npz")
+
+parser.add_argument('-n','--calibration', dest='calibration', metavar='calibration', type=int,
+                   help='number of images to calibrate on', default=200)
+
+parser.add_argument('-p','--percentile', dest='percentile', metavar='percentile', type=float,
+                   help='percentile of the absolute activations a scale clips at', default=99.99)
+
+parser.add_argument('-b','--batchsize', dest='batchSize', metavar='batchSize', type=int,
+                   help='number of images per forward pass', default=64)
+
+parser.add_argument('-th','--threads', dest='threads', metavar='threads', type=int,
+                   help='number of forward passes run at once', default=1)
+
+args = parser.parse_args()
+
+def load_images(image_dir):
+    # greyscale images in [0 1] stacked as (n, height, width), with their labels.
+    # Images of different sizes are resized to the size of the first.
+    names = sorted([f for f in os.listdir(image_dir) if f.endswith(".png")])
+    if len(names) == 0:
+        raise ValueError('no .png images in '+image_dir)
+
+    first = cv2.imread(os.path.join(image_dir, names[0]), 0)
+    images = np.empty((len(names),) + first.shape, dtype=np.float32)
+    for i, name in enumerate(names):
+        image = cv2.imread(os.path.join(image_dir, name), 0)
+        if image.shape != first.shape:
+            image = cv2.resize(image, (first.shape[1], first.shape[0]), interpolation=cv2.INTER_AREA)
+        images[i] = image / 255.0
+
+    labels = np.array([0 if "without" in name else 1 for name in names])
+
+    return images, labels
+
+def timed_predict(net, images):
+    # probabilities and windows per second, after one warm up batch
+    net.predict(images[:args.batchSize], args.batchSize, args.threads)
+    start = time.time()
+    probs = net.predict(images, args.batchSize, args.threads)
+
+    return probs, len(images) / (time.time() - start)
+
+print "Loading images ..."
+X, Y = load_images(args.valDir)
+X = X[:,:,:,np.newaxis]
+
+# calibration images are kept out of the evaluation unless there are too few
+order = np.random.RandomState(0).permutation(len(Y))
+calibration = order[:args.calibration]
+evaluation = order[args.calibration:] if len(Y) > args.calibration else order
+
+print "Calibrating int8 scales on "+str(len(calibration))+" images ..."
+float_net = NumpyClassifier(args.deploy, args.weights, raw_scale=255)
+int8_net = QuantizedClassifier(args.deploy, args.weights, percentile=args.percentile, raw_scale=255)
+int8_net.calibrate(X[calibration], args.batchSize)
+
+print "Evaluating on "+str(len(evaluation))+" images ..."
+float_probs, float_rate = timed_predict(float_net, X[evaluation])
+int8_probs, int8_rate = timed_predict(int8_net, X[evaluation])
+labels = Y[evaluation]
+
+print ""
+print "         accuracy  mine recall  windows/s"
+for name, probs, rate in (("float32", float_probs, float_rate), ("int8", int8_probs, int8_rate)):
+    predicted = np.argmax(probs, axis=1)
+    recall = np.mean(predicted[labels == 1] == 1) if np.any(labels == 1) else np.nan
+    print "%-7s  %8.4f  %11.4f  %9.1f" % (name, np.mean(predicted == labels), recall, rate)
+
+difference = np.abs(int8_probs[:,1] - float_probs[:,1])
+print ""
+print "Class agreement with float32       : %.4f" % np.mean(np.argmax(int8_probs, axis=1) == np.argmax(float_probs, axis=1))
+print "Mine probability error, mean / max : %.4f / %.4f" % (np.mean(difference), np.max(difference))
+print "Speedup over float32               : %.2fx" % (int8_rate / float_rate)
+if int8_rate < float_rate:
+    # numpy has no int8 GEMM, the int8 products run as exact float32 BLAS pieces
+    print "The int8 net is slower than float32 here, its products are emulated in float32"
+
+print "Saving int8 scales to "+args.outputFile+" ..."
+int8_net.save(args.outputFile)
@@ -0,0 +1,179 @@
+################################################################################
+# quantize_methods.py
+#
+# Post training int8 quantization of the numpy nets. The weights of every
+# Convolution and InnerProduct layer are quantized symmetrically with one scale
+# per output channel, and the input of each of those layers with one scale
+# calibrated on sample images. These layers multiply the 8 bit values with
+# int32 accumulation and hand float32 outputs on, the other layers run as in
+# numpy_net_methods.py.
+################################################################################
+
+from __future__ import division
+import numpy as np
+from numpy_net_methods import NumpyClassifier, im2col
+
+WEIGHT_MAX = 127
+
+def channel_scales(matrix, qmax=WEIGHT_MAX):
+    # symmetric scale of each row of an (output channels, inputs) weight matrix
+    peak = np.max(np.abs(matrix), axis=1)
+
+    return np.where(peak > 0, peak / qmax, 1).astype(np.float32)
+
+def quantize(x, scale, qmax, unsigned=False):
+    # nearest integer of x / scale clipped to int8, or to uint8 for inputs that
+    # are never negative (after a ReLU, or the image itself)
+    q = np.clip(np.round(x / scale), 0 if unsigned else -qmax, qmax)
+
+    return q.astype(np.uint8 if unsigned else np.int8)
+
+def exact_terms(a_max, b_max):
+    # float32 holds every integer up to 2**24, so this many products of values
+    # up to a_max and b_max can be summed in float32 without rounding
+    return max(1, (1 << 24) // (a_max * b_max))
+
+def int_dot(a, b, terms):
+    # int32 product of integer valued (m, k) and (k, n) matrices. numpy has no
+    # int8 GEMM, so the products run in float32 BLAS on pieces of at most terms
+    # of the k axis, where they are exact, and the pieces add up in int32.
+    out = None
+    for start in range(0, a.shape[1], terms):
+        part = np.dot(a[:, start:start + terms], b[start:start + terms].astype(np.float32)).astype(np.int32)
+        if out is None:
+            out = part
+        else:
+            out += part
+
+    return out
+
+def quantized_convolution(q, weights, kernel, stride, pad, group, terms, max_columns=1 << 24):
+    # int32 accumulators (n, out channels, oh, ow) of the convolution of an 8 bit
+    # (n, channels, h, w) batch with the integer valued (out channels, inputs)
+    # weight matrix, split as convolution() splits the batch
+    n, c = q.shape[:2]
+    out_channels = weights.shape[0]
+    cols_per_image = c * kernel[0] * kernel[1] * \
+        ((q.shape[2] + 2 * pad[0] - kernel[0]) // stride[0] + 1) * \
+        ((q.shape[3] + 2 * pad[1] - kernel[1]) // stride[1] + 1)
+    piece = max(1, max_columns // max(1, cols_per_image))
+
+    outputs = []
+    for start in range(0, n, piece):
+        part = q[start:start + piece]
+        group_out = []
+        for g in range(group):
+            in_slice = part[:, g * c // group:(g + 1) * c // group]
+            w = weights[g * out_channels // group:(g + 1) * out_channels // group]
+            cols, oh, ow = im2col(in_slice, kernel, stride, pad)
+            group_out.append(int_dot(w, cols, terms).reshape(w.shape[0], len(part), oh, ow))
+        out = np.concatenate(group_out, axis=0) if group > 1 else group_out[0]
+        outputs.append(out.transpose(1, 0, 2, 3))
+
+    return np.ascontiguousarray(np.concatenate(outputs, axis=0) if len(outputs) > 1 else outputs[0])
+
+class QuantizedClassifier(NumpyClassifier):
+    # NumpyClassifier with int8 Convolution and InnerProduct layers. The input
+    # scales come from calibrate(), or from a file saved after calibration,
+    # until then the net runs in float32. Input scales clip at the percentile of
+    # the absolute calibration activations, so that a few outliers do not
+    # stretch the scale of the whole layer.
+
+    def __init__(self, model_deploy, pre_trained, scales=None, percentile=99.99, **kwargs):
+        NumpyClassifier.__init__(self, model_deploy, pre_trained, **kwargs)
+        self.percentile = percentile
+        self.quantized = False
+
+        for layer in self._weighted():
+            if layer["type"] == "Convolution":
+                matrix = layer["weights"].reshape(layer["weights"].shape[0], -1)
+            else:
+                matrix = layer["weights"].T if layer["transpose"] else layer["weights"]
+            layer["weight_scale"] = channel_scales(matrix)
+            layer["qweights"] = quantize(matrix, layer["weight_scale"][:,np.newaxis], WEIGHT_MAX)
+            # integer valued float32 copy for the BLAS products
+            layer["qweights_float"] = layer["qweights"].astype(np.float32)
+
+        if scales is not None:
+            self.load(scales)
+
+    def _weighted(self):
+        return [layer for layer in self.layers if layer["type"] in ("Convolution", "InnerProduct")]
+
+    def _set_input(self, layer, peak, unsigned):
+        layer["input_unsigned"] = bool(unsigned)
+        layer["input_max"] = 255 if unsigned else 127
+        layer["input_scale"] = np.float32(peak / layer["input_max"] if peak > 0 else 1)
+        layer["terms"] = exact_terms(WEIGHT_MAX, layer["input_max"])
+
+    def calibrate(self, images, batch_size=64):
+        # input scale of each quantized layer from the float32 activations of a
+        # sample of (n, height, width[, channels]) images
+        self.quantized = False
+        peaks = {}
+        signed = {}
+        for start in range(0, len(images), batch_size):
+            self.forward(self.preprocess(images[start:start + batch_size]))
+            for layer in self._weighted():
+                # in place ReLUs have already run on the blob, as the layer saw it
+                x = self.blobs[layer["bottom"][0]]
+                name = layer["name"]
+                peaks[name] = max(peaks.get(name, 0), float(np.percentile(np.abs(x), self.percentile)))
+                signed[name] = signed.get(name, False) or bool(np.min(x) < 0)
+
+        for layer in self._weighted():
+            self._set_input(layer, peaks[layer["name"]], not signed[layer["name"]])
+        self.quantized = True
+
+        return self
+
+    def _convolution(self, layer, x):
+        if not self.quantized:
+            return NumpyClassifier._convolution(self, layer, x)
+
+        q = quantize(x, layer["input_scale"], layer["input_max"], layer["input_unsigned"])
+        acc = quantized_convolution(q, layer["qweights_float"], layer["kernel"], layer["stride"],
+                                    layer["pad"], layer["group"], layer["terms"], self.max_columns)
+        y = acc.astype(np.float32)
+        y *= (layer["input_scale"] * layer["weight_scale"]).reshape(1, -1, 1, 1)
+        if layer["bias"] is not None:
+            y += layer["bias"].reshape(1, -1, 1, 1)
+
+        return y
+
+    def _inner_product(self, layer, x):
+        if not self.quantized:
+            return NumpyClassifier._inner_product(self, layer, x)
+
+        q = quantize(x.reshape(x.shape[0], -1), layer["input_scale"], layer["input_max"], layer["input_unsigned"])
+        y = int_dot(layer["qweights_float"], q.T, layer["terms"]).T.astype(np.float32)
+        y *= layer["input_scale"] * layer["weight_scale"]
+        if layer["bias"] is not None:
+            y += layer["bias"]
+
+        return y
+
+    def get_state(self, prefix="int8_"):
+        state = {prefix+"percentile": np.array(self.percentile)}
+        for layer in self._weighted():
+            state[prefix+layer["name"]+"_peak"] = np.array(layer["input_scale"] * layer["input_max"])
+            state[prefix+layer["name"]+"_unsigned"] = np.array(layer["input_unsigned"])
+
+        return state
+
+    def set_state(self, state, prefix="int8_"):
+        self.percentile = float(state[prefix+"percentile"])
+        for layer in self._weighted():
+            if prefix+layer["name"]+"_peak" not in state:
+                raise ValueError('no input scale for layer ' + layer["name"])
+            self._set_input(layer, float(state[prefix+layer["name"]+"_peak"]),
+                            bool(state[prefix+layer["name"]+"_unsigned"]))
+        self.quantized = True
+
+        return self
+
+    def save(self, filename):
+        np.savez_compressed(filename, **self.get_state())
+
+    def load(self, filename):
+        return self.set_state(np.load(filename))
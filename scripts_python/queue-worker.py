@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+################################################################################
+# queue-worker.py
+#
+# Simulation worker of the job queue filled by job-queue.py. Start one on each
+# simulation host, with as many slots as jobs the host should run at once;
+# each slot leases the longest job left, runs it and renews its lease every
+# --heartbeat seconds while it runs. If this worker dies its jobs return to the
+# queue when their leases run out and another worker runs them. A job whose
+# lease was lost, to a worker that took it over, is stopped. The worker exits
+# when no job is queued or leased, or keeps waiting for more with --follow.
+# Every job is recorded in the trace named by $GPR_TRACE, which is what
+# simulation-cost.py calibrates on. A job stopped by simulation-watchdog.py
+# fails without being tried again, unless --retry-rejected.
+################################################################################
+
+from __future__ import print_function
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from queue_methods import JobQueue, worker_name
+from dag_methods import expand, item_variables
+from stream_methods import mark
+from trace_methods import run_traced
+from watchdog_methods import ABORTED
+
+#   Usage:
+#
+#     queue-worker.py -q <str> [-j <int>]
+#
+#   where
+#     --queue <str> this is the SQLite file of the queue
+#     -q
+#
+#     --jobs <int> optional, jobs run at once on this host (1)
+#     -j
+#
+#     --lease <float> optional, seconds a job is leased for before another
+#                     worker may take it over (300)
+#
+#     --heartbeat <float> optional, seconds between lease renewals (60)
+#
+#     --cwd <str> optional, directory the jobs run in
+#
+#     --mark <str> optional, marker written after a job succeeds, e.g.
+#     -m           "{dir}/{stem}.simulated" for the merge stream-worker.py
+#
+#     --logs <str> optional, directory for the output of each job, passed
+#                  through without
+#
+#     --stage <str> optional, stage name in the trace ("simulate")
+#     -s
+#
+#     --retry-rejected optional, queue jobs stopped by simulation-watchdog.py
+#                      again like other failures
+#
+#     --follow optional, wait for more jobs when the queue is empty
+#
+#     --poll <float> optional, seconds between looks at an empty queue (5)
+#
+
+parser = argparse.ArgumentParser(description='run jobs of the simulation job queue')
+
+parser.add_argument('-q', '--queue', required=True, dest='queue', action='store', help='SQLite file of the queue')
+
+parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int, action='store', help='jobs run at once on this host')
+
+parser.add_argument('--lease', dest='lease', default=300.0, type=float, action='store', help='seconds a job is leased for')
+
+parser.add_argument('--heartbeat', dest='heartbeat', default=60.0, type=float, action='store', help='seconds between lease renewals')
+
+parser.add_argument('--cwd', dest='cwd', default=None, action='store', help='directory the jobs run in')
+
+parser.add_argument('-m', '--mark', dest='mark', default=None, action='store', help='marker written after a job succeeds')
+
+parser.add_argument('--logs', dest='logs', default=None, action='store', help='directory for the output of each job')
+
+parser.add_argument('-s', '--stage', dest='stage', default='simulate', action='store', help='stage name in the trace')
+
+parser.add_argument('--retry-rejected', dest='retry_rejected', default=False, action='store_true', help='queue jobs stopped by simulation-watchdog.py again')
+
+parser.add_argument('--follow', dest='follow', default=False, action='store_true', help='wait for more jobs when the queue is empty')
+
+parser.add_argument('--poll', dest='poll', default=5.0, type=float, action='store', help='seconds between looks at an empty queue')
+
+args = parser.parse_args()
+
+if args.heartbeat >= args.lease:
+    parser.error('--heartbeat must be shorter than --lease')
+
+lock = threading.Lock()
+failed = []
+done = []
+
+def say(text):
+    with lock:
+        print(time.strftime("%H:%M:%S ") + text)
+        sys.stdout.flush()
+
+class Heartbeat(object):
+    # watch of run_traced that renews the lease of a job, and stops the job
+    # once the lease is lost
+
+    def __init__(self, queue, job, worker):
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self.last = time.time()
+
+    def __call__(self, process):
+        if time.time() - self.last < args.heartbeat:
+            return None
+        try:
+            held = self.queue.renew(self.job["id"], self.worker, args.lease)
+        except sqlite3.OperationalError:
+            # the queue is busy, the lease still has time
+            return None
+        self.last = time.time()
+
+        return None if held else "lease lost"
+
+def slot(number):
+    queue = JobQueue(args.queue)
+    worker = worker_name(number)
+    while True:
+        job = queue.lease(worker, args.lease)
+        if job is None:
+            counts = queue.counts()
+            if not args.follow and counts["queued"] + counts["leased"] == 0:
+                break
+            time.sleep(args.poll)
+            continue
+
+        name = os.path.basename(job["input"])
+        say("[%s] %s attempt %d" % (worker, name, job["attempts"]))
+        log = os.path.join(args.logs, name + ".log") if args.logs else None
+        start = time.time()
+        returncode = run_traced(job["command"], args.stage, job["input"], cwd=args.cwd, log=log,
+                                watch=Heartbeat(queue, job, worker), attempt=job["attempts"], worker=worker)
+        if returncode == 0 and args.mark:
+            mark(expand(args.mark, item_variables(job["input"])))
+        rejected = returncode == ABORTED
+        error = None if returncode == 0 else "rejected by the watchdog" if rejected else "exit status %d" % returncode
+        held = queue.finish(job["id"], worker, returncode, error, retry=args.retry_rejected or not rejected)
+
+        with lock:
+            (done if returncode == 0 else failed).append(name)
+        say("[%s] %s %s in %.1f s%s" % (worker, name, "done" if returncode == 0 else "REJECTED" if rejected else "FAILED",
+                                       time.time() - start,
+                                       "" if held else ", lease had been lost"))
+    queue.close()
+
+threads = [threading.Thread(target=slot, args=(number,)) for number in range(args.jobs)]
+for thread in threads:
+    thread.daemon = True
+    thread.start()
+while any(thread.is_alive() for thread in threads):
+    time.sleep(0.5)
+
+say("%d jobs done, %d failed on %s" % (len(done), len(failed), worker_name()))
+sys.exit(1 if failed else 0)
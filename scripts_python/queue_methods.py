@@ -0,0 +1,165 @@
+################################################################################
+# queue_methods.py
+#
+# Job queue of gprMax simulations in a SQLite file, so that workers on any
+# number of hosts that see the same filesystem share one campaign. A worker
+# leases a job for a number of seconds and renews the lease while the job
+# runs. A job whose lease runs out, because its worker died or lost its host,
+# goes back to the queue for another worker, until it has been tried
+# max_attempts times. Jobs are leased longest first by their predicted cost
+# (cost_methods). Every change is one short transaction, taken with BEGIN
+# IMMEDIATE so that two workers never lease the same job; the filesystem must
+# support POSIX locks, as local disks and NFSv4 do. Works under python 2 and 3.
+################################################################################
+
+from __future__ import division
+import os
+import socket
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    input TEXT UNIQUE NOT NULL,
+    command TEXT NOT NULL,
+    cost REAL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    enqueued REAL,
+    started REAL,
+    finished REAL,
+    returncode INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, cost);
+"""
+
+STATUSES = ["queued", "leased", "done", "failed"]
+
+def worker_name(slot=0):
+    # host:pid:slot, unique among the workers of a campaign
+    return "%s:%d:%d" % (socket.gethostname(), os.getpid(), slot)
+
+class JobQueue(object):
+
+    def __init__(self, filename, timeout=120.0):
+        self.filename = filename
+        # autocommit, transactions are begun explicitly
+        self.connection = sqlite3.connect(filename, timeout=timeout, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self, function):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(cursor)
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+        return result
+
+    def enqueue(self, jobs, max_attempts=3):
+        # add (input, command, cost) jobs, an input already queued is left as
+        # it is. Returns the number added.
+        def add(cursor):
+            added = 0
+            for input, command, cost in jobs:
+                cursor.execute("INSERT OR IGNORE INTO jobs (input, command, cost, status, max_attempts, enqueued) "
+                               "VALUES (?, ?, ?, 'queued', ?, ?)", (input, command, cost, max_attempts, time.time()))
+                added += cursor.rowcount
+            return added
+
+        return self._transaction(add)
+
+    def _expire(self, cursor, now):
+        # jobs whose worker stopped renewing go back to the queue
+        cursor.execute("UPDATE jobs SET status = 'failed', error = 'lease expired on ' || worker, finished = ? "
+                       "WHERE status = 'leased' AND lease_until < ? AND attempts >= max_attempts", (now, now))
+        cursor.execute("UPDATE jobs SET status = 'queued', error = 'lease expired on ' || worker "
+                       "WHERE status = 'leased' AND lease_until < ?", (now,))
+
+    def lease(self, worker, seconds):
+        # the next job for worker as a dict, longest first, or None if nothing
+        # is queued
+        def take(cursor):
+            now = time.time()
+            self._expire(cursor, now)
+            cursor.execute("SELECT * FROM jobs WHERE status = 'queued' "
+                           "ORDER BY cost IS NULL, cost DESC, id LIMIT 1")
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?, "
+                           "lease_until = ?, started = ? WHERE id = ?", (worker, now + seconds, now, row["id"]))
+            job = dict(row)
+            job.update(status="leased", attempts=row["attempts"] + 1, worker=worker)
+            return job
+
+        return self._transaction(take)
+
+    def renew(self, job_id, worker, seconds):
+        # extend the lease, False if the job is no longer this worker's
+        def extend(cursor):
+            cursor.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                           (time.time() + seconds, job_id, worker))
+            return cursor.rowcount == 1
+
+        return self._transaction(extend)
+
+    def finish(self, job_id, worker, returncode, error=None, retry=True):
+        # record the end of a job, a failure is queued again until it has
+        # been tried max_attempts times, or not at all without retry. False
+        # if the lease had been lost.
+        def end(cursor):
+            cursor.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'leased'",
+                           (job_id, worker))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            if returncode == 0:
+                status = "done"
+            elif retry and row["attempts"] < row["max_attempts"]:
+                status = "queued"
+            else:
+                status = "failed"
+            cursor.execute("UPDATE jobs SET status = ?, returncode = ?, error = ?, finished = ? WHERE id = ?",
+                           (status, returncode, error, time.time(), job_id))
+            return True
+
+        return self._transaction(end)
+
+    def counts(self):
+        def count(cursor):
+            self._expire(cursor, time.time())
+            cursor.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+            found = dict((row["status"], row["n"]) for row in cursor.fetchall())
+            return dict((status, found.get(status, 0)) for status in STATUSES)
+
+        return self._transaction(count)
+
+    def jobs(self, status=None):
+        cursor = self.connection.cursor()
+        if status is None:
+            cursor.execute("SELECT * FROM jobs ORDER BY id")
+        else:
+            cursor.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,))
+
+        return [dict(row) for row in cursor.fetchall()]
+
+    def retry_failed(self):
+        # queue the failed jobs again with fresh attempts, returns how many
+        def retry(cursor):
+            cursor.execute("UPDATE jobs SET status = 'queued', attempts = 0, error = NULL WHERE status = 'failed'")
+            return cursor.rowcount
+
+        return self._transaction(retry)
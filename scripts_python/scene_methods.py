@@ -0,0 +1,279 @@
+################################################################################
+# scene_methods.py
+#
+# Checks of the .in scenes of gprMax 3 (gpr-gen-new.py) and gprMax 2
+# (gpr-gen-noise.py) before they are simulated, so that a scene gprMax would
+# refuse, or that would only waste its hours, is caught in a fraction of a
+# second. A scene is parsed into its commands and the bounds of its objects,
+# and the objects are checked all at once against
+#
+#   the domain          every object lies inside it
+#   the PML             only the layers reaching the domain edge may enter
+#                       the absorbing cells, the landmine and the clutter not,
+#                       and the landmine does not touch the edge either
+#   the landmine        no sphere or cylinder of clutter overlaps it
+#   the antenna path    every source and receiver position of the B-scan is
+#                       inside the domain clear of the PML and of any object
+#
+# along with the commands gprMax needs and the materials, waveforms and
+# fractal boxes the commands refer to. The landmine is the geometry following
+# a comment that names it, as both generators write. Clutter that is out of
+# place can be dropped from the scene, anything else rejects it. Works under
+# python 2 and 3.
+################################################################################
+
+from __future__ import division
+import os
+import numpy as np
+
+# absorbing cells on each side when a scene does not say, gprMax 2 absorbs
+# with Higdon boundaries at the edge of the domain unless #abc_type: pml
+PML_CELLS = 10
+
+BUILTIN_MATERIALS = ["pec", "free_space"]
+
+# commands each version of gprMax needs, alternatives in a tuple
+REQUIRED = {3: ["#domain", "#dx_dy_dz", "#time_window", ("#hertzian_dipole", "#voltage_source", "#magnetic_dipole",
+                "#transmission_line"), "#waveform", ("#rx", "#rx_array")],
+            2: ["#domain", "#dx_dy", "#time_window", ("#line_source", "#hertzian_dipole"), "#analysis", "#tx",
+                "#rx", "#end_analysis"]}
+
+# position of the material in the values of each geometry command
+MATERIAL_INDEX = {3: {"#box": 6, "#sphere": 4, "#cylinder": 7},
+                  2: {"#box": 4, "#cylinder": 3}}
+
+class Scene(object):
+    # commands of a .in file as (line, name, values, mine) and its objects as
+    # arrays of lower and upper bounds
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename) as f:
+            self.lines = f.readlines()
+
+        self.commands = []
+        mine = False
+        for number, line in enumerate(self.lines):
+            text = line.strip()
+            if text.startswith("#") and ":" in text:
+                name, values = text.split(":", 1)
+                self.commands.append((number, name.strip(), values.split(), mine))
+            elif text:
+                # a comment naming the landmine starts it, any other ends it
+                mine = "landmine" in text.lower()
+
+        self.version = 3 if self.first("#dx_dy_dz") is not None or self.first("#dx_dy") is None else 2
+
+    def first(self, name):
+        for command in self.commands:
+            if command[1] == name:
+                return command[2]
+        return None
+
+    def all(self, name):
+        return [command for command in self.commands if command[1] == name]
+
+    def _vector(self, values, count=None):
+        count = count or (3 if self.version == 3 else 2)
+        vector = [float(v) for v in values[:count]]
+        return vector + [0.0] * (3 - len(vector))
+
+    def grid(self, pml_cells=None):
+        # domain size, cell size and the PML thickness below and above
+        # along each axis
+        domain = np.array(self._vector(self.first("#domain")))
+        dx = np.array(self._vector(self.first("#dx_dy_dz" if self.version == 3 else "#dx_dy")))
+        if pml_cells is not None:
+            cells = [pml_cells] * 6
+        elif self.first("#pml_cells") is not None:
+            cells = [int(v) for v in self.first("#pml_cells")]
+            cells = cells * 6 if len(cells) == 1 else cells
+        elif self.version == 2 and (self.first("#abc_type") or ["higdon"])[0] != "pml":
+            cells = [0] * 6
+        elif self.first("#pml_layers") is not None:
+            cells = [int(self.first("#pml_layers")[0])] * 6
+        else:
+            cells = [PML_CELLS] * 6
+        # no PML along an axis one cell thick, the third of a 2D model
+        thick = np.round(domain / np.where(dx > 0, dx, 1)) > 1
+        pml_lower = np.array(cells[:3], dtype=np.float64) * dx * thick
+        pml_upper = np.array(cells[3:6], dtype=np.float64) * dx * thick
+
+        return domain, dx, pml_lower, pml_upper, thick
+
+    def objects(self):
+        # (commands, lower, upper) of the geometry with bounds
+        found = []
+        lower = []
+        upper = []
+        for command in self.commands:
+            number, name, values, mine = command
+            if name in ("#box", "#fractal_box", "#add_surface_roughness"):
+                count = 6 if self.version == 3 else 4
+                low, high = self._vector(values[:count // 2]), self._vector(values[count // 2:count])
+            elif name == "#sphere":
+                centre, radius = np.array(self._vector(values[:3], 3)), float(values[3])
+                low, high = centre - radius, centre + radius
+            elif name == "#cylinder" and self.version == 3:
+                ends, radius = np.array([self._vector(values[:3], 3), self._vector(values[3:6], 3)]), float(values[6])
+                low, high = ends.min(axis=0) - radius, ends.max(axis=0) + radius
+            elif name == "#cylinder":
+                centre, radius = np.array(self._vector(values[:2], 2)), float(values[2])
+                low, high = centre - radius, centre + radius
+            else:
+                continue
+            found.append(command)
+            lower.append(low)
+            upper.append(high)
+
+        return found, np.array(lower, dtype=np.float64).reshape(-1, 3), np.array(upper, dtype=np.float64).reshape(-1, 3)
+
+    def antenna_path(self, traces=None):
+        # positions of the sources and of the receivers over the traces of
+        # the B-scan, traces from #analysis for gprMax 2 or 1 if not given
+        if traces is None:
+            traces = int(self.first("#analysis")[0]) if self.first("#analysis") else 1
+        steps = np.arange(traces, dtype=np.float64)[:, None]
+
+        paths = []
+        if self.version == 3:
+            sources = [c[2][1:4] for c in self.commands if c[1] in ("#hertzian_dipole", "#voltage_source",
+                                                                      "#magnetic_dipole", "#transmission_line")]
+            moves = [("src", sources, self.first("#src_steps")),
+                     ("rx", [c[2][:3] for c in self.all("#rx")], self.first("#rx_steps"))]
+        else:
+            moves = [("tx", [c[2][:2] for c in self.all("#tx")], self.first("#tx_steps")),
+                     ("rx", [c[2][:2] for c in self.all("#rx")], self.first("#rx_steps"))]
+        for kind, starts, step in moves:
+            step = np.array(self._vector(step)) if step else np.zeros(3)
+            for start in starts:
+                paths.append((kind, np.array(self._vector(start)) + steps * step))
+
+        return paths
+
+def check_references(scene):
+    # missing commands and names referred to but never defined
+    problems = []
+    for required in REQUIRED[scene.version]:
+        names = required if isinstance(required, tuple) else (required,)
+        if not any(scene.first(name) is not None for name in names):
+            problems.append("no " + " or ".join(names))
+
+    materials = set(BUILTIN_MATERIALS)
+    # the materials of a media file that cannot be read are not known
+    known = True
+    if scene.version == 3:
+        materials.update(c[2][4] for c in scene.all("#material") if len(c[2]) > 4)
+        mixing = set(c[2][-1] for c in scene.all("#soil_peplinski")) | materials
+        waveforms = set(c[2][3] for c in scene.all("#waveform") if len(c[2]) > 3)
+        fractal = set(c[2][12] for c in scene.all("#fractal_box") if len(c[2]) > 12)
+        for number, name, values, mine in scene.all("#fractal_box"):
+            if len(values) > 11 and values[11] not in mixing:
+                problems.append("line %d: unknown mixing model %s" % (number + 1, values[11]))
+        for number, name, values, mine in scene.all("#add_surface_roughness"):
+            if len(values) > 11 and values[11] not in fractal:
+                problems.append("line %d: unknown fractal box %s" % (number + 1, values[11]))
+        for number, name, values, mine in scene.commands:
+            if name in ("#hertzian_dipole", "#magnetic_dipole") and len(values) > 4 and values[4] not in waveforms:
+                problems.append("line %d: unknown waveform %s" % (number + 1, values[4]))
+    else:
+        materials.update(c[2][-1] for c in scene.all("#medium") if c[2])
+        media = scene.first("#media_file")
+        if media:
+            if os.path.exists(media[0]):
+                with open(media[0]) as f:
+                    materials.update(line.split()[-1] for line in f if line.split())
+            else:
+                problems.append("media file %s not found" % media[0])
+                known = False
+        sources = set(c[2][-1] for c in scene.all("#line_source") if c[2])
+        for number, name, values, mine in scene.all("#tx"):
+            if len(values) > 2 and values[2] not in sources:
+                problems.append("line %d: unknown source %s" % (number + 1, values[2]))
+
+    for number, name, values, mine in scene.commands:
+        index = MATERIAL_INDEX[scene.version].get(name)
+        if known and index is not None and len(values) > index and values[index] not in materials:
+            problems.append("line %d: unknown material %s" % (number + 1, values[index]))
+
+    return problems
+
+def check_geometry(scene, traces=None, pml_cells=None, tolerance=1e-9):
+    # [(line, reason, repairable)] of the objects and the antenna path, a
+    # repairable problem is clutter that can be dropped
+    domain, dx, pml_lower, pml_upper, thick = scene.grid(pml_cells)
+    commands, lower, upper = scene.objects()
+    mine = np.array([c[3] for c in commands], dtype=bool)
+    sphere = np.array([c[1] in ("#sphere", "#cylinder") for c in commands], dtype=bool)
+
+    # only the axes more than one cell thick are checked
+    axes = np.flatnonzero(thick)
+    lower, upper = lower[:, axes], upper[:, axes]
+    size, inner_lower, inner_upper = domain[axes], pml_lower[axes], domain[axes] - pml_upper[axes]
+
+    outside = np.any((lower < -tolerance) | (upper > size + tolerance), axis=1)
+    inverted = np.any(lower > upper + tolerance, axis=1)
+    # a box from the edge of the domain is a layer of the ground, which
+    # carries on into the PML
+    layer = ~mine & ~sphere & np.any((lower <= tolerance) | (upper >= size - tolerance), axis=1)
+    in_pml = ~layer & np.any((lower < inner_lower - tolerance) | (upper > inner_upper + tolerance), axis=1)
+    at_edge = mine & np.any((lower <= inner_lower + tolerance) | (upper >= inner_upper - tolerance), axis=1)
+
+    clutter = ~mine & ~layer
+    # the boxes of gpr-gen-noise.py are patches of soil the landmine is
+    # written over, only the spheres and cylinders are stones around it
+    mine_lower, mine_upper = lower[mine], upper[mine]
+    overlaps = np.all((lower[:, None, :] < mine_upper[None, :, :]) & (upper[:, None, :] > mine_lower[None, :, :]),
+                      axis=2).any(axis=1) & clutter & sphere
+
+    problems = []
+    for index in np.flatnonzero(outside | inverted | in_pml | at_edge | overlaps):
+        number, name, values, in_mine = commands[index]
+        if inverted[index]:
+            reason = "lower corner above upper"
+        elif outside[index]:
+            reason = "outside the domain"
+        elif in_pml[index]:
+            reason = "inside the PML"
+        elif at_edge[index]:
+            reason = "against the edge of the domain"
+        else:
+            reason = "overlaps the landmine"
+        what = "landmine" if in_mine else name[1:]
+        problems.append((number, "line %d: %s %s" % (number + 1, what, reason), bool(clutter[index])))
+
+    # the antenna moves with every trace, it must stay clear of the PML
+    # and of the landmine and clutter
+    solid_lower, solid_upper = lower[~layer], upper[~layer]
+    for kind, path in scene.antenna_path(traces):
+        path = path[:, axes]
+        bad = np.any((path < inner_lower - tolerance) | (path > inner_upper + tolerance), axis=1)
+        if bad.any():
+            problems.append((None, "%s leaves the domain or enters the PML at trace %d" %
+                             (kind, np.flatnonzero(bad)[0] + 1), False))
+        inside = np.all((path[:, None, :] >= solid_lower[None, :, :]) & (path[:, None, :] <= solid_upper[None, :, :]),
+                        axis=2).any(axis=1)
+        if inside.any():
+            problems.append((None, "%s inside an object at trace %d" % (kind, np.flatnonzero(inside)[0] + 1), False))
+
+    return problems
+
+def validate(scene, traces=None, pml_cells=None):
+    # [(line, reason, repairable)] of everything wrong with the scene
+    try:
+        problems = [(None, reason, False) for reason in check_references(scene)]
+        if not problems:
+            problems.extend(check_geometry(scene, traces, pml_cells))
+    except (ValueError, IndexError, TypeError) as error:
+        problems = [(None, "cannot be read, %s" % error, False)]
+
+    return problems
+
+def repaired_lines(scene, problems, note):
+    # lines of the scene without the clutter of the problems, with a note
+    dropped = set(number for number, reason, repairable in problems if repairable)
+    lines = [line for number, line in enumerate(scene.lines) if number not in dropped]
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
+    return lines + ["-- " + note + "\n"]
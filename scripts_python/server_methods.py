@@ -0,0 +1,204 @@
+################################################################################
+# server_methods.py
+#
+# Resident inference for localisation. A MicroBatcher owns the net and runs
+# every forward pass on one worker thread, windows of requests arriving at the
+# same time are joined into one batch, up to a batch size or a wait limit. The
+# InferenceClient talks to inference-server.py over loopback HTTP or a Unix
+# socket, arrays travel as .npy bytes.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import threading
+import Queue
+import collections
+import time
+import json
+import socket
+import httplib
+import urllib
+from StringIO import StringIO
+
+def to_npy(array):
+    buf = StringIO()
+    np.save(buf, np.asarray(array), allow_pickle=False)
+
+    return buf.getvalue()
+
+def from_npy(data):
+    return np.load(StringIO(data), allow_pickle=False)
+
+class MicroBatcher(object):
+    # predict takes an (n, height, width, channels) array of windows and returns
+    # (n, classes) probabilities. submit blocks until the windows of its request
+    # have been scored. The worker waits at most max_wait seconds after the first
+    # waiting request for others to join its batch, and stops adding requests
+    # once a batch holds max_batch windows.
+
+    def __init__(self, predict, max_batch=256, max_wait=0.01, history=1000):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.waiting_windows = 0
+        self.requests = 0
+        self.windows = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.started = time.time()
+        self.worker = threading.Thread(target=self._run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, windows):
+        windows = np.asarray(windows, dtype=np.float32)
+        request = {"windows": windows, "done": threading.Event(), "result": None,
+                   "error": None, "arrived": time.time()}
+        with self.lock:
+            self.waiting_windows += len(windows)
+        self.queue.put(request)
+        request["done"].wait()
+
+        if request["error"] is not None:
+            raise request["error"]
+
+        return request["result"]
+
+    def stop(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            size = len(first["windows"])
+            deadline = first["arrived"] + self.max_wait
+            while size < self.max_batch:
+                try:
+                    request = self.queue.get(timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    break
+                if request is None:
+                    self.queue.put(None)
+                    break
+                batch.append(request)
+                size += len(request["windows"])
+
+            self._score(batch, size)
+
+    def _score(self, batch, size):
+        start = time.time()
+        try:
+            probs = self.predict(np.concatenate([request["windows"] for request in batch], axis=0))
+            error = None
+        except Exception as e:
+            probs = None
+            error = e
+
+        finished = time.time()
+        with self.lock:
+            self.waiting_windows -= size
+            self.requests += len(batch)
+            self.windows += size
+            self.batches += 1
+            self.busy += finished - start
+            self.batch_sizes.append(size)
+            if error is not None:
+                self.errors += len(batch)
+            for request in batch:
+                self.latencies.append(finished - request["arrived"])
+
+        offset = 0
+        for request in batch:
+            n = len(request["windows"])
+            if error is None:
+                request["result"] = probs[offset:offset + n]
+            else:
+                request["error"] = error
+            offset += n
+            request["done"].set()
+
+    def metrics(self):
+        # queue depth now, counters since start and latency percentiles in
+        # milliseconds over the last history requests
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            sizes = np.array(self.batch_sizes)
+            uptime = time.time() - self.started
+            metrics = {"uptime_s": uptime,
+                       "queue_requests": self.queue.qsize(),
+                       "queue_windows": self.waiting_windows,
+                       "requests": self.requests,
+                       "windows": self.windows,
+                       "batches": self.batches,
+                       "errors": self.errors,
+                       "busy_fraction": self.busy / uptime if uptime > 0 else 0.0,
+                       "windows_per_s": self.windows / self.busy if self.busy > 0 else 0.0,
+                       "mean_batch": float(np.mean(sizes)) if len(sizes) > 0 else 0.0}
+        for p in (50, 95, 99):
+            metrics["latency_p%d_ms" % p] = float(np.percentile(latencies, p)) if len(latencies) > 0 else 0.0
+
+        return metrics
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    # HTTP over a Unix socket at path
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+class InferenceClient(object):
+    # client of inference-server.py, address is host:port or the path of a
+    # Unix socket
+
+    def __init__(self, address, timeout=600):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if ":" in self.address and not self.address.startswith("/"):
+            host, port = self.address.rsplit(":", 1)
+            return httplib.HTTPConnection(host, int(port), timeout=self.timeout)
+
+        return UnixHTTPConnection(self.address, self.timeout)
+
+    def _request(self, method, path, body=None):
+        connection = self._connection()
+        try:
+            connection.request(method, path, body, {"Content-Type": "application/octet-stream"})
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError('inference server: %d %s' % (response.status, data.strip()))
+
+        return data
+
+    def classify(self, windows):
+        # (n, classes) probabilities of an (n, height, width[, channels]) array
+        # of windows in [0 1]
+        return from_npy(self._request("POST", "/classify", to_npy(np.asarray(windows, dtype=np.float32))))
+
+    def heatmap(self, image, step=64, size=128):
+        # mean mine probability of every pixel of a (height, width[, channels])
+        # image in [0 1], over the size x size windows step pixels apart
+        query = urllib.urlencode({"step": step, "size": size})
+        return from_npy(self._request("POST", "/heatmap?" + query, to_npy(np.asarray(image, dtype=np.float32))))
+
+    def metrics(self):
+        return json.loads(self._request("GET", "/metrics"))
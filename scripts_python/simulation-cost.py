@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+################################################################################
+# simulation-cost.py
+#
+# Predicts the run time of the gprMax simulation of each .in file from its
+# domain, cell size, time window, traces and geometry (cost_methods), lists
+# the files longest first and gives the ETA of the campaign on a number of
+# workers, taking the files longest first and in ls order. With --calibrate
+# the model is first fitted to the simulate records of traces of past runs
+# and saved, which pipeline.py and stream-worker.py then use to order their
+# simulations.
+################################################################################
+
+from __future__ import print_function
+import argparse
+import glob
+import os
+from cost_methods import CostModel, makespan, format_duration
+from trace_methods import read_trace
+
+#   Usage:
+#
+#     simulation-cost.py -i <str> [-m <str>] [--calibrate <str> ...]
+#
+#   where
+#     --input <str> this is the directory of .in files, or a glob of them
+#     -i
+#
+#     --model <str> optional, json coefficients of the cost model, read if it
+#     -m            exists and written after --calibrate (cost-model.json)
+#
+#     --calibrate <str> optional, trace of past runs to fit the model to, can
+#                       be given more than once
+#
+#     --traces <int> optional, traces of each B-scan (95)
+#     -n
+#
+#     --gpu optional, predict runs on a gpu
+#
+#     --jobs <int> optional, simulations run at once (1)
+#     -j
+#
+
+parser = argparse.ArgumentParser(description='predict gprMax run times and the campaign ETA')
+
+parser.add_argument('-i', '--input', required=True, dest='input', action='store', help='directory or glob of .in files')
+
+parser.add_argument('-m', '--model', dest='model', default='cost-model.json', action='store', help='json coefficients of the cost model')
+
+parser.add_argument('--calibrate', dest='calibrate', default=[], action='append', help='trace of past runs to fit the model to')
+
+parser.add_argument('-n', '--traces', dest='traces', default=95, type=int, action='store', help='traces of each B-scan')
+
+parser.add_argument('--gpu', dest='gpu', default=False, action='store_true', help='predict runs on a gpu')
+
+parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int, action='store', help='simulations run at once')
+
+args = parser.parse_args()
+
+model = CostModel(args.model)
+
+if args.calibrate:
+    records = []
+    for filename in args.calibrate:
+        records.extend(read_trace(filename))
+    fitted = model.fit(records)
+    if len(fitted) == 0:
+        print("Too few simulate records with their .in files to calibrate, keeping the coefficients")
+    for device, (runs, error) in sorted(fitted.items()):
+        print("Calibrated %s on %d runs, median error %.0f%%" % (device, runs, 100 * error))
+    if fitted:
+        model.save(args.model)
+        print("Saved " + args.model)
+
+pattern = os.path.join(args.input, "*.in") if os.path.isdir(args.input) else args.input
+files = sorted(glob.glob(pattern))
+command = "-n %d%s" % (args.traces, " -gpu" if args.gpu else "")
+
+costs = []
+for filename in files:
+    cost = model.predict_file(filename, command)
+    if cost is None:
+        print("Cannot parse " + filename)
+        continue
+    costs.append((cost, filename))
+
+if costs:
+    print("")
+    print("%-40s %12s" % ("file (longest first)", "predicted"))
+    for cost, filename in sorted(costs, reverse=True):
+        print("%-40s %12s" % (os.path.basename(filename), format_duration(cost)))
+
+    in_order = [cost for cost, _ in costs]
+    print("")
+    print("%d files on %d workers: ETA %s longest first, %s in ls order" % (
+        len(costs), args.jobs, format_duration(makespan(sorted(in_order, reverse=True), args.jobs)),
+        format_duration(makespan(in_order, args.jobs))))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+################################################################################
+# simulation-watchdog.py
+#
+# Runs a gprMax simulation and checks each trace as soon as it is written
+# (watchdog_methods), instead of finding a degenerate B-scan after all its
+# traces and its post processing as remove-skewed-data.py does. When a trace
+# is bad the simulation is stopped, the reason is written to {stem}.rejected
+# next to the .in file and to the trace named by $GPR_TRACE, and the exit
+# status is 3, which the pipelines take as a rejected scene rather than a
+# failure: pipeline.py records it as done without outputs and queue-worker.py
+# does not try it again unless --retry-rejected. With --discard the traces
+# written so far are removed. Otherwise the exit status is the simulation's.
+# It wraps the simulate command of the pipelines, e.g.
+#
+#   simulation-watchdog.py -i with0.in -n 95 -- python3 -m gprMax with0.in -n 95
+#
+# Works under python 2 and 3, so it runs inside the python 3 environment.
+################################################################################
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from watchdog_methods import TraceWatchdog, ABORTED, DEFAULTS
+from stream_methods import mark
+from trace_methods import run_traced, terminate, record
+
+#   Usage:
+#
+#     simulation-watchdog.py -i <str> -n <int> [--discard] -- <command>
+#
+#   where
+#     --input <str> this is the .in file the command simulates
+#     -i
+#
+#     --traces <int> this is the number of traces, -n of gprMax
+#     -n
+#
+#     --discard optional, remove the traces of a stopped simulation
+#
+#     --field <str> optional, field checked at the receiver ("Ez")
+#
+#     --max-peak, --growing-peak, --tail-ratio, --min-similarity <float>
+#         optional, limits of the checks, see watchdog_methods.py
+#
+#     --interval <float> optional, seconds between looks for new traces (2)
+#
+
+parser = argparse.ArgumentParser(description='run a gprMax simulation and stop it once a trace is bad')
+
+parser.add_argument('-i', '--input', required=True, dest='input', action='store', help='.in file the command simulates')
+
+parser.add_argument('-n', '--traces', required=True, dest='traces', type=int, action='store', help='number of traces')
+
+parser.add_argument('--discard', dest='discard', default=False, action='store_true', help='remove the traces of a stopped simulation')
+
+parser.add_argument('--field', dest='field', default='Ez', action='store', help='field checked at the receiver')
+
+parser.add_argument('--max-peak', dest='max_peak', default=DEFAULTS["max_peak"], type=float, action='store', help='largest allowed peak field')
+
+parser.add_argument('--growing-peak', dest='growing_peak', default=DEFAULTS["growing_peak"], type=float, action='store', help='largest allowed peak as a multiple of the first trace\'s')
+
+parser.add_argument('--tail-ratio', dest='tail_ratio', default=DEFAULTS["tail_ratio"], type=float, action='store', help='largest allowed late time power as a multiple of the direct wave\'s')
+
+parser.add_argument('--min-similarity', dest='min_similarity', default=DEFAULTS["min_similarity"], type=float, action='store', help='smallest allowed correlation with the previous trace')
+
+parser.add_argument('--interval', dest='interval', default=2.0, type=float, action='store', help='seconds between looks for new traces')
+
+parser.add_argument('command', nargs=argparse.REMAINDER, help='simulation command, after --')
+
+args = parser.parse_args()
+
+command = args.command[1:] if args.command[:1] == ['--'] else args.command
+if len(command) == 0:
+    parser.error('no command given')
+
+stem = os.path.splitext(args.input)[0]
+rejected = stem + ".rejected"
+if os.path.exists(rejected):
+    os.remove(rejected)
+
+watchdog = TraceWatchdog(stem, args.traces, args.field, limits={"max_peak": args.max_peak,
+                                                                 "growing_peak": args.growing_peak,
+                                                                 "tail_ratio": args.tail_ratio,
+                                                                 "min_similarity": args.min_similarity})
+
+# the simulation stays in this process group, so that whoever stops this
+# process by its group stops it too; a plain SIGTERM is passed on
+running = {}
+def watch(process):
+    running["pid"] = process.pid
+    return watchdog(process)
+
+def stop(signum, frame):
+    if "pid" in running:
+        terminate(running["pid"], signal.SIGTERM, False)
+    sys.exit(128 + signum)
+signal.signal(signal.SIGTERM, stop)
+
+start = time.time()
+returncode = run_traced(command, "watchdog", args.input, watch=watch, interval=args.interval, group=False)
+
+reason = watchdog.reason
+if reason is None and returncode == 0:
+    # the traces written since the last look
+    reason = watchdog.check(ended=True)
+
+if reason is None:
+    sys.exit(returncode)
+
+print("Stopped the simulation of %s after %.0f s, %s" % (args.input, time.time() - start, reason))
+fields = {"input": args.input, "reason": reason, "traces_checked": watchdog.checked, "traces": args.traces,
+          "seconds": time.time() - start}
+mark(rejected, json.dumps(fields) + "\n")
+record(stage="watchdog.rejected", file=args.input, status="rejected", **dict((k, fields[k]) for k in ("reason", "traces_checked", "traces")))
+if args.discard:
+    for filename in watchdog.written():
+        os.remove(filename)
+
+sys.exit(ABORTED)
@@ -0,0 +1,22 @@
+################################################################################
+# split_methods.py
+#
+# Splitting of the radargram .png files by scene. The radargrams of the
+# receivers of one scene, <name>.rx1.png to <name>.rxN.png, are views of one
+# simulation, so they always go to the same side of a split.
+################################################################################
+
+import re
+
+def scene_id(file_name):
+    # <name> of <name>.png or <name>.rxN.png
+    return re.sub(r"(\.rx\d+)?\.png$", "", file_name)
+
+def split_by_scene(split, file_names, **kwargs):
+    # split, e.g. train_test_split, is applied to the scenes of file_names
+    # rather than to the files, and the files of each side are handed back
+    first, second = split(sorted(set(scene_id(f) for f in file_names)), **kwargs)
+    first = set(first)
+
+    return ([f for f in file_names if scene_id(f) in first],
+            [f for f in file_names if scene_id(f) not in first])
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+################################################################################
+# stream-worker.py
+#
+# Worker of one pipeline stage in streaming mode. It watches a directory and
+# runs its command on each file as soon as the file is complete, instead of
+# waiting for the previous stage to finish every file, so simulation, merging
+# and post processing overlap (see pipeline-stream.sh). After the command
+# succeeds the worker writes the marker --mark, which is what the next stage
+# waits for, and when the previous stage has written its --end marker and no
+# file is left the worker writes its own --finish marker and exits. Claims make
+# it safe to run several workers of a stage on the same directory, and files a
+# worker has settled are not taken again after a restart. With --longest-first
+# the .in files ready at once are simulated in order of their predicted cost,
+# largest first. A file whose command exits with --reject-status, e.g. a scene
+# stopped by simulation-watchdog.py, is rejected: it gets no marker and does
+# not count as a failure. Every file is recorded in the trace named by
+# $GPR_TRACE.
+################################################################################
+
+import argparse
+import os
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from dag_methods import expand, item_variables
+from stream_methods import Watcher, StageFiles, mark
+from trace_methods import run_traced
+from cost_methods import CostModel
+
+#   Usage:
+#
+#     stream-worker.py -s <str> -i <str> -c <str> [-r <str>] [-m <str>]
+#                      [--end <str>] [--finish <str>]
+#
+#   where
+#     --stage <str> this is the name of the stage, e.g. merge
+#     -s
+#
+#     --input <str> this is the glob of the files to watch, e.g.
+#     -i            "data/stage1/*_merged.out", quoted for the shell
+#
+#     --command <str> this is the shell command run on each file, with
+#     -c              {input}, {name}, {stem} and {dir} of the file
+#
+#     --ready <str> optional, marker that shows a file is complete
+#     -r            ("{input}.done"), "" to wait for the file to stop changing
+#
+#     --settle <float> optional, seconds a file without a ready marker must
+#                      be unchanged (5)
+#
+#     --mark <str> optional, marker written after the command succeeds,
+#     -m           e.g. "{dir}/{stem}_merged.out.done"
+#
+#     --end <str> optional, marker of the previous stage having finished,
+#                 without it the worker runs until interrupted
+#
+#     --finish <str> optional, marker written when this worker is finished
+#
+#     --cwd <str> optional, directory the command runs in
+#
+#     --jobs <int> optional, files processed at once (1)
+#     -j
+#
+#     --poll <float> optional, seconds between looks at the directory (1)
+#
+#     --longest-first optional, take the .in files with the longest
+#                     predicted simulation first
+#
+#     --cost-model <str> optional, coefficients calibrated by
+#                        simulation-cost.py, rough defaults without
+#
+#     --reject-status <int> optional, exit status of a rejected file, e.g. 3
+#                           of simulation-watchdog.py
+#
+
+parser = argparse.ArgumentParser(description='run a command on each file of a directory as soon as it is complete')
+
+parser.add_argument('-s', '--stage', required=True, dest='stage', action='store', help='name of the stage')
+
+parser.add_argument('-i', '--input', required=True, dest='input', action='store', help='glob of the files to watch')
+
+parser.add_argument('-c', '--command', required=True, dest='command', action='store', help='shell command run on each file')
+
+parser.add_argument('-r', '--ready', dest='ready', default='{input}.done', action='store', help='marker that shows a file is complete, "" to wait for it to stop changing')
+
+parser.add_argument('--settle', dest='settle', default=5.0, type=float, action='store', help='seconds a file without a ready marker must be unchanged')
+
+parser.add_argument('-m', '--mark', dest='mark', default=None, action='store', help='marker written after the command succeeds')
+
+parser.add_argument('--end', dest='end', default=None, action='store', help='marker of the previous stage having finished')
+
+parser.add_argument('--finish', dest='finish', default=None, action='store', help='marker written when this worker is finished')
+
+parser.add_argument('--cwd', dest='cwd', default=None, action='store', help='directory the command runs in')
+
+parser.add_argument('-j', '--jobs', dest='jobs', default=1, type=int, action='store', help='files processed at once')
+
+parser.add_argument('--poll', dest='poll', default=1.0, type=float, action='store', help='seconds between looks at the directory')
+
+parser.add_argument('--longest-first', dest='longest_first', default=False, action='store_true', help='take the files with the longest predicted simulation first')
+
+parser.add_argument('--cost-model', dest='cost_model', default=None, action='store', help='coefficients calibrated by simulation-cost.py')
+
+parser.add_argument('--reject-status', dest='reject_status', default=None, type=int, action='store', help='exit status of a rejected file')
+
+args = parser.parse_args()
+
+watcher = Watcher(args.input, args.ready or None, args.settle, args.poll)
+files = StageFiles(args.stage)
+pool = ThreadPool(args.jobs)
+lock = threading.Lock()
+running = set()
+failed = []
+rejected = []
+model = CostModel(args.cost_model) if args.longest_first else None
+costs = {}
+
+def ready_files():
+    paths = watcher.files()
+    if model is not None:
+        for path in paths:
+            if path not in costs:
+                costs[path] = model.predict_file(path, expand(args.command, item_variables(path))) or 0
+        paths.sort(key=lambda path: -costs[path])
+
+    return paths
+
+def say(text):
+    with lock:
+        print(time.strftime("%H:%M:%S ") + "[%s] %s" % (args.stage, text))
+        sys.stdout.flush()
+
+def process(path):
+    variables = item_variables(path)
+    ok = False
+    reject = False
+    try:
+        start = time.time()
+        returncode = run_traced(expand(args.command, variables), args.stage, path, cwd=args.cwd)
+        ok = returncode == 0
+        reject = args.reject_status is not None and returncode == args.reject_status
+        if ok and args.mark:
+            mark(expand(args.mark, variables))
+        outcome = "done" if ok else "rejected" if reject else "FAILED with exit status %d" % returncode
+        say("%s %s in %.1f s" % (os.path.basename(path), outcome, time.time() - start))
+    except Exception as e:
+        say("%s FAILED: %s" % (os.path.basename(path), e))
+    finally:
+        files.finish(path, ok, reject)
+        with lock:
+            running.discard(path)
+            if reject:
+                rejected.append(path)
+            elif not ok:
+                failed.append(path)
+
+say("watching " + args.input)
+try:
+    while True:
+        # the end marker is looked at before the directory, so that no file
+        # written before it is missed
+        ended = args.end is not None and os.path.exists(args.end)
+        for path in ready_files():
+            with lock:
+                if path in running or len(running) >= args.jobs:
+                    continue
+            if files.take(path):
+                with lock:
+                    running.add(path)
+                pool.apply_async(process, (path,))
+        with lock:
+            idle = len(running) == 0
+        if ended and idle and all(files.settled(path) for path in watcher.expected()):
+            break
+        watcher.wait()
+finally:
+    pool.close()
+    pool.join()
+
+if args.finish:
+    mark(args.finish, "%d failed, %d rejected\n" % (len(failed), len(rejected)))
+
+say("finished, %d failed, %d rejected" % (len(failed), len(rejected)))
+sys.exit(1 if failed else 0)
@@ -0,0 +1,133 @@
+################################################################################
+# stream_methods.py
+#
+# Hand over of files between stage workers that run at the same time and watch
+# the same directories. A file is complete once its ready marker exists, a
+# small file written under a temporary name and renamed into place, so a
+# watcher never takes a file that is still being written. Where the writer
+# leaves no marker a file counts as complete once it has not changed for a
+# while. Each worker claims a file by creating a claim file exclusively, so
+# several workers of a stage can share a directory, and renames the claim to
+# .ok or .failed when it is done, so a restarted worker carries on where it
+# stopped. Works under python 2 and 3 like trace_methods.
+################################################################################
+
+from __future__ import division
+import errno
+import glob
+import os
+import socket
+import time
+from dag_methods import expand, item_variables
+
+def mark(path, text=""):
+    # create the marker path atomically
+    temporary = "%s.tmp.%d" % (path, os.getpid())
+    with open(temporary, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary, path)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+def claim(path):
+    # True if this process now holds the claim file path. A claim left by a
+    # process of this host that has died is taken over.
+    for _ in range(2):
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            try:
+                with open(path) as f:
+                    host, pid = f.read().split()[:2]
+            except (IOError, OSError, ValueError):
+                return False
+            if host != socket.gethostname() or pid_alive(int(pid)):
+                return False
+            try:
+                os.remove(path)
+            except OSError:
+                return False
+            continue
+        os.write(descriptor, ("%s %d %f\n" % (socket.gethostname(), os.getpid(), time.time())).encode("ascii"))
+        os.close(descriptor)
+        return True
+
+    return False
+
+class Watcher(object):
+    # complete files matching pattern, polled every poll seconds. ready is a
+    # marker template such as "{input}.done", or None to wait until a file has
+    # not changed for settle seconds.
+
+    def __init__(self, pattern, ready="{input}.done", settle=5.0, poll=1.0):
+        self.pattern = pattern
+        self.ready = ready
+        self.settle = settle
+        self.poll = poll
+
+    def complete(self, path):
+        if self.ready:
+            return os.path.exists(expand(self.ready, item_variables(path)))
+        try:
+            return time.time() - os.path.getmtime(path) >= self.settle
+        except OSError:
+            return False
+
+    def files(self):
+        # complete files now, in name order
+        return [path for path in sorted(glob.glob(self.pattern)) if self.complete(path)]
+
+    def expected(self):
+        # files that are or will be complete, without a ready marker every file
+        # is once it stops changing
+        return self.files() if self.ready else sorted(glob.glob(self.pattern))
+
+    def wait(self):
+        time.sleep(self.poll)
+
+class StageFiles(object):
+    # claim, done, failed and rejected files of the inputs of one stage
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def claim_file(self, path):
+        return "%s.%s.claim" % (path, self.stage)
+
+    def ok_file(self, path):
+        return "%s.%s.ok" % (path, self.stage)
+
+    def failed_file(self, path):
+        return "%s.%s.failed" % (path, self.stage)
+
+    def rejected_file(self, path):
+        return "%s.%s.rejected" % (path, self.stage)
+
+    def settled(self, path):
+        # processed, with or without success
+        return (os.path.exists(self.ok_file(path)) or os.path.exists(self.failed_file(path)) or
+                os.path.exists(self.rejected_file(path)))
+
+    def take(self, path):
+        if self.settled(path) or not claim(self.claim_file(path)):
+            return False
+        # another worker may have finished it between the check and the claim
+        if self.settled(path):
+            os.remove(self.claim_file(path))
+            return False
+
+        return True
+
+    def finish(self, path, ok, rejected=False):
+        settled = self.ok_file(path) if ok else self.rejected_file(path) if rejected else self.failed_file(path)
+        os.rename(self.claim_file(path), settled)
@@ -0,0 +1,403 @@
+################################################################################
+# svm_methods.py
+#
+# Methods for fitting the SVM to datasets too large for the exact kernel SVC.
+# The RBF kernel is approximated with random Fourier features (or Nystroem) and
+# a linear classifier is trained chunk by chunk from memory-mapped arrays.
+# Also holds a parallel successive halving search over C and gamma and the
+# saving and loading of trained models.
+################################################################################
+
+from __future__ import division
+import numpy as np
+import os, time, json, hashlib
+from multiprocessing import Pool, cpu_count
+from sklearn import svm
+from sklearn.kernel_approximation import RBFSampler, Nystroem
+from sklearn.linear_model import SGDClassifier, LogisticRegression
+from sklearn.metrics import accuracy_score
+
+CLASSES = np.array([0, 1])
+
+def to_memmap(images, transform, filename, chunk_size=10000):
+    # turn a (height, width, images) stack, which may itself be a memory map,
+    # in to the (samples, features) rows of a float32 .npy file chunk by chunk,
+    # transform mapping a float32 chunk of images to its rows, so that neither
+    # the stack nor the features are held in memory whole. Hands back a
+    # read-only memory map of the rows.
+    n_images = images.shape[2]
+    out = None
+    for start in range(0, n_images, chunk_size):
+        rows = transform(np.array(images[:,:,start:start + chunk_size], dtype=np.float32))
+        if out is None:
+            out = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32,
+                                            shape=(n_images, rows.shape[1]))
+        out[start:start + rows.shape[0]] = rows
+    out.flush()
+    del out
+
+    return np.load(filename, mmap_mode='r')
+
+def iterate_chunks(start, stop, chunk_size, shuffle=False, rng=np.random):
+    # yield contiguous slices so that memory-mapped reads stay sequential
+    starts = np.arange(start, stop, chunk_size)
+    if shuffle:
+        rng.shuffle(starts)
+    for idx in starts:
+        yield slice(idx, min(idx + chunk_size, stop))
+
+def kernel_map(method, gamma, n_components, random_state=None):
+    if method == "rff":
+        return RBFSampler(gamma=gamma, n_components=n_components, random_state=random_state)
+    elif method == "nystroem":
+        return Nystroem(kernel='rbf', gamma=gamma, n_components=n_components, random_state=random_state)
+    else:
+        raise ValueError('method must be "rff" or "nystroem"')
+
+class ApproxSVM(object):
+    # kernel map followed by a linear SVM, with a sigmoid (Platt) fit of the
+    # decision values giving calibrated mine probabilities
+
+    def __init__(self, feature_map, clf, calibration=(1.0, 0.0)):
+        self.feature_map = feature_map
+        self.clf = clf
+        self.calibration = calibration
+
+    def decision_function(self, X):
+        return self.clf.decision_function(self.feature_map.transform(X))
+
+    def calibrate(self, X, Y):
+        lr = LogisticRegression(C=1e6, solver='liblinear').fit(self.decision_function(X)[:,np.newaxis], Y)
+        self.calibration = (float(lr.coef_[0,0]), float(lr.intercept_[0]))
+        return self
+
+    def predict_proba(self, X):
+        a, b = self.calibration
+        probability = 1/(1 + np.exp(-(a*self.decision_function(X) + b)))
+        return np.column_stack((1 - probability, probability))
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:,1] >= 0.5).astype(np.uint8)
+
+    def get_state(self):
+        state = dict(coef=self.clf.coef_, intercept=self.clf.intercept_, t=np.array(self.clf.t_),
+                     calibration=np.array(self.calibration),
+                     gamma=np.array(self.feature_map.gamma),
+                     n_components=np.array(self.feature_map.n_components))
+        if isinstance(self.feature_map, Nystroem):
+            state.update(method=np.array("nystroem"), components=self.feature_map.components_,
+                         normalization=self.feature_map.normalization_,
+                         component_indices=self.feature_map.component_indices_)
+        else:
+            state.update(method=np.array("rff"), random_weights=self.feature_map.random_weights_,
+                         random_offset=self.feature_map.random_offset_)
+
+        return state
+
+    def set_state(self, state):
+        # rebuild the fitted kernel map and classifier from their saved arrays
+        method = str(state["method"])
+        self.feature_map = kernel_map(method, float(state["gamma"]), int(state["n_components"]))
+        if method == "nystroem":
+            self.feature_map.components_ = state["components"]
+            self.feature_map.normalization_ = state["normalization"]
+            self.feature_map.component_indices_ = state["component_indices"]
+        else:
+            self.feature_map.random_weights_ = state["random_weights"]
+            self.feature_map.random_offset_ = state["random_offset"]
+
+        self.clf = SGDClassifier(loss='hinge', penalty='l2')
+        self.clf.coef_ = np.array(state["coef"])
+        self.clf.intercept_ = np.array(state["intercept"])
+        self.clf.t_ = float(state["t"])
+        self.clf.classes_ = CLASSES
+        self.calibration = tuple(state["calibration"])
+
+        return self
+
+def approx_svm_fit(X, Y, gamma=1, C=1, method="rff", n_components=2000, chunk_size=10000,
+                   n_epochs=5, calibration_size=0.1, random_state=None, init=None):
+    # X is (samples, features) and may be a memory map, only one chunk of it is
+    # held in memory at a time. The last calibration_size of the samples are kept
+    # back to calibrate the probabilities once training has finished. If init is
+    # a trained ApproxSVM its kernel map and weights are the starting point.
+    rng = np.random.RandomState(random_state)
+    n_samples = X.shape[0]
+    n_cal = int(np.clip(np.round(n_samples*calibration_size), 2, 50000))
+    n_train = n_samples - n_cal
+
+    if init is not None:
+        feature_map = init.feature_map
+        clf = init.clf
+        clf.set_params(alpha=1/(C*n_train), random_state=random_state)
+    else:
+        # fit the kernel map, Nystroem needs a sample of landmark points
+        feature_map = kernel_map(method, gamma, n_components, random_state)
+        if method == "nystroem":
+            landmarks = np.sort(rng.choice(n_train, min(n_components, n_train), replace=False))
+            feature_map.fit(np.asarray(X[landmarks], dtype=np.float32))
+        else:
+            feature_map.fit(np.asarray(X[:1], dtype=np.float32))
+
+        # hinge loss + l2 penalty is the linear SVM objective, alpha = 1/(C*n)
+        clf = SGDClassifier(loss='hinge', penalty='l2', alpha=1/(C*n_train), random_state=random_state)
+
+    for epoch in range(n_epochs):
+        for chunk in iterate_chunks(0, n_train, chunk_size, shuffle=True, rng=rng):
+            order = rng.permutation(chunk.stop - chunk.start)
+            features = feature_map.transform(np.asarray(X[chunk], dtype=np.float32)[order])
+            clf.partial_fit(features, Y[chunk][order], classes=CLASSES)
+
+    # calibrate probabilities once on the held back samples
+    model = ApproxSVM(feature_map, clf)
+    model.calibrate(np.asarray(X[n_train:], dtype=np.float32), Y[n_train:])
+
+    return model
+
+def exact_svm_fit(X, Y, gamma=1, C=1, init=None):
+    # only the support vectors define an SVM, so a refit starting from init (a
+    # trained SVC) only needs its support vectors plus the new training data.
+    # Those already in the training data are left out, as a duplicate would
+    # double their weight C.
+    if init is not None:
+        keep = new_rows(init.support_vectors_, X)
+        X = np.vstack((init.support_vectors_[keep], np.asarray(X, dtype=init.support_vectors_.dtype)))
+        Y = np.concatenate((init.support_labels_[keep], Y))
+
+    clf = svm.SVC(kernel='rbf', gamma=gamma, C=C, probability=True)
+    clf.fit(X, Y)
+    clf.support_labels_ = np.asarray(Y)[clf.support_]
+
+    return clf
+
+def new_rows(rows, X):
+    # mask of the rows that are not already a row of X, compared bit for bit
+    X = np.ascontiguousarray(X)
+    rows = np.ascontiguousarray(rows, dtype=X.dtype)
+    row_type = np.dtype((np.void, X.dtype.itemsize*X.shape[1]))
+
+    return ~np.in1d(rows.view(row_type).ravel(), X.view(row_type).ravel())
+
+def exact_svm_rebuild(state, gamma, C):
+    # set the fitted attributes of an SVC from their saved arrays, so that the
+    # loaded model gives exactly the decision values and probabilities of the
+    # saved one without being trained again. libsvm keeps the dual coefficients
+    # and intercept of a binary SVC with the opposite sign to sklearn.
+    clf = svm.SVC(kernel='rbf', gamma=gamma, C=C, probability=True)
+    clf.support_vectors_ = np.asarray(state["support_vectors"], dtype=np.float64)
+    clf.support_ = np.asarray(state["support"], dtype=np.int32)
+    clf.n_support_ = np.asarray(state["n_support"], dtype=np.int32)
+    clf.dual_coef_ = np.asarray(state["dual_coef"], dtype=np.float64)
+    clf.intercept_ = np.asarray(state["intercept"], dtype=np.float64)
+    clf._dual_coef_ = -clf.dual_coef_
+    clf._intercept_ = -clf.intercept_
+    clf.probA_ = np.asarray(state["probA"], dtype=np.float64)
+    clf.probB_ = np.asarray(state["probB"], dtype=np.float64)
+    clf.classes_ = np.asarray(state["classes"])
+    clf.class_weight_ = np.ones(len(clf.classes_))
+    clf.shape_fit_ = tuple(state["shape_fit"])
+    clf.fit_status_ = 0
+    clf._gamma = gamma
+    clf._sparse = False
+    clf.support_labels_ = state["support_labels"]
+
+    return clf
+
+################################################################################
+# saving and loading trained models
+################################################################################
+
+def save_svm(filename, model, C, gamma, preprocessor=None, features="pixels"):
+    # write a trained SVM (and the preprocessing it was trained with) to an npz
+    state = dict(C=np.array(C), gamma=np.array(gamma), features=np.array(features))
+    if isinstance(model, ApproxSVM):
+        state["solver"] = np.array("approx")
+        state.update(model.get_state())
+    else:
+        state["solver"] = np.array("exact")
+        state.update(support_vectors=model.support_vectors_, support=model.support_,
+                     n_support=model.n_support_, dual_coef=model.dual_coef_,
+                     intercept=model.intercept_, probA=model.probA_, probB=model.probB_,
+                     classes=model.classes_, shape_fit=np.array(model.shape_fit_),
+                     support_labels=model.support_labels_)
+    if preprocessor is not None:
+        state.update(preprocessor.get_state())
+
+    np.savez_compressed(filename, **state)
+
+def load_svm(filename):
+    # returns the model, its C and gamma, and the raw state for the preprocessing
+    state = np.load(filename)
+    C = float(state["C"])
+    gamma = float(state["gamma"])
+
+    if str(state["solver"]) == "approx":
+        model = ApproxSVM(None, None).set_state(state)
+    else:
+        model = exact_svm_rebuild(state, gamma, C)
+
+    return model, C, gamma, state
+
+def approx_svm_predict(model, X, chunk_size=10000):
+    # predict class and mine probability chunk by chunk
+    probability = np.empty(X.shape[0], dtype=np.float32)
+    for chunk in iterate_chunks(0, X.shape[0], chunk_size):
+        probability[chunk] = model.predict_proba(np.asarray(X[chunk], dtype=np.float32))[:,1]
+
+    return (probability >= 0.5).astype(np.uint8), probability
+
+def benchmark_svm(X_train, Y_train, X_test, Y_test, sizes, gamma=1, C=1, method="rff",
+                  n_components=2000, chunk_size=10000, max_exact=20000):
+    # time the exact SVC against the approximation on growing training subsets,
+    # the exact SVC is skipped once the subset is larger than max_exact
+    results = []
+    X_eval = np.asarray(X_test, dtype=np.float32)
+
+    print ""
+    print "%10s %10s %12s %12s %10s" % ("samples", "solver", "fit [s]", "predict [s]", "accuracy")
+    for size in sizes:
+        size = min(size, X_train.shape[0])
+        solvers = ["approx"] if size > max_exact else ["exact", "approx"]
+
+        for solver in solvers:
+            start_time = time.time()
+            if solver == "exact":
+                clf = exact_svm_fit(np.asarray(X_train[:size]), Y_train[:size], gamma, C)
+                fit_time = time.time() - start_time
+                start_time = time.time()
+                Y_predict = clf.predict(X_eval)
+            else:
+                model = approx_svm_fit(X_train[:size], Y_train[:size], gamma, C, method,
+                                       n_components, chunk_size)
+                fit_time = time.time() - start_time
+                start_time = time.time()
+                Y_predict, _ = approx_svm_predict(model, X_eval, chunk_size)
+            predict_time = time.time() - start_time
+            accuracy = accuracy_score(Y_test, Y_predict)
+
+            print "%10d %10s %12.3f %12.3f %10.3f" % (size, solver, fit_time, predict_time, accuracy)
+            results.append(dict(samples=size, solver=solver, fit_time=fit_time,
+                                predict_time=predict_time, accuracy=accuracy))
+
+    print ""
+    return results
+
+################################################################################
+# successive halving search
+################################################################################
+
+# memory maps opened once per worker process by init_search_worker
+search_X = None
+search_Y = None
+
+def init_search_worker(X_file, Y_file):
+    # workers open the shared features read-only, nothing is pickled per task
+    global search_X, search_Y
+    search_X = np.load(X_file, mmap_mode='r')
+    search_Y = np.load(Y_file, mmap_mode='r')
+
+def score_candidate(task):
+    # fit one C/gamma pair on the first n_samples training samples and score it
+    # on the validation block at the end of the arrays
+    C, gamma, n_samples, n_val, solver = task
+    n_train = search_X.shape[0] - n_val
+    X_val = np.asarray(search_X[n_train:], dtype=np.float32)
+    Y_val = np.asarray(search_Y[n_train:])
+
+    start_time = time.time()
+    if solver == "approx":
+        model = approx_svm_fit(search_X[:n_samples], np.asarray(search_Y[:n_samples]), gamma, C)
+        Y_predict, _ = approx_svm_predict(model, X_val)
+    else:
+        clf = svm.SVC(kernel='rbf', gamma=gamma, C=C)
+        clf.fit(np.asarray(search_X[:n_samples], dtype=np.float32), np.asarray(search_Y[:n_samples]))
+        Y_predict = clf.predict(X_val)
+
+    return dict(C=C, gamma=gamma, samples=n_samples, score=accuracy_score(Y_val, Y_predict),
+                fit_time=time.time() - start_time)
+
+def data_fingerprint(X_file, Y_file, n_rows=1000):
+    # sha1 of the shape, the labels and an evenly spaced sample of the rows,
+    # cheap enough for memory mapped arrays of millions of samples
+    X = np.load(X_file, mmap_mode='r')
+    Y = np.load(Y_file, mmap_mode='r')
+    rows = np.unique(np.linspace(0, X.shape[0] - 1, min(n_rows, X.shape[0])).astype(int))
+
+    digest = hashlib.sha1()
+    digest.update(str(X.shape).encode("utf-8"))
+    digest.update(np.ascontiguousarray(Y).tobytes())
+    digest.update(np.ascontiguousarray(X[rows]).tobytes())
+
+    return digest.hexdigest()
+
+def load_search_results(search_file, header):
+    # previous results keyed on (C, gamma, samples) so that a search can resume.
+    # The first line of the file is the header of the data, solver and features
+    # the results were scored with; a file with another header is discarded
+    # and started again with this one.
+    results = {}
+    if os.path.isfile(search_file):
+        with open(search_file) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if len(lines) > 0 and lines[0] == header:
+            for result in lines[1:]:
+                results[(result["C"], result["gamma"], result["samples"])] = result
+        else:
+            print "Discarding %s, it was scored on other data, solver or features" % search_file
+            os.remove(search_file)
+
+    if not os.path.isfile(search_file):
+        with open(search_file, "w") as f:
+            f.write(json.dumps(header, sort_keys=True) + "\n")
+
+    return results
+
+def successive_halving(X_file, Y_file, C_range, gamma_range, search_file, min_samples=500,
+                       eta=3, val_size=0.2, n_jobs=None, solver="exact", features="pixels"):
+    # every candidate is scored on a small subset, the best 1/eta of them move on
+    # to a subset eta times larger until one is left or the data runs out
+    n_total = np.load(X_file, mmap_mode='r').shape[0]
+    n_val = int(np.round(n_total*val_size))
+    n_train = n_total - n_val
+
+    candidates = [(float(C), float(gamma)) for C in C_range for gamma in gamma_range]
+    header = dict(fingerprint=data_fingerprint(X_file, Y_file), solver=solver, features=features,
+                  val_size=val_size)
+    results = load_search_results(search_file, header)
+    if len(results) > 0:
+        print "Resuming search, %d results loaded from %s" % (len(results), search_file)
+
+    pool = Pool(n_jobs or cpu_count(), initializer=init_search_worker, initargs=(X_file, Y_file))
+    n_samples = min(min_samples, n_train)
+    rung = 0
+
+    try:
+        while True:
+            tasks = [(C, gamma, n_samples, n_val, solver) for (C, gamma) in candidates
+                     if (C, gamma, n_samples) not in results]
+
+            print "Rung %d : %d candidates on %d samples (%d to fit)" % (rung, len(candidates),
+                                                                        n_samples, len(tasks))
+
+            # append each result as it arrives so an interrupted search loses little
+            with open(search_file, "a") as f:
+                for result in pool.imap_unordered(score_candidate, tasks):
+                    results[(result["C"], result["gamma"], result["samples"])] = result
+                    f.write(json.dumps(result) + "\n")
+                    f.flush()
+
+            scores = [results[(C, gamma, n_samples)]["score"] for (C, gamma) in candidates]
+            ranked = [candidates[i] for i in np.argsort(scores)[::-1]]
+
+            if len(candidates) == 1 or n_samples == n_train:
+                break
+
+            candidates = ranked[:max(1, int(len(candidates) // eta))]
+            n_samples = min(n_samples*eta, n_train)
+            rung += 1
+    finally:
+        pool.close()
+        pool.join()
+
+    best = results[ranked[0] + (n_samples,)]
+    return best, results
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+################################################################################
+# trace-run.py
+#
+# Runs one command of a shell pipeline and appends its wall and cpu seconds,
+# peak resident memory and storage traffic to the trace named by $GPR_TRACE,
+# passing its output through and exiting with its exit status. Works under
+# python 2 and 3, so it can wrap the gprMax stages inside the python 3
+# environment.
+################################################################################
+
+import argparse
+import sys
+from trace_methods import run_traced
+
+#   Usage:
+#
+#     trace-run.py -s <str> [-f <str>] -- <command> [arguments]
+#
+#   where
+#     --stage <str> this is the name of the pipeline stage, e.g. simulate
+#     -s
+#
+#     --file <str> optional, the file the command works on
+#     -f
+#
+
+parser = argparse.ArgumentParser(description='run a command and record it in the trace')
+
+parser.add_argument('-s', '--stage', required=True, dest='stage', action='store', help='name of the pipeline stage')
+
+parser.add_argument('-f', '--file', dest='file', default=None, action='store', help='file the command works on')
+
+parser.add_argument('command', nargs=argparse.REMAINDER, help='command to run, after --')
+
+args = parser.parse_args()
+
+command = args.command[1:] if args.command[:1] == ['--'] else args.command
+if len(command) == 0:
+    parser.error('no command given')
+
+sys.exit(run_traced(command, args.stage, args.file))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+################################################################################
+# trace-summary.py
+#
+# Summarises a JSON-lines trace written by trace_methods.py: the time, memory
+# and storage traffic of each stage, the share of the total each stage takes,
+# the slowest files, and the throughput and time left of stages with a known
+# number of files.
+################################################################################
+
+from __future__ import division
+import argparse
+import numpy as np
+import os, time
+from trace_methods import read_trace, TRACE_ENV
+
+#   Usage:
+#
+#     trace-summary.py [-i <str>] [-e <str>]
+#
+#   where
+#     --input <str> optional, the trace file ($GPR_TRACE)
+#     -i
+#
+#     --expected <str> optional, comma separated stage=files, the number of
+#     -e               files each stage will run on in total, for an ETA
+#
+#     --top <int> optional, number of slowest files listed (10)
+#     -t
+#
+
+parser = argparse.ArgumentParser(description='summarise a pipeline trace')
+
+parser.add_argument('-i', '--input', dest='input', default=os.environ.get(TRACE_ENV), action='store', help='trace file')
+
+parser.add_argument('-e', '--expected', dest='expected', default='', action='store', help='comma separated stage=files')
+
+parser.add_argument('-t', '--top', dest='top', default=10, type=int, action='store', help='number of slowest files listed')
+
+args = parser.parse_args()
+
+if args.input is None:
+    parser.error('no trace file, give --input or set $' + TRACE_ENV)
+
+records = read_trace(args.input)
+if len(records) == 0:
+    raise ValueError('no records in ' + args.input)
+
+def megabytes(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / (1024 * 1024) if len(values) > 0 else float('nan')
+
+# stages in the order they first appear
+stages = []
+for r in records:
+    if r["stage"] not in stages:
+        stages.append(r["stage"])
+
+total = sum(r["wall_s"] for r in records)
+span = max(r["end"] for r in records) - min(r["start"] for r in records)
+
+print "%d records, %.1f s of work in %.1f s elapsed" % (len(records), total, span)
+print ""
+print "stage                 runs  errors    total s  share   mean s    p95 s  cpu/wall  peak MB  read MB  write MB  files/h"
+summary = {}
+for stage in stages:
+    runs = [r for r in records if r["stage"] == stage]
+    walls = np.array([r["wall_s"] for r in runs])
+    ok = [r for r in runs if r.get("status") == "ok"]
+    first = min(r["start"] for r in runs)
+    last = max(r["end"] for r in runs)
+    # files finished per hour over the time the stage was running, which
+    # counts files that ran at once
+    rate = len(ok) / (last - first) * 3600 if last > first else float('nan')
+    summary[stage] = {"done": len(ok), "rate": rate, "last": last}
+
+    print "%-20s %5d  %6d  %9.1f  %4.1f%%  %7.2f  %7.2f  %8.2f  %7.1f  %7.1f  %8.1f  %7.1f" % (
+        stage[:20], len(runs), len(runs) - len(ok), walls.sum(), 100 * walls.sum() / total if total > 0 else 0,
+        walls.mean(), np.percentile(walls, 95), sum(r["cpu_s"] for r in runs) / max(walls.sum(), 1e-9),
+        max(r["peak_rss_mb"] for r in runs), megabytes(r.get("read_bytes") for r in runs),
+        megabytes(r.get("write_bytes") for r in runs), rate)
+
+print ""
+print "Slowest files"
+for r in sorted(records, key=lambda r: r["wall_s"], reverse=True)[:args.top]:
+    print "%9.1f s  %-20s %s%s" % (r["wall_s"], r["stage"][:20], r.get("file") or "-",
+                                   "" if r.get("status") == "ok" else "  (" + str(r.get("status")) + ")")
+
+expected = [item.split('=') for item in args.expected.split(',') if item != '']
+if len(expected) > 0:
+    print ""
+    print "stage                 done / total   files/h        left   finishes"
+for stage, files in expected:
+    files = int(files)
+    done = summary[stage]["done"] if stage in summary else 0
+    rate = summary[stage]["rate"] if stage in summary else float('nan')
+    if done >= files:
+        print "%-20s %5d / %-5d  %8.1f    finished" % (stage[:20], done, files, rate)
+    elif np.isnan(rate) or rate <= 0:
+        print "%-20s %5d / %-5d  %8s    unknown" % (stage[:20], done, files, "-")
+    else:
+        left = (files - done) / rate * 3600
+        finish = summary[stage]["last"] + left
+        print "%-20s %5d / %-5d  %8.1f  %8.1f h   %s" % (stage[:20], done, files, rate, left / 3600,
+                                                        time.strftime("%Y-%m-%d %H:%M", time.localtime(finish)))
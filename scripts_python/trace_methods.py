@@ -0,0 +1,186 @@
+################################################################################
+# trace_methods.py
+#
+# Timing and memory instrumentation for the pipeline. Each stage, or each file
+# of a stage, appends one JSON line to the trace named by $GPR_TRACE with its
+# wall and cpu seconds, peak resident memory and the bytes it read from and
+# wrote to storage. Nothing is recorded when $GPR_TRACE is not set. Works under
+# python 2 and 3, since the gprMax stages run inside the python 3 environment.
+################################################################################
+
+from __future__ import division
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TRACE_ENV = "GPR_TRACE"
+
+def trace_file():
+    return os.environ.get(TRACE_ENV) or None
+
+def script_name():
+    return os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+
+def rss_mb(kilobytes):
+    # ru_maxrss is in kilobytes on linux and in bytes on mac
+    return kilobytes / (1024 * 1024) if sys.platform == "darwin" else kilobytes / 1024
+
+def io_bytes():
+    # bytes this process has read from and written to storage, None where
+    # /proc is not available
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f.read().strip().split("\n"))
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+def record(**fields):
+    # append one record to the trace, locked so that processes running at once
+    # do not interleave their lines
+    filename = trace_file()
+    if filename is None:
+        return
+
+    fields.setdefault("host", socket.gethostname())
+    fields.setdefault("pid", os.getpid())
+    fields.setdefault("script", script_name())
+    line = json.dumps(fields, sort_keys=True) + "\n"
+    with open(filename, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+        f.flush()
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class Stage(object):
+    # with Stage("post_process", file=name): ... records the block. Peak memory
+    # is the peak of the whole process up to the end of the block.
+
+    def __init__(self, stage, file=None, **fields):
+        self.stage = stage
+        self.file = file
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.time()
+        times = os.times()
+        self.cpu = times[0] + times[1]
+        self.io = io_bytes()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if trace_file() is None:
+            return False
+
+        times = os.times()
+        read, written = io_bytes()
+        fields = dict(self.fields)
+        fields.update({"stage": self.stage,
+                       "file": self.file,
+                       "start": self.start,
+                       "end": time.time(),
+                       "wall_s": time.time() - self.start,
+                       "cpu_s": times[0] + times[1] - self.cpu,
+                       "peak_rss_mb": rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+                       "read_bytes": read - self.io[0] if read is not None else None,
+                       "write_bytes": written - self.io[1] if written is not None else None,
+                       "status": "ok" if kind is None else "error"})
+        if kind is not None:
+            fields["error"] = "%s: %s" % (kind.__name__, value)
+        record(**fields)
+
+        return False
+
+def run_traced(command, stage, file=None, cwd=None, log=None, watch=None, interval=1.0, group=True, **fields):
+    # run a command to completion with its output passed through, or written to
+    # the file log, and record it, returns its exit status. A string command is
+    # run by the shell. The child is reaped with os.wait4 for its own rusage,
+    # its storage traffic is counted in 512 byte blocks.
+    #
+    # watch, if given, is called with the process every interval seconds while
+    # it runs. When it returns a reason the command and everything it started
+    # are terminated, the reason is recorded as "killed". With group False the
+    # command stays in the group of the caller and only it is terminated, so
+    # that whoever signals the caller's group reaches it too.
+    shell = not isinstance(command, list)
+    output = open(log, "w") if log is not None else None
+    start = time.time()
+    killed = None
+    try:
+        process = subprocess.Popen(command, shell=shell, cwd=cwd, stdout=output,
+                                   stderr=subprocess.STDOUT if output is not None else None,
+                                   preexec_fn=os.setsid if watch is not None and group else None)
+        if watch is None:
+            _, status, usage = os.wait4(process.pid, 0)
+        else:
+            deadline = None
+            while True:
+                pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                if pid != 0:
+                    break
+                if killed is None:
+                    killed = watch(process)
+                    if killed:
+                        terminate(process.pid, signal.SIGTERM, group)
+                        deadline = time.time() + 10
+                elif time.time() > deadline:
+                    terminate(process.pid, signal.SIGKILL, group)
+                time.sleep(interval if killed is None else 0.1)
+    finally:
+        if output is not None:
+            output.close()
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    fields.update({"stage": stage,
+                   "file": file,
+                   "command": command if shell else " ".join(command),
+                   "start": start,
+                   "end": time.time(),
+                   "wall_s": time.time() - start,
+                   "cpu_s": usage.ru_utime + usage.ru_stime,
+                   "peak_rss_mb": rss_mb(usage.ru_maxrss),
+                   "read_bytes": usage.ru_inblock * 512,
+                   "write_bytes": usage.ru_oublock * 512,
+                   "returncode": process.returncode,
+                   "status": "ok" if process.returncode == 0 and not killed else "error"})
+    if killed:
+        fields["killed"] = killed
+        if process.returncode == 0:
+            process.returncode = -signal.SIGTERM
+    record(**fields)
+
+    return process.returncode
+
+def terminate(pid, signum, group=True):
+    # signal pid, or the process group that it leads
+    try:
+        if group:
+            os.killpg(pid, signum)
+        else:
+            os.kill(pid, signum)
+    except OSError:
+        pass
+
+def read_trace(filename):
+    # records of a trace, skipping a line cut short by an interrupted writer
+    records = []
+    with open(filename) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
@@ -5,13 +5,15 @@
 #
 # This python script splits the training and test images in to two
 # separate directories by splitting a list of images and moving their
-# directories
+# directories. The radargrams of the receivers of one scene, <name>.rx1.png to
+# <name>.rxN.png, all go to the same one of train, validation and test
 ################################################################################
 
 from sklearn.cross_validation import train_test_split
 import os
 import shutil
 import argparse
+from split_methods import split_by_scene
 
 #   Usage:
 #
@@ -48,12 +50,12 @@ for file in os.listdir(dataDir):
     if file.endswith(".png"):
         imagelist.append(file)
 
-#  Split radargram images into lists for entry into train/test directories (75/25% train/test split)
+#  Split radargram images into lists for entry into train/test directories (75/25% train/test split), by scene
 all_train, test_list = \
-    train_test_split(imagelist, test_size=0.25)
+    split_by_scene(train_test_split, imagelist, test_size=0.25)
 
 train_list, val_list = \
-    train_test_split(all_train, test_size=0.25)
+    split_by_scene(train_test_split, all_train, test_size=0.25)
 
 # create directories for train and test data
 os.chdir(outputDir)
@@ -4,7 +4,8 @@
 # train-test-split-files.py
 #
 # This python script splits the training and test png files in to two
-# separate numpy files
+# separate numpy files. The radargrams of the receivers of one scene,
+# <name>.rx1.png to <name>.rxN.png, all go to the same side of the split
 ################################################################################
 
 from __future__ import division
@@ -15,6 +16,7 @@ import shutil
 import argparse
 import matplotlib.pyplot as plt
 import cv2
+from split_methods import split_by_scene
 
 #   Usage:
 #
@@ -49,9 +51,9 @@ for file in os.listdir(dataDir):
     if "with" in file and file.endswith(".png"):
         imagelist.append(file)
 
-##  Split radargram and mine .png lists in to train/test directories
+##  Split radargram and mine .png lists in to train/test directories, by scene
 train_list, test_list = \
-    train_test_split(imagelist, test_size=0.25)
+    split_by_scene(train_test_split, imagelist, test_size=0.25)
 
 def save_data(data_list, data_type):
     print data_type+" progress : "
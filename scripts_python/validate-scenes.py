@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+################################################################################
+# validate-scenes.py
+#
+# Checks every .in scene of a directory before it is simulated (scene_methods)
+# and prints what is wrong with each. With --repair the clutter that is out of
+# the domain, in the PML or on the landmine is dropped from the scene, which is
+# rewritten in place. A scene that cannot be repaired is rejected, and with
+# --reject it is moved to a directory together with its _minepos.csv and a
+# {stem}.rejected file of the reasons, as simulation-watchdog.py writes for the
+# scenes it stops, so that it is never queued. The exit status is 1 while a
+# bad scene is left in place. Run it between gpr-gen-new.py and the
+# simulations, e.g.
+#
+#   validate-scenes.py -i data/stage1 -n 95 --repair --reject data/rejected
+#
+# Works under python 2 and 3.
+################################################################################
+
+from __future__ import print_function
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+from scene_methods import Scene, validate, repaired_lines
+from stream_methods import mark
+from dag_methods import expand, item_variables
+
+#   Usage:
+#
+#     validate-scenes.py -i <str> [-n <int>] [--repair] [--reject <str>]
+#
+#   where
+#     --input <str> this is the directory of .in files or a glob of the files,
+#     -i            quoted for the shell
+#
+#     --traces <int> optional, traces of each B-scan, -n of gprMax, which set
+#     -n             how far the antenna moves (#analysis of gprMax 2 or 1)
+#
+#     --repair optional, drop the clutter that is out of place
+#
+#     --reject <str> optional, directory the scenes that cannot be repaired
+#                    are moved to
+#
+#     --pml-cells <int> optional, PML cells on each side, instead of those of
+#                       the scene or 10
+#
+#     --mark <str> optional, marker written for each scene that passes, e.g.
+#     -m           "{dir}/{stem}.valid" for the simulate stream-worker.py
+#
+#     --report <str> optional, JSON file of the problems of each scene
+#
+
+parser = argparse.ArgumentParser(description='check gprMax scenes before they are simulated')
+
+parser.add_argument('-i', '--input', required=True, dest='input', action='store', help='directory or glob of .in files')
+
+parser.add_argument('-n', '--traces', dest='traces', default=None, type=int, action='store', help='traces of each B-scan')
+
+parser.add_argument('--repair', dest='repair', default=False, action='store_true', help='drop the clutter that is out of place')
+
+parser.add_argument('--reject', dest='reject', default=None, action='store', help='directory the bad scenes are moved to')
+
+parser.add_argument('--pml-cells', dest='pml_cells', default=None, type=int, action='store', help='PML cells on each side')
+
+parser.add_argument('-m', '--mark', dest='mark', default=None, action='store', help='marker written for each scene that passes')
+
+parser.add_argument('--report', dest='report', default=None, action='store', help='JSON file of the problems of each scene')
+
+args = parser.parse_args()
+
+pattern = os.path.join(args.input, "*.in") if os.path.isdir(args.input) else args.input
+filenames = sorted(glob.glob(pattern))
+
+if args.reject is not None and not os.path.isdir(args.reject):
+    os.makedirs(args.reject)
+
+report = {}
+counts = {"valid": 0, "repaired": 0, "rejected": 0, "bad": 0}
+for filename in filenames:
+    scene = Scene(filename)
+    problems = validate(scene, args.traces, args.pml_cells)
+    reasons = [reason for number, reason, repairable in problems]
+
+    if not problems:
+        status = "valid"
+    elif args.repair and all(repairable for number, reason, repairable in problems):
+        dropped = len(set(number for number, reason, repairable in problems))
+        mark(filename, "".join(repaired_lines(scene, problems, "validate-scenes.py dropped %d objects" % dropped)))
+        status = "repaired"
+    elif args.reject is not None:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        for moved in [filename, os.path.splitext(filename)[0] + "_minepos.csv"]:
+            if os.path.exists(moved):
+                shutil.move(moved, os.path.join(args.reject, os.path.basename(moved)))
+        reason = [reason for number, reason, repairable in problems if not repairable or not args.repair][0]
+        mark(os.path.join(args.reject, stem + ".rejected"),
+             json.dumps({"input": filename, "reason": reason, "reasons": reasons}) + "\n")
+        status = "rejected"
+    else:
+        status = "bad"
+
+    counts[status] += 1
+    report[filename] = {"status": status, "problems": reasons}
+    if problems:
+        print("%s %s" % (os.path.basename(filename), status))
+        for reason in reasons:
+            print("    " + reason)
+    if status in ("valid", "repaired") and args.mark:
+        mark(expand(args.mark, item_variables(filename)))
+
+print("%d scenes: %d valid, %d repaired, %d rejected, %d bad" % (len(filenames), counts["valid"], counts["repaired"],
+                                                                 counts["rejected"], counts["bad"]))
+
+if args.report is not None:
+    mark(args.report, json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+sys.exit(1 if counts["bad"] else 0)
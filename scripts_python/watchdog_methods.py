@@ -0,0 +1,133 @@
+################################################################################
+# watchdog_methods.py
+#
+# Checks of the traces of a gprMax B-scan while it is simulated. gprMax run
+# with -n writes one output file per trace, {stem}1.out, {stem}2.out, ..., and
+# a trace is checked once the file of the next one appears, or once the run
+# has ended. A trace is bad when
+#
+#   it holds NaN or Inf
+#   its peak is zero, above max_peak, or growing_peak times the peak of the
+#   first trace
+#   the mean power of its last tail of samples is above tail_ratio times the
+#   mean power of the direct wave in its first direct of samples, the late
+#   time growth of an unstable simulation
+#   its correlation with the previous trace is below min_similarity, as
+#   neighbouring traces of a B-scan look alike
+#
+# and the watchdog then reports why, so that the run can be stopped a few
+# traces in instead of after all of them. Works under python 2 and 3.
+################################################################################
+
+from __future__ import division
+import os
+import numpy as np
+import h5py
+
+# exit status of a simulation stopped by the watchdog
+ABORTED = 3
+
+DEFAULTS = {"max_peak": 1e6,
+            "growing_peak": 100.0,
+            "direct": 0.2,
+            "tail": 0.1,
+            "tail_ratio": 1.0,
+            "min_similarity": 0.3}
+
+def trace_file(stem, number, traces=2):
+    # gprMax numbers the outputs of a run of more than one trace
+    return "%s%d.out" % (stem, number) if traces > 1 else stem + ".out"
+
+def read_trace(filename, field="Ez", rx="rx1"):
+    # the field at the receiver of a trace file, None if it cannot be read
+    try:
+        with h5py.File(filename, 'r') as f:
+            return np.asarray(f['/rxs/' + rx + '/' + field], dtype=np.float64)
+    except (IOError, OSError, KeyError):
+        return None
+
+def power(ascan):
+    return float(np.mean(ascan**2)) if len(ascan) else 0.0
+
+def similarity(a, b):
+    # correlation of two traces, 1 for traces alike up to scale
+    a = a - a.mean()
+    b = b - b.mean()
+    norm = np.sqrt(np.sum(a**2) * np.sum(b**2))
+
+    return float(np.sum(a * b) / norm) if norm > 0 else 0.0
+
+def check_trace(ascan, first_peak=None, previous=None, limits=DEFAULTS):
+    # reason the trace is bad, or None
+    if not np.all(np.isfinite(ascan)):
+        return "NaN or Inf in the field"
+
+    peak = float(np.max(np.abs(ascan)))
+    if peak == 0:
+        return "no field at the receiver"
+    if peak > limits["max_peak"]:
+        return "peak %.3g above %.3g" % (peak, limits["max_peak"])
+    if first_peak and peak > limits["growing_peak"] * first_peak:
+        return "peak %.3g is %.0f times the first trace's" % (peak, peak / first_peak)
+
+    direct = power(ascan[:max(1, int(len(ascan) * limits["direct"]))])
+    tail = power(ascan[-max(1, int(len(ascan) * limits["tail"])):])
+    if direct > 0 and tail > limits["tail_ratio"] * direct:
+        return "late time power %.3g times the direct wave's" % (tail / direct)
+
+    if previous is not None and len(previous) == len(ascan):
+        correlation = similarity(ascan, previous)
+        if correlation < limits["min_similarity"]:
+            return "correlation %.2f with the previous trace" % correlation
+
+    return None
+
+class TraceWatchdog(object):
+    # watch for trace_methods.run_traced of a gprMax run writing the traces
+    # {stem}1.out to {stem}{traces}.out, returns the reason once a trace is bad
+
+    def __init__(self, stem, traces, field="Ez", rx="rx1", limits=None):
+        self.stem = stem
+        self.traces = traces
+        self.field = field
+        self.rx = rx
+        self.limits = dict(DEFAULTS)
+        self.limits.update(limits or {})
+        self.checked = 0
+        self.first_peak = None
+        self.previous = None
+        self.reason = None
+
+    def _check(self, number):
+        ascan = read_trace(trace_file(self.stem, number, self.traces), self.field, self.rx)
+        if ascan is None:
+            return "trace %d cannot be read" % number
+        reason = check_trace(ascan, self.first_peak, self.previous, self.limits)
+        if self.first_peak is None and reason is None:
+            self.first_peak = float(np.max(np.abs(ascan)))
+        self.previous = ascan
+
+        return None if reason is None else "trace %d: %s" % (number, reason)
+
+    def check(self, ended=False):
+        # check the traces written since the last call, those of which the
+        # next trace exists, or all of them once the run has ended
+        while self.reason is None and self.checked < self.traces:
+            number = self.checked + 1
+            if not ended and (self.traces == 1 or not os.path.exists(trace_file(self.stem, number + 1, self.traces))):
+                break
+            if ended and not os.path.exists(trace_file(self.stem, number, self.traces)):
+                break
+            self.reason = self._check(number)
+            self.checked = number
+
+        return self.reason
+
+    def __call__(self, process):
+        return self.check()
+
+    def written(self):
+        # trace files of the run on disk
+        files = [trace_file(self.stem, n, self.traces) for n in range(1, self.traces + 1)]
+
+        return [f for f in files if os.path.exists(f)]